@@ -0,0 +1,72 @@
+# ============LICENSE_START====================================================
+# org.onap.dcaegen2
+# =============================================================================
+# Copyright (c) 2021 AT&T Intellectual Property. All rights reserved.
+# =============================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END======================================================
+
+# Import time of the plugin's operation modules.
+# Run with "tox -e benchmark" (or "pytest benchmarks" with pytest-benchmark installed).
+# No network is available during the benchmark: importing the plugin must not talk to
+# Consul or the bus controller.  Only the plugin's own modules are reloaded for each round.
+
+import importlib
+import socket
+import sys
+
+import pytest
+
+PLUGIN_PACKAGES = ('dmaapplugin', 'consulif', 'dmaapcontrollerif')
+OPERATION_MODULES = ('dmaapplugin.dr_lifecycle', 'dmaapplugin.dr_relationships', 'dmaapplugin.dr_bridge',
+                     'dmaapplugin.mr_lifecycle', 'dmaapplugin.mr_relationships')
+
+
+def _plugin_module_names():
+    return [name for name in sys.modules if name.split('.')[0] in PLUGIN_PACKAGES]
+
+
+def _unload_plugin():
+    for name in _plugin_module_names():
+        del sys.modules[name]
+
+
+def _import_plugin():
+    for name in OPERATION_MODULES:
+        importlib.import_module(name)
+
+
+@pytest.fixture()
+def no_network(monkeypatch):
+    attempts = []
+
+    def connect(self, address):
+        attempts.append(address)
+        raise socket.error('No network while importing the plugin')
+
+    monkeypatch.setattr(socket.socket, 'connect', connect)
+    return attempts
+
+
+@pytest.fixture()
+def restore_plugin():
+    saved = dict((name, sys.modules[name]) for name in _plugin_module_names())
+    yield
+    _unload_plugin()
+    sys.modules.update(saved)
+
+
+def test_import_plugin(benchmark, no_network, restore_plugin):
+    benchmark.pedantic(_import_plugin, setup=_unload_plugin, rounds=20)
+    benchmark.extra_info['connections'] = len(no_network)
+    assert no_network == []
@@ -19,23 +19,111 @@
 
 import consul
 import json
+import random
+import threading
+import time
+import requests
 try:
     from urllib.parse import urlparse
 except ImportError:
     from urlparse import urlparse
 
+# Maximum number of keep-alive HTTP connections kept per Consul host
+CONSUL_POOL_SIZE = 10
+# Timeouts (secs) for connecting to Consul and for reading a response
+CONSUL_CONNECT_TIMEOUT = 5
+CONSUL_READ_TIMEOUT = 30
+# Check-and-set updates: maximum number of tries, and the bounds (secs) of the
+# exponential backoff between tries
+CAS_MAX_ATTEMPTS = 20
+CAS_BASE_DELAY = 0.05
+CAS_MAX_DELAY = 2.0
+
+
+class ConsulConflictError(RuntimeError):
+    '''
+    A check-and-set update kept losing out to concurrent updates of the same key
+    '''
+    pass
+
+
+class _TimeoutSession(requests.Session):
+    '''
+    requests Session that applies a default timeout to every request
+    '''
+
+    def __init__(self, timeout):
+        super(_TimeoutSession, self).__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super(_TimeoutSession, self).request(*args, **kwargs)
+
+
+# Process-wide cache of Consul clients, keyed by (scheme, host, port, pool size, timeouts)
+_consul_clients = {}
+_consul_clients_lock = threading.Lock()
+
+
+def _consul_client(scheme, hostname, port, pool_size=None, connect_timeout=None, read_timeout=None):
+    '''
+    Get the shared Consul client for scheme://hostname:port, creating it if needed.
+    The client's requests session keeps up to pool_size connections to Consul alive
+    for reuse, so each Consul operation doesn't have to set up a new TCP connection.
+    pool_size, connect_timeout and read_timeout default to CONSUL_POOL_SIZE,
+    CONSUL_CONNECT_TIMEOUT and CONSUL_READ_TIMEOUT.
+    It's safe to use the client from several threads at once.
+    '''
+    pool_size = pool_size or CONSUL_POOL_SIZE
+    timeout = (connect_timeout or CONSUL_CONNECT_TIMEOUT, read_timeout or CONSUL_READ_TIMEOUT)
+    key = (scheme, hostname, port, pool_size, timeout)
+    with _consul_clients_lock:
+        ch = _consul_clients.get(key)
+        if ch is None:
+            ch = consul.Consul(host=hostname, port=port, scheme=scheme)
+            session = _TimeoutSession(timeout)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            ch.http.session = session
+            _consul_clients[key] = ch
+        return ch
+
+
+# Contention counters for check-and-set updates in this process
+_cas_counters = {"updates": 0, "attempts": 0, "conflicts": 0, "failures": 0, "backoff_time": 0.0}
+_cas_counters_lock = threading.Lock()
+
+
+def _count_cas(**increments):
+    with _cas_counters_lock:
+        for counter, increment in increments.items():
+            _cas_counters[counter] += increment
+
+
+def cas_stats():
+    '''
+    Report the check-and-set counters: updates made, attempts, conflicts with
+    concurrent updates, updates that gave up, and total time spent backing off
+    '''
+    with _cas_counters_lock:
+        return dict(_cas_counters)
+
 
 class ConsulHandle(object):
     '''
     Provide access to Consul KV store and service discovery
     '''
 
-    def __init__(self, api_url, user, password, logger):
+    def __init__(self, api_url, user, password, logger, pool_size=None, connect_timeout=None, read_timeout=None):
         '''
         Constructor
+        pool_size, connect_timeout and read_timeout override CONSUL_POOL_SIZE,
+        CONSUL_CONNECT_TIMEOUT and CONSUL_READ_TIMEOUT for the connection to Consul.
         '''
         u = urlparse(api_url)
-        self.ch = consul.Consul(host=u.hostname, port=u.port, scheme=u.scheme)
+        self.ch = _consul_client(u.scheme, u.hostname, u.port, pool_size, connect_timeout, read_timeout)
 
     def get_config(self, key):
         '''
@@ -80,10 +168,50 @@ class ConsulHandle(object):
         '{"feed00": {"feed_url" : "http://example.com/feeds/999"}, "topic00" : {"topic_url" : "http://example.com/topics/1229"}}'
         '''
 
-        while True:     # do until update succeeds
+        self.add_many_to_entry(key, {add_name: add_value})
+
+    def add_many_to_entry(self, key, entries):
+        '''
+        Like add_to_entry, but add all of the name/value pairs in the dict 'entries' with one update
+        '''
+        return self._cas_update(key, lambda v: v.update(entries))
+
+    def delete_from_entry(self, key, delete_name):
+        '''
+        Find 'key' in consul.
+        Treat its value as a JSON string representing a dict.
+        Remove the entry with key 'delete_name' from the dict, and store the result back into Consul under 'key'.
+        When there's nothing left in the dict, delete 'key' altogether.
+        Like add_to_entry, watch out for conflicting concurrent updates.
+        Quietly does nothing if 'key' or 'delete_name' isn't there.
+        '''
+        return self.delete_many_from_entry(key, [delete_name])
+
+    def delete_many_from_entry(self, key, delete_names):
+        '''
+        Like delete_from_entry, but remove all of the names in 'delete_names' with one update
+        '''
+        def update(v):
+            for name in delete_names:
+                v.pop(name, None)
+        return self._cas_update(key, update, delete_empty=True)
+
+    def _cas_update(self, key, update, max_attempts=CAS_MAX_ATTEMPTS,
+                    base_delay=CAS_BASE_DELAY, max_delay=CAS_MAX_DELAY, delete_empty=False):
+        '''
+        Update the JSON dict stored under 'key' with a check-and-set write.
+        update(v) changes the dict v.  When another writer changes the key first, we wait a
+        random time (up to an exponentially growing bound) and try again, at most max_attempts times.
+        With delete_empty, a key whose dict ends up empty is deleted (also with a check-and-set),
+        and a key that doesn't exist is left alone.
+        Returns the updated dict.  Raises ConsulConflictError if every attempt conflicted.
+        '''
+        for attempt in range(1, max_attempts + 1):
             (index, val) = self.ch.kv.get(key)     # index gives version of key retrieved
 
-            if val is None:     # no key yet
+            if val is None and delete_empty:
+                return {}
+            elif val is None:     # no key yet
                 vstring = '{}'
                 mod_index = 0   # Use 0 as the cas index for initial insertion of the key
             else:
@@ -93,12 +221,27 @@ class ConsulHandle(object):
             # Build the updated dict
             # Exceptions just propagate
             v = json.loads(vstring)
-            v[add_name] = add_value
-            new_vstring = json.dumps(v)
+            update(v)
+            if val is not None and v == json.loads(vstring):
+                # Nothing changed, so don't bother the key's watchers with a write
+                return v
 
-            updated = self.ch.kv.put(key, new_vstring, cas=mod_index)       # if the key has changed since retrieval, this will return false
+            if delete_empty and not v:
+                updated = self.ch.kv.delete(key, cas=mod_index)             # likewise false if the key has changed
+            else:
+                updated = self.ch.kv.put(key, json.dumps(v), cas=mod_index) # if the key has changed since retrieval, this will return false
             if updated:
-                break
+                _count_cas(updates=1, attempts=attempt, conflicts=attempt - 1)
+                return v
+
+            if attempt < max_attempts:
+                # "Full jitter" backoff
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+                _count_cas(backoff_time=delay)
+                time.sleep(delay)
+
+        _count_cas(attempts=max_attempts, conflicts=max_attempts, failures=1)
+        raise ConsulConflictError('Could not update "{0}": still conflicting after {1} attempts'.format(key, max_attempts))
 
 
     def delete_entry(self,entry_name):
@@ -109,17 +252,7 @@ class ConsulHandle(object):
         whether there's an entry with key 'entry_name' exists or not.  This doesn't seem like
         a great design, but it means it's safe to try to delete the same entry repeatedly.
 
-        Note also in our application for this plugin, the uninstall workflow will always delete all of the topics and
-        feeds we've stored into the 'component_name:dmaap' entry.
-
-        Given the two foregoing notes, it is safe for this plugin to attempt to delete the entire
-        'component_name:dmaap' entry any time it performs an 'unlink' operation for a publishes or
-        subscribes relationship.   The first unlink will actually remove the entry, the subsequent ones
-        will harmlessly try to remove it again.
-
-        The 'correct' approach would be to have a delete_from_entry(self, key, delete_name) that fetches
-        the entry from Consul, removes only the topic or feed being unlinked, and then puts the resulting
-        entry back into Consul.  It would be very similar to add_from_entry.  When there's nothing left
-        in the entry, then the entire entry would be deleted.
+        To remove just some of the names from a 'component_name:dmaap' entry, use delete_from_entry
+        or delete_many_from_entry, which delete the whole entry once it is empty.
         '''
         self.ch.kv.delete(entry_name)
@@ -18,7 +18,18 @@
 # limitations under the License.
 # ============LICENSE_END======================================================
 
+import bisect
+import codecs
+import json
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
 
 ### "Constants"
 FEEDS_PATH = '/feeds'
@@ -28,6 +39,263 @@ TOPICS_PATH = '/topics'
 CLIENTS_PATH = '/mr_clients'
 LOCATIONS_PATH = '/dcaeLocations'
 
+# Connections to the bus controller
+POOL_SIZE = 10              # maximum number of keep-alive connections kept for reuse
+CONNECT_TIMEOUT = 5         # secs
+READ_TIMEOUT = 60           # secs
+RETRIES = 3                 # retries for failed GET and DELETE requests (POSTs are never retried)
+RETRY_BACKOFF_FACTOR = 0.5  # secs; retries wait 0.5, 1, 2, ... secs
+RETRY_STATUSES = (502, 503, 504)
+
+# Lookups by name
+NAME_INDEX_TTL = 300        # secs a name->id mapping is remembered after it was last seen
+STREAM_CHUNK_SIZE = 65536   # bytes read at a time when scanning a collection
+# Request logging
+LOG_BODY_MAX = 1000         # characters of a request or response body that go into the log
+LOG_SAMPLE_EVERY = 10       # only one in this many successful GETs to an endpoint is logged
+LOG_REDACTED_KEYS = ('password', 'userpw', 'secret', 'token')  # body keys containing these are redacted
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # secs, upper bounds of the histogram buckets
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _retry(retries, backoff_factor):
+    kwargs = dict(total=retries, connect=retries, read=retries, status=retries,
+                  backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                  raise_on_status=False)
+    methods = frozenset(['GET', 'HEAD', 'OPTIONS', 'DELETE'])
+    try:
+        return Retry(allowed_methods=methods, **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=methods, **kwargs)
+
+
+def get_session(pool_size=POOL_SIZE, retries=RETRIES, backoff_factor=RETRY_BACKOFF_FACTOR):
+    '''
+    Get the requests Session shared by all of the DMaaPControllerHandles in this process
+    that use the same pool_size, retries and backoff_factor.
+    The session keeps up to pool_size connections to each host alive, so consecutive
+    requests to the bus controller don't each need a new TCP connection and TLS handshake.
+    Idempotent requests (GET and DELETE) that fail to connect, time out, or get a 502, 503
+    or 504 response are retried, up to 'retries' times, with exponential backoff.
+    '''
+    key = (pool_size, retries, backoff_factor)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                  max_retries=_retry(retries, backoff_factor))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+        return session
+
+class _NameIndex(object):
+    '''
+    Remembers the ids of the feeds and topics found by name, so that looking up the same
+    name again doesn't need another scan of the whole collection.  Shared by all of the
+    handles in the process (each operation makes its own handle).
+    An entry expires 'ttl' secs after it was last seen in a response from the bus controller.
+    The ids are only hints: the handle gets the item by id before using it (see _get_indexed()).
+    '''
+
+    def __init__(self, ttl=NAME_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}      # (collection URL, name) -> (id, expiry time)
+
+    def get(self, collection_url, name):
+        with self._lock:
+            entry = self._entries.get((collection_url, name))
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self._entries[(collection_url, name)]
+                return None
+            return entry[0]
+
+    def add(self, collection_url, name, id):
+        with self._lock:
+            self._entries[(collection_url, name)] = (id, time.time() + self.ttl)
+
+    def discard(self, collection_url, name=None, id=None):
+        ''' Forget the entries in the collection with the given name or id '''
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if key[0] == collection_url and (key[1] == name or entry[0] == id):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_name_index = _NameIndex()
+
+
+def _endpoint(method, path):
+    '''
+    The endpoint a request is counted under: the method and the path, with the query
+    string dropped and everything after the collection replaced by "{id}"
+    '''
+    segments = path.split('?', 1)[0].strip('/').split('/')
+    return '{0} /{1}'.format(method, '/'.join(segments[:1] + ['{id}'] * (len(segments) - 1)))
+
+
+def _redact(value):
+    '''
+    Copy the JSON value 'value', replacing the values of keys that look like they hold secrets
+    '''
+    if isinstance(value, dict):
+        return dict((k, '********' if any(r in str(k).lower() for r in LOG_REDACTED_KEYS) else _redact(v))
+                    for k, v in value.items())
+    if isinstance(value, list):
+        return [_redact(v) for v in value]
+    return value
+
+
+def _truncate(text):
+    if len(text) <= LOG_BODY_MAX:
+        return text
+    return '{0}... ({1} characters in all)'.format(text[:LOG_BODY_MAX], len(text))
+
+
+class _LogBody(object):
+    '''
+    A JSON body to pass as an argument to the logger.  It's only formatted if the message
+    is actually logged, and then with secrets redacted and cut to LOG_BODY_MAX characters.
+    '''
+
+    def __init__(self, body):
+        self.body = body
+
+    def __str__(self):
+        return _truncate(json.dumps(_redact(self.body), sort_keys=True, default=str))
+
+
+class _LogResponse(object):
+    '''
+    Like _LogBody, for the body of a response
+    '''
+
+    def __init__(self, response):
+        self.response = response
+
+    def __str__(self):
+        try:
+            return str(_LogBody(self.response.json()))
+        except Exception:
+            pass
+        try:
+            return _truncate(self.response.text)
+        except Exception:
+            return ''
+
+
+class _LatencyHistograms(object):
+    '''
+    Histograms of the time taken by the requests this process makes to the bus controller,
+    one per endpoint (see _endpoint())
+    '''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms = {}   # endpoint -> [count, total secs, max secs, bucket counts]
+
+    def record(self, endpoint, elapsed):
+        '''
+        Count a request to 'endpoint' that took 'elapsed' secs.
+        Returns the number of requests to the endpoint so far.
+        '''
+        with self._lock:
+            h = self._histograms.get(endpoint)
+            if h is None:
+                h = self._histograms[endpoint] = [0, 0.0, 0.0, [0] * (len(self.buckets) + 1)]
+            h[0] += 1
+            h[1] += elapsed
+            h[2] = max(h[2], elapsed)
+            h[3][bisect.bisect_left(self.buckets, elapsed)] += 1
+            return h[0]
+
+    def stats(self):
+        labels = [str(b) for b in self.buckets] + ['+Inf']
+        with self._lock:
+            return dict((endpoint, {'count': h[0], 'total': h[1], 'max': h[2], 'buckets': dict(zip(labels, h[3]))})
+                        for endpoint, h in self._histograms.items())
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+_latencies = _LatencyHistograms()
+
+
+def latency_stats():
+    '''
+    Get the latency histograms of the requests this process has made to the bus controller.
+    Returns a dict mapping each endpoint, such as "GET /feeds/{id}", to its request count,
+    total and maximum time (in secs), and the number of requests in each bucket, keyed by
+    the bucket's upper bound.
+    '''
+    return _latencies.stats()
+
+
+def _iter_json_array(response, chunk_size=STREAM_CHUNK_SIZE):
+    '''
+    Parse the body of the streamed response 'response', which is a JSON array,
+    yielding each element of the array as soon as it has been read.
+    The caller can stop early, leaving the rest of the body unread.
+    '''
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = response.iter_content(chunk_size=chunk_size)
+    buf = ''
+    pos = 0
+    started = False
+    exhausted = False
+    while True:
+        # Skip whitespace and the punctuation between elements
+        while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ',')):
+            pos += 1
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError("Expected a JSON array, got: {0}".format(buf[pos:pos + 50]))
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if exhausted:
+                    raise
+                end = None
+            # An element that runs to the end of what's been read so far may be incomplete
+            if end is not None and (end < len(buf) or exhausted):
+                yield element
+                pos = end
+                continue
+        elif exhausted:
+            raise ValueError("Unexpected end of JSON array")
+
+        # Read some more
+        buf = buf[pos:]
+        pos = 0
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buf += text_decoder.decode(b'', final=True)
+        else:
+            buf += text_decoder.decode(chunk)
+
+
 class DMaaPControllerHandle(object):
     '''
     A simple wrapper class to map DMaaP bus controller API calls into operations supported by the requests module
@@ -38,9 +306,14 @@ class DMaaPControllerHandle(object):
                  pubs_path = PUBS_PATH,
                  subs_path = SUBS_PATH,
                  topics_path = TOPICS_PATH,
-                 clients_path = CLIENTS_PATH):
+                 clients_path = CLIENTS_PATH,
+                 session = None,
+                 timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)):
         '''
         Constructor
+        session: requests Session to send requests with.  By default, the session shared by
+        the process (see get_session()).
+        timeout: (connect timeout, read timeout), in secs, for each request
         '''
         self.api_url = api_url        # URL for the root of the Controller resource tree, no trailing "/"
         self.auth = (user, password)  # user name and password for HTTP basic auth
@@ -50,6 +323,10 @@ class DMaaPControllerHandle(object):
         self.subs_path = subs_path
         self.topics_path = topics_path
         self.clients_path = clients_path
+        self.session = session or get_session()
+        self.timeout = timeout
+        self._locations_lock = threading.Lock()
+        self._location_index = None   # DCAE location names by (dcaeLayer, status), once fetched
 
 
     ### INTERNAL FUNCTIONS ###
@@ -63,30 +340,102 @@ class DMaaPControllerHandle(object):
 
         return self.api_url + path
 
-    def _get_resource(self, path):
+    def _request(self, method, path, send, body=None):
         '''
-        Get the DMaaP resource at path, where path is relative to the root.
+        Make the request 'method' to path (relative to the root) with send(url), logging it and
+        counting it in the latency histograms.
+        Bodies are only logged with failures (Cloudify's ctx.logger logs at debug level, so
+        logging them at debug level would still format every one), without secrets and cut short.
+        Successful GETs are logged one in LOG_SAMPLE_EVERY times for each endpoint.
         '''
         url = self._make_url(path)
-        self.logger.info("Querying URL: {0}".format(url))
-        return requests.get(url, auth=self.auth)
+        endpoint = _endpoint(method, path)
+
+        start = time.time()
+        try:
+            r = send(url)
+        except Exception as e:
+            elapsed = time.time() - start
+            _latencies.record(endpoint, elapsed)
+            if body is not None:
+                self.logger.info("%s %s with body %s failed after %.3f secs: %s", method, url, _LogBody(body), elapsed, e)
+            else:
+                self.logger.info("%s %s failed after %.3f secs: %s", method, url, elapsed, e)
+            raise
+        elapsed = time.time() - start
+        count = _latencies.record(endpoint, elapsed)
+
+        if r.status_code >= 400:
+            if body is not None:
+                self.logger.info("%s %s with body %s returned %s in %.3f secs: %s",
+                                 method, url, _LogBody(body), r.status_code, elapsed, _LogResponse(r))
+            else:
+                self.logger.info("%s %s returned %s in %.3f secs: %s", method, url, r.status_code, elapsed, _LogResponse(r))
+        elif method != 'GET' or (count - 1) % LOG_SAMPLE_EVERY == 0:
+            self.logger.info("%s %s returned %s in %.3f secs", method, url, r.status_code, elapsed)
+        return r
+
+    def _get_resource(self, path, stream=False):
+        '''
+        Get the DMaaP resource at path, where path is relative to the root.
+        If stream is True, the body isn't read until the caller reads it.
+        '''
+        if stream:
+            return self._request('GET', path, lambda url: self.session.get(url, auth=self.auth, timeout=self.timeout, stream=True))
+        return self._request('GET', path, lambda url: self.session.get(url, auth=self.auth, timeout=self.timeout))
+
+    def _find_id_by_name(self, collection_path, query, name_key, id_key, name):
+        '''
+        Scan the collection at collection_path (with the query string 'query'), for an item
+        whose name_key is 'name', and return its id_key, or None if there isn't one.
+        The collection is parsed as it arrives, and the scan stops at the first match.
+        The names and ids of all of the items scanned go into the name index.
+        '''
+        collection_url = self._make_url(collection_path)
+        r = self._get_resource(collection_path + query, stream=True)
+        try:
+            r.raise_for_status()
+            for item in _iter_json_array(r):
+                if name_key in item and id_key in item:
+                    _name_index.add(collection_url, item[name_key], item[id_key])
+                    if item[name_key] == name:
+                        return item[id_key]
+            return None
+        finally:
+            r.close()
+
+    def _get_indexed(self, collection_path, name):
+        '''
+        Look up the id of the item named 'name' in the collection at collection_path in the
+        name index, and make sure the item still exists by getting it.
+        Returns (id, response), or (None, None) if the name isn't in the index or the item
+        has been deleted since it was seen.  Raises an exception for any other error.
+        '''
+        collection_url = self._make_url(collection_path)
+        item_id = _name_index.get(collection_url, name)
+        if item_id is None:
+            return (None, None)
+        r = self._get_resource("{0}/{1}".format(collection_path, item_id))
+        if r.status_code == 404:
+            _name_index.discard(collection_url, name=name)
+            return (None, None)
+        r.raise_for_status()
+        return (item_id, r)
 
     def _create_resource(self, path, resource_content):
         '''
         Create a DMaaP resource by POSTing to the resource collection
         identified by path (relative to root), using resource_content as the body of the post
         '''
-        url = self._make_url(path)
-        self.logger.info("Posting to URL: {0} with body: {1}".format(url, resource_content))
-        return requests.post(url, auth=self.auth, json=resource_content)
+        return self._request('POST', path,
+                             lambda url: self.session.post(url, auth=self.auth, json=resource_content, timeout=self.timeout),
+                             body=resource_content)
 
     def _delete_resource(self, path):
         '''
         Delete the DMaaP resource at path, where path is relative to the root.
         '''
-        url = self._make_url(path)
-        self.logger.info("Deleting URL: {0}".format(url))
-        return requests.delete(url, auth=self.auth)
+        return self._request('DELETE', path, lambda url: self.session.delete(url, auth=self.auth, timeout=self.timeout))
 
     ### PUBLIC API ###
 
@@ -121,14 +470,23 @@ class DMaaPControllerHandle(object):
     def get_feed_info_by_name(self, feed_name):
         '''
         Get the representation of the DMaaP data router feed whose feed name is feed_name.
-        '''
-        feeds = self._get_resource("{0}".format(self.feeds_path))
-        feed_list = feeds.json()
-        for feed in feed_list:
-            if feed["feedName"] == feed_name:
+        Returns None if there isn't one; raises an exception if the bus controller returns an error.
+        '''
+        f = self._get_indexed(self.feeds_path, feed_name)[1]
+        if f is not None:
+            self.logger.info("Found feed with {0}".format(feed_name))
+            return f
+
+        # The bus controller filters the feeds by name, if it supports feedName;
+        # otherwise we get all of them, and check the names ourselves
+        feed_id = self._find_id_by_name(self.feeds_path, "?feedName={0}".format(quote(feed_name, safe='')),
+                                        "feedName", "feedId", feed_name)
+        if feed_id is not None:
+            f = self._get_resource("{0}/{1}".format(self.feeds_path, feed_id))
+            if f.status_code != 404:
+                f.raise_for_status()
                 self.logger.info("Found feed with {0}".format(feed_name))
-                feed_id = feed["feedId"]
-                return self._get_resource("{0}/{1}".format(self.feeds_path, feed_id))
+                return f
 
         self.logger.info("feed_name {0} not found".format(feed_name))
         return None
@@ -137,6 +495,7 @@ class DMaaPControllerHandle(object):
         '''
         Delete the DMaaP data router feed whose feed id is feed_id.
         '''
+        _name_index.discard(self._make_url(self.feeds_path), id=feed_id)
         return self._delete_resource("{0}/{1}".format(self.feeds_path, feed_id))
 
     # Data Router Publishers
@@ -233,14 +592,14 @@ class DMaaPControllerHandle(object):
     def get_topic_fqtn_by_name(self, topic_name):
         '''
         Get the representation of the DMaaP message router topic fqtn whose topic name is topic_name.
+        Returns None if there isn't one; raises an exception if the bus controller returns an error.
         '''
-        topics = self._get_resource("{0}".format(self.topics_path))
-        topic_list = topics.json()
-        for topic in topic_list:
-            if topic["topicName"] == topic_name:
-                self.logger.info("Found existing topic with name {0}".format(topic_name))
-                fqtn = topic["fqtn"]
-                return fqtn
+        (fqtn, t) = self._get_indexed(self.topics_path, topic_name)
+        if t is None:
+            fqtn = self._find_id_by_name(self.topics_path, "", "topicName", "fqtn", topic_name)
+        if fqtn is not None:
+            self.logger.info("Found existing topic with name {0}".format(topic_name))
+            return fqtn
 
         self.logger.info("topic_name {0} not found".format(topic_name))
         return None
@@ -249,6 +608,7 @@ class DMaaPControllerHandle(object):
         '''
         Delete the topic whose fully qualified name is 'fqtn'
         '''
+        _name_index.discard(self._make_url(self.topics_path), id=fqtn)
         return self._delete_resource("{0}/{1}".format(self.topics_path, fqtn))
 
     # Message route clients (publishers and subscribers
@@ -284,14 +644,7 @@ class DMaaPControllerHandle(object):
         Get the list of location names known to the DMaaP bus controller
         whose "dcaeLayer" property matches dcae_layer and whose status is "VALID".
         '''
-        # Do these as a separate step so things like 404 get reported precisely
-        locations = self._get_resource(LOCATIONS_PATH)
-        locations.raise_for_status()
-
-        # pull out location names for VALID locations with matching dcae_layer
-        return [location["dcaeLocationName"] for location in locations.json()
-                if location['dcaeLayer'] == dcae_layer
-                and location['status'] == 'VALID']
+        return list(self._get_location_index().get((dcae_layer, 'VALID'), []))
 
     def get_dcae_central_locations(self):
         '''
@@ -300,12 +653,32 @@ class DMaaPControllerHandle(object):
         and whose status is "VALID".
         "dcaeLayer" contains "central" for central sites.
         '''
-        # Do these as a separate step so things like 404 get reported precisely
-        locations = self._get_resource(LOCATIONS_PATH)
-        locations.raise_for_status()
+        # pull out location names for VALID central locations (the first is the first one the bus controller listed)
+        index = self._get_location_index()
+        return [name for (layer, status), names in index.items()
+                if 'central' in layer.lower() and status == 'VALID'
+                for name in names]
 
-        # pull out location names for VALID central locations
-        return [location["dcaeLocationName"] for location in locations.json()
-                if 'central' in location['dcaeLayer'].lower()
-                and location['status'] == 'VALID']
+    def _get_location_index(self):
+        '''
+        Get the DCAE locations, indexed by (dcaeLayer, status).
+        The locations are fetched from the bus controller once for the handle, that is, for
+        the operation that made it, however many lookups the operation makes.
+        '''
+        with self._locations_lock:
+            if self._location_index is None:
+                # Do these as a separate step so things like 404 get reported precisely
+                locations = self._get_resource(LOCATIONS_PATH)
+                locations.raise_for_status()
+                index = {}
+                for location in locations.json():
+                    index.setdefault((location['dcaeLayer'], location['status']), []).append(location['dcaeLocationName'])
+                self._location_index = index
+            return self._location_index
 
+    def invalidate_locations(self):
+        '''
+        Forget the DCAE locations, so the next lookup gets them from the bus controller
+        '''
+        with self._locations_lock:
+            self._location_index = None
@@ -20,63 +20,105 @@
 ## Get parameters for accessing the DMaaP controller
 from consulif.consulif import ConsulHandle
 from cloudify.exceptions import NonRecoverableError
+from collections import namedtuple
 import os
+import threading
 
 os.environ["REQUESTS_CA_BUNDLE"]="/opt/onap/certs/cacert.pem"  # This is to handle https request thru plugin
 
 CONSUL_HOST = "consul"                      # Should always be a local consul agent on Cloudify Manager
 DBCL_KEY_NAME = "dmaap-plugin"              # Consul key containing DMaaP data bus credentials
+# Deletions of DMaaP entities that failed during uninstall, to be tried again
+DELETE_FAILURES_PATH = os.path.join(os.path.expanduser("~"), ".cache", "onap", "dmaap-plugin-deletes.json")
 # In the ONAP Kubernetes environment, bus controller address is always "dmaap-bc", on port 8080 (http) and 8443 (https)
 ONAP_SERVICE_ADDRESS = "dmaap-bc"
 HTTP_PORT = "8080"
 HTTPS_PORT = "8443"
 
-try:
-    _ch = ConsulHandle("http://{0}:8500".format(CONSUL_HOST), None, None, None)
-except Exception as e:
-    raise NonRecoverableError("Error getting ConsulHandle when configuring dmaap plugin: {0}".format(e))
-
-try:
-    config = _ch.get_config(DBCL_KEY_NAME)
-except Exception as e:
-    raise NonRecoverableError("Error getting config for '{0}' from ConsulHandle when configuring dmaap plugin: {1}".format(DBCL_KEY_NAME, e))
-
-try:
-    DMAAP_USER = config['dmaap']['username']
-except Exception as e:
-    raise NonRecoverableError("Error setting DMAAP_USER while configuring dmaap plugin: {0}".format(e))
-
-try:
-    DMAAP_PASS = config['dmaap']['password']
-except Exception as e:
-    raise NonRecoverableError("Error setting DMAAP_PASS while configuring dmaap plugin: {0}".format(e))
-
-try:
-    DMAAP_OWNER = config['dmaap']['owner']
-except Exception as e:
-    raise NonRecoverableError("Error setting DMAAP_OWNER while configuring dmaap plugin: {0}".format(e))
-
-try:
-    if 'protocol' in config['dmaap']:
-        DMAAP_PROTOCOL = config['dmaap']['protocol']
-        service_port = HTTP_PORT
-    else:
-        DMAAP_PROTOCOL = 'https'    # Default to https (service discovery should give us this but doesn't
-        service_port = HTTPS_PORT
-except Exception as e:
-    raise NonRecoverableError("Error setting DMAAP_PROTOCOL while configuring dmaap plugin: {0}".format(e))
-
-try:
-    if 'path' in config['dmaap']:
-        DMAAP_PATH = config['dmaap']['path']
-    else:
-        DMAAP_PATH = 'webapi'       # SHould come from service discovery but Consul doesn't support it
-except Exception as e:
-    raise NonRecoverableError("Error setting DMAAP_PATH while configuring dmaap plugin: {0}".format(e))
-
-try:
-    service_address = ONAP_SERVICE_ADDRESS
-    DMAAP_API_URL = '{0}://{1}:{2}/{3}'.format(DMAAP_PROTOCOL, service_address, service_port, DMAAP_PATH)
-except Exception as e:
-    raise NonRecoverableError("Error setting DMAAP_API_URL while configuring dmaap plugin: {0}".format(e))
+# Parameters for accessing the DMaaP bus controller, and options for the Consul client
+# (pool_size, connect_timeout, read_timeout; see consulif.ConsulHandle)
+Settings = namedtuple('Settings', ['user', 'password', 'owner', 'protocol', 'path', 'api_url', 'consul'])
+# Consul client options that can be set in the "consul" section of the plugin's Consul key
+CONSUL_OPTIONS = ('pool_size', 'connect_timeout', 'read_timeout')
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def get_settings():
+    '''
+    Get the parameters for accessing the DMaaP bus controller.
+    They're read from Consul the first time they're needed rather than when the
+    plugin is imported, so importing the plugin doesn't depend on Consul.
+    '''
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = _load_settings()
+        return _settings
+
+
+def _load_settings():
+    try:
+        _ch = ConsulHandle("http://{0}:8500".format(CONSUL_HOST), None, None, None)
+    except Exception as e:
+        raise NonRecoverableError("Error getting ConsulHandle when configuring dmaap plugin: {0}".format(e))
+
+    try:
+        config = _ch.get_config(DBCL_KEY_NAME)
+    except Exception as e:
+        raise NonRecoverableError("Error getting config for '{0}' from ConsulHandle when configuring dmaap plugin: {1}".format(DBCL_KEY_NAME, e))
+
+    try:
+        DMAAP_USER = config['dmaap']['username']
+    except Exception as e:
+        raise NonRecoverableError("Error setting DMAAP_USER while configuring dmaap plugin: {0}".format(e))
+
+    try:
+        DMAAP_PASS = config['dmaap']['password']
+    except Exception as e:
+        raise NonRecoverableError("Error setting DMAAP_PASS while configuring dmaap plugin: {0}".format(e))
+
+    try:
+        DMAAP_OWNER = config['dmaap']['owner']
+    except Exception as e:
+        raise NonRecoverableError("Error setting DMAAP_OWNER while configuring dmaap plugin: {0}".format(e))
+
+    try:
+        if 'protocol' in config['dmaap']:
+            DMAAP_PROTOCOL = config['dmaap']['protocol']
+            service_port = HTTP_PORT
+        else:
+            DMAAP_PROTOCOL = 'https'    # Default to https (service discovery should give us this but doesn't
+            service_port = HTTPS_PORT
+    except Exception as e:
+        raise NonRecoverableError("Error setting DMAAP_PROTOCOL while configuring dmaap plugin: {0}".format(e))
+
+    try:
+        if 'path' in config['dmaap']:
+            DMAAP_PATH = config['dmaap']['path']
+        else:
+            DMAAP_PATH = 'webapi'       # SHould come from service discovery but Consul doesn't support it
+    except Exception as e:
+        raise NonRecoverableError("Error setting DMAAP_PATH while configuring dmaap plugin: {0}".format(e))
+
+    try:
+        service_address = ONAP_SERVICE_ADDRESS
+        DMAAP_API_URL = '{0}://{1}:{2}/{3}'.format(DMAAP_PROTOCOL, service_address, service_port, DMAAP_PATH)
+    except Exception as e:
+        raise NonRecoverableError("Error setting DMAAP_API_URL while configuring dmaap plugin: {0}".format(e))
+
+    try:
+        consul_options = dict((k, v) for k, v in config.get('consul', {}).items() if k in CONSUL_OPTIONS)
+    except Exception as e:
+        raise NonRecoverableError("Error setting Consul options while configuring dmaap plugin: {0}".format(e))
+
+    return Settings(DMAAP_USER, DMAAP_PASS, DMAAP_OWNER, DMAAP_PROTOCOL, DMAAP_PATH, DMAAP_API_URL, consul_options)
+
+
+def get_consul_handle(settings, logger):
+    '''
+    Get a ConsulHandle for the local Consul agent, using the Consul client options in 'settings'
+    '''
+    return ConsulHandle("http://{0}:8500".format(CONSUL_HOST), None, None, logger, **settings.consul)
 
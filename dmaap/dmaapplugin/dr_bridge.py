@@ -17,28 +17,32 @@
 # limitations under the License.
 # ============LICENSE_END======================================================
 
+from concurrent import futures
+import time
 from cloudify import ctx
 from cloudify.decorators import operation
 from cloudify.exceptions import NonRecoverableError
-from dmaapplugin import DMAAP_API_URL, DMAAP_USER, DMAAP_PASS
+from dmaapplugin import get_settings
 from dmaapplugin.dmaaputils import random_string
+from dmaapplugin.teardown import DeleteQueue
 from dmaapcontrollerif.dmaap_requests import DMaaPControllerHandle
 
+# Maximum number of bridges being set up at once
+BRIDGE_MAX_CONCURRENCY = 10
+
 # Set up a subscriber to a source feed
 def _set_up_subscriber(dmc, source_feed_id, loc, delivery_url, username, userpw):
-    # Add subscriber to source feed
-    add_sub = dmc.add_subscriber(source_feed_id, loc, delivery_url, username, userpw)
+    # Add subscriber to source feed, delivering files as they were published, without privileges
+    add_sub = dmc.add_subscriber(source_feed_id, loc, delivery_url, username, userpw, False, False)
     add_sub.raise_for_status()
     return add_sub.json()
 
 # Set up a publisher to a target feed
-def _set_up_publisher(dmc, target_feed_id, loc):
-    username = random_string(8)
-    userpw = random_string(16)
+def _set_up_publisher(dmc, target_feed_id, loc, username, userpw):
     add_pub = dmc.add_publisher(target_feed_id, loc, username, userpw)
     add_pub.raise_for_status()
     pub_info = add_pub.json()
-    return pub_info["pubId"], username, userpw
+    return pub_info["pubId"]
 
 # Get a central location to use when creating a publisher or subscriber
 def _get_central_location(dmc):
@@ -47,55 +51,69 @@ def _get_central_location(dmc):
         raise Exception('No central location found for setting up DR bridging')
     return locations[0]          # We take the first one.  Typically there will be two central locations
 
+# Call f(*args), recording how long it took in latency[step]
+def _timed(latency, step, f, *args):
+    start = time.time()
+    try:
+        return f(*args)
+    finally:
+        latency[step] = round(time.time() - start, 3)
+
+def _source_feed_id(source_props):
+    if 'feed_id' in source_props:
+        return source_props['feed_id']
+    raise Exception('Source feed has no feed_id property')
+
+def _target_feed_id(target_props):
+    if 'feed_id' in target_props:
+        return target_props['feed_id']
+    raise Exception('Target feed has no feed_id property')
+
 
 # Set up a "bridge" between two feeds internal to DCAE
 # A source feed "bridges_to" a target feed, meaning that anything published to
 # the source feed will be delivered to subscribers to the target feed (as well as
 # to subscribers of the source feed).
 #
-# The bridge is established by first adding a publisher to the target feed.  The result of doing this
+# The bridge is established by adding a publisher to the target feed.  The result of doing this
 # is a publish URL and a set of publication credentials.
-#The publish URL and publication credentials are used to set up a subscriber to the source feed.
-#I.e., we tell the source feed to deliver to an endpoint which is actually a publish
+# The publish URL and publication credentials are used to set up a subscriber to the source feed.
+# I.e., we tell the source feed to deliver to an endpoint which is actually a publish
 # endpoint for the target feed.
-@operation
-def create_dr_bridge(**kwargs):
-
-    try:
-
-        # Get source and target feed ids
-        if 'feed_id' in ctx.target.instance.runtime_properties:
-            target_feed_id = ctx.target.instance.runtime_properties['feed_id']
-        else:
-            raise Exception('Target feed has no feed_id property')
-        if 'feed_id' in ctx.source.instance.runtime_properties:
-            source_feed_id = ctx.source.instance.runtime_properties['feed_id']
-        else:
-            raise Exception('Source feed has no feed_id property')
-
-        dmc = DMaaPControllerHandle(DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, ctx.logger)
+# We choose the publication credentials ourselves, so the publisher and the subscriber
+# are set up at the same time.  If only one of them can be set up, it's deleted again.
+def _bridge_internal(dmc, logger, loc, source_props, target, latency):
+    target_props = target.instance.runtime_properties
+    target_feed_id = _target_feed_id(target_props)
+    source_feed_id = _source_feed_id(source_props)
+    delivery_url = target_props['publish_url']
+    username = random_string(8)
+    userpw = random_string(16)
 
-        # Get a location to use when creating a publisher or subscriber--a central location seems reasonable
-        loc = _get_central_location(dmc)
+    logger.info('Creating bridge from feed {0} to feed {1} using location {2}'.format(source_feed_id, target_feed_id, loc))
 
-        ctx.logger.info('Creating bridge from feed {0} to feed {1} using location {2}'.format(source_feed_id, target_feed_id, loc))
+    with futures.ThreadPoolExecutor(max_workers=2) as executor:
+        pub = executor.submit(_timed, latency, 'publisher', _set_up_publisher, dmc, target_feed_id, loc, username, userpw)
+        sub = executor.submit(_timed, latency, 'subscriber', _set_up_subscriber, dmc, source_feed_id, loc, delivery_url, username, userpw)
+        futures.wait([pub, sub])
 
-        # Add publisher to target feed
-        publisher_id, username, userpw = _set_up_publisher(dmc, target_feed_id, loc)
-        ctx.logger.info("Added publisher id {0} to  target feed {1} with user {2}".format(publisher_id, target_feed_id, username))
+    if pub.exception() or sub.exception():
+        queue = DeleteQueue(dmc, logger=logger)
+        if not pub.exception():
+            queue.add("publisher", pub.result())
+        if not sub.exception():
+            queue.add("subscriber", sub.result()["subId"])
+        queue.run()
+        raise pub.exception() or sub.exception()
 
-        # Add subscriber to source feed
-        delivery_url = ctx.target.instance.runtime_properties['publish_url']
-        subscriber_info = _set_up_subscriber(dmc, source_feed_id, loc, delivery_url, username, userpw)
-        subscriber_id = subscriber_info["subId"]
-        ctx.logger.info("Added subscriber id {0} to source feed {1} with delivery url {2}".format(subscriber_id, source_feed_id, delivery_url))
+    publisher_id = pub.result()
+    subscriber_id = sub.result()["subId"]
+    logger.info("Added publisher id {0} to  target feed {1} with user {2}".format(publisher_id, target_feed_id, username))
+    logger.info("Added subscriber id {0} to source feed {1} with delivery url {2}".format(subscriber_id, source_feed_id, delivery_url))
 
-        # Save the publisher and subscriber IDs on the source node, indexed by the target node id
-        ctx.source.instance.runtime_properties[ctx.target.node.id] = {"publisher_id": publisher_id, "subscriber_id": subscriber_id}
+    # Save the publisher and subscriber IDs on the source node, indexed by the target node id
+    return {"publisher_id": publisher_id, "subscriber_id": subscriber_id}
 
-    except Exception as e:
-        ctx.logger.error("Error creating bridge: {0}".format(e))
-        raise NonRecoverableError(e)
 
 # Set up a bridge from an internal DCAE feed to a feed in an external Data Router system
 # The target feed needs to be provisioned in the external Data Router system.  A publisher
@@ -103,42 +121,29 @@ def create_dr_bridge(**kwargs):
 # username, and password need to be captured in a target node of type dcae.nodes.ExternalTargetFeed.
 # The bridge is established by setting up a subscriber to the internal DCAE source feed using the
 # external feed publisher parameters as delivery parameters for the subscriber.
-@operation
-def create_external_dr_bridge(**kwargs):
-    try:
-
-        # Make sure target feed has full set of properties
-        if 'url' in ctx.target.node.properties and 'username' in ctx.target.node.properties and 'userpw' in ctx.target.node.properties:
-            url = ctx.target.node.properties['url']
-            username = ctx.target.node.properties['username']
-            userpw = ctx.target.node.properties['userpw']
-        else:
-            raise Exception ("Target feed missing url, username, and/or user pw")
+def _bridge_to_external(dmc, logger, loc, source_props, target, latency):
+    # Make sure target feed has full set of properties
+    target_node_props = target.node.properties
+    if 'url' in target_node_props and 'username' in target_node_props and 'userpw' in target_node_props:
+        url = target_node_props['url']
+        username = target_node_props['username']
+        userpw = target_node_props['userpw']
+    else:
+        raise Exception ("Target feed missing url, username, and/or user pw")
 
-        # Make sure source feed has a feed ID
-        if 'feed_id' in ctx.source.instance.runtime_properties:
-            source_feed_id = ctx.source.instance.runtime_properties['feed_id']
-        else:
-            raise Exception('Source feed has no feed_id property')
+    # Make sure source feed has a feed ID
+    source_feed_id = _source_feed_id(source_props)
 
-        dmc = DMaaPControllerHandle(DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, ctx.logger)
+    logger.info('Creating external bridge from feed {0} to external url {1} using location {2}'.format(source_feed_id, url, loc))
 
-        # Get a central location to use when creating subscriber
-        loc = _get_central_location(dmc)
+    # Create subscription to source feed using properties of the external target feed
+    subscriber_info = _timed(latency, 'subscriber', _set_up_subscriber, dmc, source_feed_id, loc, url, username, userpw)
+    subscriber_id = subscriber_info["subId"]
+    logger.info("Added subscriber id {0} to source feed {1} with delivery url {2}".format(subscriber_id, source_feed_id, url))
 
-        ctx.logger.info('Creating external bridge from feed {0} to external url {1} using location {2}'.format(source_feed_id, url, loc))
+    # Save the subscriber ID on the source node, indexed by the target node id
+    return {"subscriber_id": subscriber_id}
 
-        # Create subscription to source feed using properties of the external target feed
-        subscriber_info = _set_up_subscriber(dmc, source_feed_id, loc, url, username, userpw)
-        subscriber_id = subscriber_info["subId"]
-        ctx.logger.info("Added subscriber id {0} to source feed {1} with delivery url {2}".format(subscriber_id, source_feed_id, url))
-
-        # Save the subscriber ID on the source node, indexed by the target node id
-        ctx.source.instance.runtime_properties[ctx.target.node.id] = {"subscriber_id": subscriber_id}
-
-    except Exception as e:
-        ctx.logger.error("Error creating external bridge: {0}".format(e))
-        raise NonRecoverableError(e)
 
 # Set up a bridge from a feed in an external Data Router system to an internal DCAE feed.
 # The bridge is established by creating a publisher on the internal DCAE feed.  Then a subscription
@@ -147,26 +152,135 @@ def create_external_dr_bridge(**kwargs):
 # for the external subscription.
 # In order to obtain the publish URL, publisher username, and password, a blueprint using this sort of
 # bridge will typically have an output that exposes the runtime_property set on the source node in this operation.
-@operation
-def create_external_source_dr_bridge(**kwargs):
-    try:
-        # Get target feed id
-        if 'feed_id' in ctx.target.instance.runtime_properties:
-            target_feed_id = ctx.target.instance.runtime_properties['feed_id']
-        else:
-            raise Exception('Target feed has no feed_id property')
+def _bridge_from_external(dmc, logger, loc, source_props, target, latency):
+    # Get target feed id
+    target_props = target.instance.runtime_properties
+    target_feed_id = _target_feed_id(target_props)
 
-        dmc = DMaaPControllerHandle(DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, ctx.logger)
+    # Create a publisher on the target feed
+    username = random_string(8)
+    userpw = random_string(16)
+    publisher_id = _timed(latency, 'publisher', _set_up_publisher, dmc, target_feed_id, loc, username, userpw)
+
+    # Save the publisher info on the source node, indexed by the target node
+    return {"publisher_id": publisher_id, "url": target_props["publish_url"], "username": username, "userpw": userpw}
+
+
+# The function that sets up each type of bridge
+BRIDGE_TYPES = {
+    "dcaegen2.relationships.bridges_to": _bridge_internal,
+    "dcaegen2.relationships.bridges_to_external": _bridge_to_external,
+    "dcaegen2.relationships.bridges_from_external_to_internal": _bridge_from_external
+}
+
+def _bridge_type(rel):
+    if rel.type in BRIDGE_TYPES:
+        return BRIDGE_TYPES[rel.type]
+    for rel_type in rel.type_hierarchy:
+        if rel_type in BRIDGE_TYPES:
+            return BRIDGE_TYPES[rel_type]
+    return None
+
+# A bridge has been set up once the source has an entry for the target with a publisher or subscriber
+def _is_bridged(source_props, target_name):
+    entry = source_props.get(target_name)
+    return isinstance(entry, dict) and ('publisher_id' in entry or 'subscriber_id' in entry)
+
+
+def set_up_bridges(source, logger, target_name=None, max_concurrency=BRIDGE_MAX_CONCURRENCY):
+    '''
+    Set up all of the bridges from the node instance in the relationship subject 'source'
+    that haven't been set up yet.
+    Cloudify establishes a node instance's relationships one after another, so the first
+    bridge operation to run does the work for all of them: it gets the central location
+    once, and sets up the bridges concurrently, at most 'max_concurrency' at a time.
+    The time, in secs, that each step of setting up a bridge took is logged, and kept in
+    the source's 'bridge_latency' runtime property, indexed by the target node id, apart from
+    the bridge's own entry (which blueprints expose).
+    A bridge that couldn't be set up is logged and left pending, so the operation for its own
+    relationship tries it again and reports the failure there: only the error for the bridge
+    to 'target_name' (the running operation's own) is raised, after recording the others.
+    Returns the names of the target nodes of the bridges that were set up.
+    '''
+    source_props = source.instance.runtime_properties
+
+    pending = []
+    for rel in source.instance.relationships:
+        bridge = _bridge_type(rel)
+        if bridge is not None and not _is_bridged(source_props, rel.target.node.id):
+            pending.append((bridge, rel.target))
+    if not pending:
+        return []
+
+    settings = get_settings()
+    dmc = DMaaPControllerHandle(settings.api_url, settings.user, settings.password, logger)
+
+    # Get a location to use when creating a publisher or subscriber--a central location seems reasonable
+    location_latency = {}
+    loc = _timed(location_latency, 'location', _get_central_location, dmc)
+
+    def set_up(bridge, target):
+        start = time.time()
+        latency = dict(location_latency)
+        entry = bridge(dmc, logger, loc, source_props, target, latency)
+        latency['total'] = round(time.time() - start + location_latency['location'], 3)
+        logger.info("Bridge from {0} to {1} set up in {2}".format(source.node.id, target.node.id, latency))
+        return (entry, latency)
+
+    entries = {}
+    latencies = {}
+    failures = {}
+    with futures.ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(pending)))) as executor:
+        submitted = dict((executor.submit(set_up, bridge, target), target.node.id) for (bridge, target) in pending)
+        for f in futures.as_completed(submitted):
+            try:
+                (entries[submitted[f]], latencies[submitted[f]]) = f.result()
+            except Exception as e:
+                logger.error("Error creating bridge to {0}: {1}".format(submitted[f], e))
+                failures[submitted[f]] = e
+
+    for name, entry in entries.items():
+        source_props[name] = entry
+    if latencies:
+        bridge_latency = dict(source_props.get('bridge_latency', {}))
+        bridge_latency.update(latencies)
+        source_props['bridge_latency'] = bridge_latency
+
+    if target_name in failures:
+        raise failures[target_name]
+
+    return sorted(entries)
+
+
+def _set_up_bridge(bridge_kind):
+    if _is_bridged(ctx.source.instance.runtime_properties, ctx.target.node.id):
+        ctx.logger.info("{0} from {1} to {2} already set up".format(bridge_kind, ctx.source.node.id, ctx.target.node.id))
+        return
+    set_up_bridges(ctx.source, ctx.logger, ctx.target.node.id)
+    if not _is_bridged(ctx.source.instance.runtime_properties, ctx.target.node.id):
+        raise Exception("{0} has no bridge relationship to {1}".format(ctx.source.node.id, ctx.target.node.id))
 
-        # Get a central location to use when creating a publisher
-        loc = _get_central_location(dmc)
 
-        # Create a publisher on the target feed
-        publisher_id, username, userpw = _set_up_publisher(dmc, target_feed_id, loc)
+@operation
+def create_dr_bridge(**kwargs):
+    try:
+        _set_up_bridge("Bridge")
+    except Exception as e:
+        ctx.logger.error("Error creating bridge: {0}".format(e))
+        raise NonRecoverableError(e)
 
-        # Save the publisher info on the source node, indexed by the target node
-        ctx.source.instance.runtime_properties[ctx.target.node.id] = {"publisher_id": publisher_id, "url": ctx.target.instance.runtime_properties["publish_url"], "username": username, "userpw": userpw}
+@operation
+def create_external_dr_bridge(**kwargs):
+    try:
+        _set_up_bridge("External bridge")
+    except Exception as e:
+        ctx.logger.error("Error creating external bridge: {0}".format(e))
+        raise NonRecoverableError(e)
 
+@operation
+def create_external_source_dr_bridge(**kwargs):
+    try:
+        _set_up_bridge("External source bridge")
     except Exception as e:
         ctx.logger.error("Error creating external source bridge: {0}".format(e))
 
@@ -178,19 +292,30 @@ def create_external_source_dr_bridge(**kwargs):
 def remove_dr_bridge(**kwargs):
     try:
 
-        dmc = DMaaPControllerHandle(DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, ctx.logger)
-
-        if ctx.target.node.id in ctx.source.instance.runtime_properties:
-
-            if 'subscriber_id' in ctx.source.instance.runtime_properties[ctx.target.node.id]:
-                # Delete the subscription for this bridge
-                ctx.logger.info("Removing bridge -- deleting subscriber {0}".format(ctx.source.instance.runtime_properties[ctx.target.node.id]['subscriber_id']))
-                dmc.delete_subscriber(ctx.source.instance.runtime_properties[ctx.target.node.id]['subscriber_id'])
-
-            if 'publisher_id' in ctx.source.instance.runtime_properties:
-                # Delete the publisher for this bridge
-                ctx.logger.info("Removing bridge -- deleting publisher {0}".format(ctx.source.instance.runtime_properties[ctx.target.node.id]['publisher_id']))
-                dmc.delete_publisher(ctx.source.instance.runtime_properties[ctx.target.node.id]['publisher_id'])
+        settings = get_settings()
+        dmc = DMaaPControllerHandle(settings.api_url, settings.user, settings.password, ctx.logger)
+
+        # Delete the subscription and the publisher for this bridge, whichever it has
+        source_props = ctx.source.instance.runtime_properties
+        target_name = ctx.target.node.id
+        queue = DeleteQueue(dmc, logger=ctx.logger)
+        bridge = dict(source_props.get(target_name, {}))
+        if 'subscriber_id' in bridge:
+            ctx.logger.info("Removing bridge -- deleting subscriber {0}".format(bridge['subscriber_id']))
+            queue.add("subscriber", bridge.pop('subscriber_id'))
+        if 'publisher_id' in bridge:
+            ctx.logger.info("Removing bridge -- deleting publisher {0}".format(bridge['publisher_id']))
+            queue.add("publisher", bridge.pop('publisher_id'))
+        queue.run()
+
+        # Failed deletions are recorded to be tried again, so the bridge is gone either way,
+        # and setting it up again makes a new one
+        if target_name in source_props:
+            source_props[target_name] = bridge
+        if target_name in source_props.get('bridge_latency', {}):
+            bridge_latency = dict(source_props['bridge_latency'])
+            del bridge_latency[target_name]
+            source_props['bridge_latency'] = bridge_latency
 
         ctx.logger.info("Remove bridge from {0} to {1}".format(ctx.source.node.id, ctx.target.node.id))
 
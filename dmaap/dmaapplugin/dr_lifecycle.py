@@ -20,8 +20,9 @@
 from cloudify import ctx
 from cloudify.decorators import operation
 from cloudify.exceptions import NonRecoverableError
-from dmaapplugin import DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, DMAAP_OWNER
+from dmaapplugin import get_settings
 from dmaapplugin.dmaaputils import random_string
+from dmaapplugin.teardown import DeleteQueue
 from dmaapcontrollerif.dmaap_requests import DMaaPControllerHandle
 
 # Lifecycle operations for DMaaP Data Router feeds
@@ -66,9 +67,10 @@ def create_feed(**kwargs):
             useExisting = False
 
         # Make the request to the controller
-        dmc = DMaaPControllerHandle(DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, ctx.logger)
+        settings = get_settings()
+        dmc = DMaaPControllerHandle(settings.api_url, settings.user, settings.password, ctx.logger)
         ctx.logger.info("Attempting to create feed name {0}".format(feed_name))
-        f = dmc.create_feed(feed_name, feed_version, feed_description, aspr_classification, DMAAP_OWNER, useExisting)
+        f = dmc.create_feed(feed_name, feed_version, feed_description, aspr_classification, settings.owner, useExisting)
         f.raise_for_status()
 
         # Capture important properties from the result
@@ -96,7 +98,8 @@ def get_existing_feed(**kwargs):
 
     try:
         # Make the lookup request to the controller
-        dmc = DMaaPControllerHandle(DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, ctx.logger)
+        settings = get_settings()
+        dmc = DMaaPControllerHandle(settings.api_url, settings.user, settings.password, ctx.logger)
         ctx.logger.info("DMaaPControllerHandle() returned")
         feed_id_input = False
         if "feed_id" in ctx.node.properties:
@@ -143,10 +146,17 @@ def delete_feed(**kwargs):
     '''
     try:
         # Make the lookup request to the controllerid=ctx.node.properties["feed_id"]
-        dmc = DMaaPControllerHandle(DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, ctx.logger)
-        f = dmc.delete_feed(ctx.instance.runtime_properties["feed_id"])
-        f.raise_for_status()
-        ctx.logger.info("Deleting feed id {0}".format(ctx.instance.runtime_properties["feed_id"]))
+        settings = get_settings()
+        dmc = DMaaPControllerHandle(settings.api_url, settings.user, settings.password, ctx.logger)
+        feed_id = ctx.instance.runtime_properties["feed_id"]
+        ctx.logger.info("Deleting feed id {0}".format(feed_id))
+
+        # A failed deletion is recorded to be tried again later, as well as reported here
+        queue = DeleteQueue(dmc, logger=ctx.logger)
+        queue.add("feed", feed_id)
+        errors = queue.run()
+        if ("feed", feed_id) in errors:
+            raise errors[("feed", feed_id)]
 
     except Exception as e:
         ctx.logger.error("Error deleting feed id {id}: {er}".format(id=ctx.instance.runtime_properties["feed_id"],er=e))
@@ -21,8 +21,9 @@
 from cloudify import ctx
 from cloudify.decorators import operation
 from cloudify.exceptions import NonRecoverableError
-from dmaapplugin import DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, DMAAP_OWNER
+from dmaapplugin import get_settings
 from dmaapplugin.dmaaputils import random_string
+from dmaapplugin.teardown import DeleteQueue
 from dmaapcontrollerif.dmaap_requests import DMaaPControllerHandle
 
 # Lifecycle operations for DMaaP Message Router topics
@@ -61,9 +62,10 @@ def create_topic(**kwargs):
         use_existing = ctx.node.properties.get("useExisting", False)
 
         # Make the request to the controller
-        dmc = DMaaPControllerHandle(DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, ctx.logger)
+        settings = get_settings()
+        dmc = DMaaPControllerHandle(settings.api_url, settings.user, settings.password, ctx.logger)
         ctx.logger.info("Attempting to create topic name {0}".format(topic_name))
-        t = dmc.create_topic(topic_name, topic_description, tnx_enabled, DMAAP_OWNER, replication_case, global_mr_url, use_existing)
+        t = dmc.create_topic(topic_name, topic_description, tnx_enabled, settings.owner, replication_case, global_mr_url, use_existing)
         t.raise_for_status()
 
         # Capture important properties from the result
@@ -86,7 +88,8 @@ def get_existing_topic(**kwargs):
     don't run into problems when we try to add a publisher or subscriber later.
     '''
     try:
-        dmc = DMaaPControllerHandle(DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, ctx.logger)
+        settings = get_settings()
+        dmc = DMaaPControllerHandle(settings.api_url, settings.user, settings.password, ctx.logger)
         fqtn_input = False
         if "fqtn" in ctx.node.properties:
             fqtn = ctx.node.properties["fqtn"]
@@ -119,10 +122,14 @@ def delete_topic(**kwargs):
     '''
     try:
         fqtn = ctx.instance.runtime_properties["fqtn"]
-        dmc = DMaaPControllerHandle(DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, ctx.logger)
+        settings = get_settings()
+        dmc = DMaaPControllerHandle(settings.api_url, settings.user, settings.password, ctx.logger)
         ctx.logger.info("Attempting to delete topic {0}".format(fqtn))
-        t = dmc.delete_topic(fqtn)
-        t.raise_for_status()
+        queue = DeleteQueue(dmc, logger=ctx.logger)
+        queue.add("topic", fqtn)
+        errors = queue.run()
+        if ("topic", fqtn) in errors:
+            raise errors[("topic", fqtn)]
 
     except Exception as e:
         ctx.logger.error("Error getting existing topic: {er}".format(er=e))
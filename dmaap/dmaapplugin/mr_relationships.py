@@ -19,9 +19,7 @@
 from cloudify import ctx
 from cloudify.decorators import operation
 from cloudify.exceptions import NonRecoverableError
-from dmaapplugin import DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, DMAAP_OWNER, CONSUL_HOST
-from dmaapcontrollerif.dmaap_requests import DMaaPControllerHandle
-from consulif.consulif import ConsulHandle
+from dmaapplugin import streams
 
 # Message router relationship operations
 
@@ -40,45 +38,11 @@ def _add_mr_client(ctype, actions):
     Adds two properties to the dictionary above:
         - topic_url (the URL that the client can use to access the topic)
         - client_id  (used to delete the client in the uninstall workflow)
+    The client may already have been added along with the source's other streams (see dmaapplugin.streams).
     '''
     try:
-        # Make sure we have a name under which to store DMaaP configuration
-        # Check early so we don't needlessly create DMaaP entities
-        if 'service_component_name' not in ctx.source.instance.runtime_properties:
-            raise Exception("Source node does not have 'service_component_name' in runtime_properties")
-
-        target_topic = ctx.target.node.id           # Key for the source's dictionary with topic-related info
-        fqtn = ctx.target.instance.runtime_properties["fqtn"]
-        ctx.logger.info("Attempting to add {0} as {1} to topic {2}".format(ctx.source.node.id, ctype, fqtn))
-
-        # Get the parameters needed for adding the client
-        location = ctx.source.instance.runtime_properties[target_topic]["location"]
-        client_role = ctx.source.instance.runtime_properties[target_topic]["client_role"]
-
-        # Make the request to add the client to the topic
-        dmc = DMaaPControllerHandle(DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, ctx.logger)
-        c = dmc.create_client(fqtn, location, client_role, actions)
-        c.raise_for_status()
-        client_info = c.json()
-        client_id = client_info["mrClientId"]
-        topic_url = client_info["topicURL"]
-
-        # Update source's runtime properties
-        #ctx.source.instance.runtime_properties[target_topic]["topic_url"] = topic_url
-        #ctx.source.instance.runtime_properties[target_topic]["client_id"] = client_id
-        ctx.source.instance.runtime_properties[target_topic] = {
-            "topic_url" : topic_url,
-            "client_id" : client_id,
-            "location" : location,
-            "client_role" : client_role
-        }
-
-        ctx.logger.info("Added {0} id {1} to feed {2} at {3}".format(ctype, client_id, fqtn, location))
-
-        # Set key in Consul
-        ch = ConsulHandle("http://{0}:8500".format(CONSUL_HOST), None, None, ctx.logger)
-        ch.add_to_entry("{0}:dmaap".format(ctx.source.instance.runtime_properties['service_component_name']), target_topic, ctx.source.instance.runtime_properties[target_topic])
-
+        ctx.logger.info("Attempting to add {0} as {1} to topic {2}".format(ctx.source.node.id, ctype, ctx.target.node.id))
+        streams.provision_stream(ctx.source, ctx.target, "client_id", ctx.logger)
     except Exception as e:
         ctx.logger.error("Error adding client to feed: {er}".format(er=e))
         raise NonRecoverableError(e)
@@ -97,22 +61,11 @@ def delete_mr_client(**kwargs):
     Delete the client (publisher or subscriber).
     Expect property 'client_id' to have been set in the instance's runtime_properties
     when the client was created.
+    The client may already have been deleted along with the source's other streams.
     '''
     try:
-        target_topic = ctx.target.node.id
-        client_id = ctx.source.instance.runtime_properties[target_topic]["client_id"]
-        ctx.logger.info("Attempting to delete client {0} ".format(client_id))
-        dmc = DMaaPControllerHandle(DMAAP_API_URL, DMAAP_USER, DMAAP_PASS, ctx.logger)
-        c = dmc.delete_client(client_id)
-        c.raise_for_status()
-
-        ctx.logger.info("Deleted client {0}".format(client_id))
-
-        # Attempt to remove the entire ":dmaap" entry from the Consul KV store
-        # Will quietly do nothing if the entry has already been removed
-        ch = ConsulHandle("http://{0}:8500".format(CONSUL_HOST), None, None, ctx.logger)
-        ch.delete_entry("{0}:dmaap".format(ctx.source.instance.runtime_properties['service_component_name']))
-
+        ctx.logger.info("Attempting to delete client {0} of topic {1}".format(ctx.source.node.id, ctx.target.node.id))
+        streams.delete_stream(ctx.source, ctx.target, "client_id", ctx.logger)
     except Exception as e:
         ctx.logger.error("Error deleting MR client: {er}".format(er=e))
         # don't raise a NonRecoverable error here--let the uninstall workflow continue
@@ -0,0 +1,316 @@
+# ============LICENSE_START====================================================
+# org.onap.dcaegen2
+# =============================================================================
+# Copyright (c) 2017-2020 AT&T Intellectual Property. All rights reserved.
+# =============================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END======================================================
+
+# Provisioning of all of a component's DMaaP streams at once
+#
+# Cloudify runs the preconfigure operations of a node instance's relationships one
+# after another.  So the first of the DMaaP relationship operations to run sets up
+# every stream the component declares (publishers and subscribers to feeds, clients
+# of topics), making the bus controller requests concurrently and writing the
+# component's "<service_component_name>:dmaap" entry in Consul once.  The operations
+# that run after it find their stream already provisioned and have nothing to do.
+# Uninstalling the component works the same way: the first unlink operation deletes
+# all of the streams and the Consul entry, through a dmaapplugin.teardown.DeleteQueue.
+# When only some of the component's relationships go (say, a target node is removed),
+# just those streams are deleted and dropped from the Consul entry.
+
+from concurrent import futures
+from cloudify.manager import get_rest_client
+from dmaapplugin import get_settings, get_consul_handle
+from dmaapplugin import teardown
+from dmaapplugin.dmaaputils import random_string
+from dmaapcontrollerif.dmaap_requests import DMaaPControllerHandle
+
+# Maximum number of bus controller requests in progress at once
+STREAMS_MAX_CONCURRENCY = 10
+
+
+def _add_dr_publisher(dmc, logger, target_feed, source_props, target_props):
+    '''
+    Add the component as a publisher to the feed 'target_feed'.
+    Returns the feed's entry for the component's runtime properties.
+    '''
+    feed_id = target_props["feed_id"]
+    location = source_props[target_feed]["location"]
+    username = random_string(8)
+    password = random_string(16)
+
+    add_pub = dmc.add_publisher(feed_id, location, username, password)
+    add_pub.raise_for_status()
+    publisher_id = add_pub.json()["pubId"]
+    logger.info("Added publisher id {0} to feed {1} at {2}, with user {3}".format(publisher_id, feed_id, location, username))
+
+    return {
+        "publisher_id" : publisher_id,
+        "location" : location,
+        "publish_url" : target_props["publish_url"],
+        "log_url" : target_props["log_url"],
+        "username" : username,
+        "password" : password
+    }
+
+
+def _add_dr_subscriber(dmc, logger, target_feed, source_props, target_props):
+    '''
+    Add the component as a subscriber to the feed 'target_feed'.
+    Returns the feed's entry for the component's runtime properties.
+    '''
+    feed_id = target_props["feed_id"]
+    feed = source_props[target_feed]
+    location = feed["location"]
+    delivery_url = feed["delivery_url"]
+    username = feed["username"]
+    password = feed["password"]
+    decompress = feed["decompress"] if "decompress" in feed else False
+    privileged = feed["privileged"] if "privileged" in feed else False
+
+    add_sub = dmc.add_subscriber(feed_id, location, delivery_url,username, password, decompress, privileged)
+    add_sub.raise_for_status()
+    subscriber_id = add_sub.json()["subId"]
+    logger.info("Added subscriber id {0} to feed {1} at {2}".format(subscriber_id, feed_id, location))
+
+    return {
+        "subscriber_id": subscriber_id,
+        "location" : location,
+        "delivery_url" : delivery_url,
+        "username" : username,
+        "password" : password,
+        "decompress": decompress,
+        "privilegedSubscriber": privileged
+    }
+
+
+def _mr_client(ctype, actions):
+    '''
+    Returns a function that adds the component as a client (publisher or subscriber,
+    depending on 'actions') to a topic, and returns the topic's entry for the
+    component's runtime properties.
+    '''
+    def add(dmc, logger, target_topic, source_props, target_props):
+        fqtn = target_props["fqtn"]
+        location = source_props[target_topic]["location"]
+        client_role = source_props[target_topic]["client_role"]
+
+        c = dmc.create_client(fqtn, location, client_role, actions)
+        c.raise_for_status()
+        client_info = c.json()
+        client_id = client_info["mrClientId"]
+        logger.info("Added {0} id {1} to feed {2} at {3}".format(ctype, client_id, fqtn, location))
+
+        return {
+            "topic_url" : client_info["topicURL"],
+            "client_id" : client_id,
+            "location" : location,
+            "client_role" : client_role
+        }
+    return add
+
+
+# For each type of DMaaP stream relationship: the function that provisions the stream,
+# and the runtime property that shows it has been provisioned
+STREAM_TYPES = {
+    "dcaegen2.relationships.publish_files": (_add_dr_publisher, "publisher_id"),
+    "dcaegen2.relationships.subscribe_to_files": (_add_dr_subscriber, "subscriber_id"),
+    "dcaegen2.relationships.publish_events": (_mr_client("publisher", ["view", "pub"]), "client_id"),
+    "dcaegen2.relationships.subscribe_to_events": (_mr_client("subscriber", ["view", "sub"]), "client_id")
+}
+
+
+# The kind of DMaaP entity to delete for each of the properties above
+_ENTITY_KINDS = {
+    "publisher_id": "publisher",
+    "subscriber_id": "subscriber",
+    "client_id": "client"
+}
+
+
+def is_provisioned(source_props, target_name, marker):
+    '''
+    True if the stream to the node 'target_name' has already been provisioned, that is,
+    if the source's entry for the target has the property 'marker'
+    '''
+    entry = source_props.get(target_name)
+    return isinstance(entry, dict) and marker in entry
+
+
+def _stream_type(rel):
+    # Only look up the type hierarchy (another REST call) for types derived from ours
+    if rel.type in STREAM_TYPES:
+        return STREAM_TYPES[rel.type]
+    for rel_type in rel.type_hierarchy:
+        if rel_type in STREAM_TYPES:
+            return STREAM_TYPES[rel_type]
+    return None
+
+
+def provision_streams(source, logger, max_concurrency=STREAMS_MAX_CONCURRENCY):
+    '''
+    Provision all of the DMaaP streams of the node instance in the relationship
+    subject 'source' that haven't been provisioned yet.
+    The bus controller requests are made concurrently, at most 'max_concurrency' at a time.
+    The entries for the streams that were provisioned are stored in the source's runtime properties
+    and added to its "<service_component_name>:dmaap" entry in Consul with a single update.
+    If any stream couldn't be provisioned, raises an exception after recording the others.
+    Returns the names of the target nodes of the streams that were provisioned.
+    '''
+    source_props = source.instance.runtime_properties
+
+    # Make sure we have a name under which to store DMaaP configuration
+    # Check early so we don't needlessly create DMaaP entities
+    if 'service_component_name' not in source_props:
+        raise Exception("Source node does not have 'service_component_name' in runtime_properties")
+
+    pending = []
+    for rel in source.instance.relationships:
+        stream_type = _stream_type(rel)
+        if stream_type is None:
+            continue
+        (add, marker) = stream_type
+        target_name = rel.target.node.id
+        if not is_provisioned(source_props, target_name, marker):
+            pending.append((add, target_name, dict(rel.target.instance.runtime_properties)))
+
+    if not pending:
+        return []
+
+    logger.info("Provisioning {0} DMaaP streams for {1}: {2}".format(
+        len(pending), source.node.id, ", ".join(p[1] for p in pending)))
+
+    settings = get_settings()
+    dmc = DMaaPControllerHandle(settings.api_url, settings.user, settings.password, logger)
+
+    entries = {}
+    failures = {}
+    with futures.ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(pending)))) as executor:
+        submitted = {
+            executor.submit(add, dmc, logger, target_name, source_props, target_props): target_name
+            for (add, target_name, target_props) in pending
+        }
+        for f in futures.as_completed(submitted):
+            target_name = submitted[f]
+            try:
+                entries[target_name] = f.result()
+            except Exception as e:
+                logger.error("Error provisioning DMaaP stream {0}: {1}".format(target_name, e))
+                failures[target_name] = e
+
+    if entries:
+        for target_name, entry in entries.items():
+            source_props[target_name] = entry
+
+        # Set key in Consul
+        ch = get_consul_handle(settings, logger)
+        ch.add_many_to_entry("{0}:dmaap".format(source_props['service_component_name']),
+                             dict((name, dict(entry)) for name, entry in entries.items()))
+
+    if failures:
+        raise Exception("Could not provision DMaaP streams: {0}".format(
+            "; ".join("{0}: {1}".format(name, e) for name, e in sorted(failures.items()))))
+
+    return sorted(entries)
+
+
+def provision_stream(source, target, marker, logger):
+    '''
+    Make sure the stream from the relationship subject 'source' to 'target' is provisioned.
+    If it isn't, provision it together with all of the source's other streams that aren't.
+    '''
+    source_props = source.instance.runtime_properties
+    target_name = target.node.id
+    if is_provisioned(source_props, target_name, marker):
+        logger.info("DMaaP stream from {0} to {1} already provisioned".format(source.node.id, target_name))
+        return
+
+    provision_streams(source, logger)
+    if not is_provisioned(source_props, target_name, marker):
+        raise Exception("{0} has no DMaaP stream relationship to {1}".format(source.node.id, target_name))
+
+
+def delete_streams(source, logger, target_names=None):
+    '''
+    Delete the DMaaP streams of the node instance in the relationship subject 'source' to the
+    nodes in 'target_names' (all of its streams, if None) that are still provisioned, and remove
+    them from the source's "<service_component_name>:dmaap" entry in Consul, deleting the entry
+    once it is empty.
+    The deletions are made concurrently.  Deletions of publishers, subscribers and clients that
+    fail are recorded to be tried again (see dmaapplugin.teardown), so the streams are marked as
+    deleted in the source's runtime properties either way.  A failure to update the Consul entry
+    is only reported.
+    Returns a dict mapping each (kind, id) that couldn't be deleted to the error.
+    '''
+    source_props = source.instance.runtime_properties
+
+    settings = get_settings()
+    dmc = DMaaPControllerHandle(settings.api_url, settings.user, settings.password, logger)
+    ch = get_consul_handle(settings, logger)
+    queue = teardown.DeleteQueue(dmc, ch, logger)
+
+    deleting = []
+    for rel in source.instance.relationships:
+        stream_type = _stream_type(rel)
+        if stream_type is None:
+            continue
+        marker = stream_type[1]
+        target_name = rel.target.node.id
+        if target_names is not None and target_name not in target_names:
+            continue
+        if is_provisioned(source_props, target_name, marker):
+            queue.add(_ENTITY_KINDS[marker], source_props[target_name][marker])
+            deleting.append((target_name, marker))
+
+    if deleting and 'service_component_name' in source_props:
+        queue.add_entry("{0}:dmaap".format(source_props['service_component_name']),
+                        [target_name for (target_name, marker) in deleting])
+
+    errors = queue.run()
+
+    for (target_name, marker) in deleting:
+        entry = dict(source_props[target_name])
+        del entry[marker]
+        source_props[target_name] = entry
+
+    logger.info("Deleted {0} DMaaP streams for {1}, {2} failed".format(len(deleting), source.node.id, len(errors)))
+    return errors
+
+
+def delete_stream(source, target, marker, logger):
+    '''
+    Make sure the stream from the relationship subject 'source' to 'target' is deleted.
+    If it isn't, and the source itself is being uninstalled, delete it together with all of
+    the source's other streams.
+    '''
+    if not is_provisioned(source.instance.runtime_properties, target.node.id, marker):
+        logger.info("DMaaP stream from {0} to {1} already deleted".format(source.node.id, target.node.id))
+        return {}
+
+    if _uninstalling(source, logger):
+        return delete_streams(source, logger)
+    return delete_streams(source, logger, [target.node.id])
+
+
+def _uninstalling(source, logger):
+    '''
+    True if the node instance in the relationship subject 'source' is being uninstalled (it's
+    been stopped), rather than just losing some of its relationships
+    '''
+    try:
+        state = get_rest_client().node_instances.get(source.instance.id, _include=['state']).state
+    except Exception as e:
+        logger.warning("Could not get the state of {0}, deleting only the stream being unlinked: {1}".format(source.instance.id, e))
+        return False
+    return state in ('stopping', 'stopped', 'deleting')
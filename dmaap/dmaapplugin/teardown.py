@@ -0,0 +1,222 @@
+# ============LICENSE_START====================================================
+# org.onap.dcaegen2
+# =============================================================================
+# Copyright (c) 2017-2020 AT&T Intellectual Property. All rights reserved.
+# =============================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END======================================================
+
+# Deleting DMaaP entities during uninstall
+#
+# Deletions are queued and then made together: requests to the bus controller
+# are made concurrently, and each entity is deleted, or Consul key updated, only once
+# however many times it's queued.  Deletions of publishers, subscribers, clients and feeds
+# that fail are recorded in a file and tried again the next time a queue is run on this host,
+# so a failure during one uninstall doesn't leave the entity behind for good.  Topics and
+# Consul keys are named rather than numbered, so failures to delete them are only reported.
+
+from concurrent import futures
+import fcntl
+import json
+import logging
+import os
+import time
+from dmaapplugin import DELETE_FAILURES_PATH
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of bus controller requests in progress at once
+DELETE_MAX_CONCURRENCY = 10
+# Number of times to try a deletion before giving up on it
+DELETE_MAX_ATTEMPTS = 10
+
+# Kinds of things a DeleteQueue deletes, other than Consul keys
+ENTITY_KINDS = ("feed", "publisher", "subscriber", "topic", "client")
+# Kinds of entities whose failed deletions are tried again later.  Their ids are made up by the
+# bus controller and not reused, so a recorded id can't have come to mean some other entity
+# since.  Topics are named by their owners, and a later deployment may create one with the same name.
+RETRY_KINDS = ("feed", "publisher", "subscriber", "client")
+# Kind for Consul keys
+ENTRY = "entry"
+
+
+def _update_failures(path, update):
+    '''
+    Replace the list of recorded failures in the file 'path' with update(failures),
+    holding a lock on the file so processes don't lose each other's records.
+    '''
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    with os.fdopen(fd, 'r+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        text = f.read()
+        try:
+            failures = json.loads(text) if text.strip() else []
+        except ValueError:
+            logger.warning("Discarding unreadable record of failed DMaaP deletions in {0}".format(path))
+            failures = []
+        failures = update(failures)
+        f.seek(0)
+        f.truncate()
+        json.dump(failures, f)
+
+
+def recorded_failures(path=None):
+    '''
+    Get the deletions that failed and are waiting to be tried again
+    '''
+    try:
+        with open(path or DELETE_FAILURES_PATH) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return []
+
+
+class DeleteQueue(object):
+    '''
+    Collects deletions of DMaaP entities (through the bus controller handle 'dmc') and
+    of Consul keys (through the Consul handle 'ch'), and makes them when run() is called.
+    '''
+
+    def __init__(self, dmc, ch=None, logger=logger, max_concurrency=DELETE_MAX_CONCURRENCY,
+                 failures_path=None):
+        self.dmc = dmc
+        self.ch = ch
+        self.logger = logger
+        self.max_concurrency = max_concurrency
+        self.failures_path = failures_path or DELETE_FAILURES_PATH
+        self._queue = []
+        self._attempts = {}
+        self._entry_names = {}
+
+    def add(self, kind, entity_id):
+        '''
+        Queue the deletion of the entity of kind 'kind' (one of ENTITY_KINDS) with id 'entity_id'
+        '''
+        if kind not in ENTITY_KINDS:
+            raise ValueError("Unknown kind of DMaaP entity: {0}".format(kind))
+        self._add(kind, entity_id)
+
+    def add_entry(self, key, names=None):
+        '''
+        Queue the removal of the entries 'names' from the JSON dict stored under the Consul key 'key'
+        (which is deleted once the dict is empty), or of the whole key if 'names' is None.
+        A removal that fails isn't tried again later: by then the key may hold entries written since.
+        '''
+        if key in self._entry_names:
+            queued = self._entry_names[key]
+            names = None if queued is None or names is None else queued | set(names)
+        elif names is not None:
+            names = set(names)
+        self._entry_names[key] = names
+        self._add(ENTRY, key)
+
+    def _add(self, kind, item_id, attempts=0):
+        item = (kind, item_id)
+        if item not in self._attempts:
+            self._queue.append(item)
+            self._attempts[item] = attempts
+
+    def _delete(self, item):
+        (kind, item_id) = item
+        if kind == ENTRY:
+            names = self._entry_names[item_id]
+            if names is None:
+                self.ch.delete_entry(item_id)
+            else:
+                self.ch.delete_many_from_entry(item_id, sorted(names))
+            return
+        r = getattr(self.dmc, "delete_" + kind)(item_id)
+        if r.status_code == 404:
+            self.logger.info("DMaaP {0} {1} was already deleted".format(kind, item_id))
+            return
+        r.raise_for_status()
+
+    def run(self):
+        '''
+        Make the queued deletions, along with the ones that failed before.
+        Returns a dict mapping each queued (kind, id) that couldn't be deleted to the error.
+        The failed deletions of kinds in RETRY_KINDS are recorded to be tried again.
+        Deletions tried again for earlier queues aren't in the dict: if they fail, they're
+        just recorded again.
+        '''
+        retries = []
+        def claim(failures):
+            retries.extend(failures)
+            return []
+        try:
+            _update_failures(self.failures_path, claim)
+        except (IOError, OSError) as e:
+            self.logger.warning("Error reading record of failed DMaaP deletions: {0}".format(e))
+        retried = set()
+        for failure in retries:
+            item = (failure["kind"], failure["id"])
+            if failure["kind"] not in RETRY_KINDS:
+                self.logger.warning("Not trying again to delete DMaaP {0} {1}".format(*item))
+                continue
+            if item not in self._attempts:
+                retried.add(item)
+            self._add(failure["kind"], failure["id"], failure["attempts"])
+
+        items = list(self._queue)
+        self._queue = []
+        errors = {}
+        if items:
+            self.logger.info("Deleting {0} DMaaP entities and Consul keys".format(len(items)))
+
+        entities = [item for item in items if item[0] != ENTRY]
+        if entities:
+            with futures.ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(entities)))) as executor:
+                submitted = dict((executor.submit(self._delete, item), item) for item in entities)
+                for f in futures.as_completed(submitted):
+                    try:
+                        f.result()
+                    except Exception as e:
+                        errors[submitted[f]] = e
+
+        for item in items:
+            if item[0] == ENTRY:
+                try:
+                    self._delete(item)
+                except Exception as e:
+                    errors[item] = e
+
+        failures = []
+        for item in items:
+            if item not in errors:
+                continue
+            (kind, item_id) = item
+            attempts = self._attempts[item] + 1
+            if kind not in RETRY_KINDS:
+                self.logger.error("Error deleting DMaaP {0} {1}: {2}".format(kind, item_id, errors[item]))
+            elif attempts >= DELETE_MAX_ATTEMPTS:
+                self.logger.error("Giving up deleting DMaaP {0} {1} after {2} attempts: {3}".format(kind, item_id, attempts, errors[item]))
+            else:
+                self.logger.error("Error deleting DMaaP {0} {1}, will try again later: {2}".format(kind, item_id, errors[item]))
+                failures.append({"kind": kind, "id": item_id, "attempts": attempts,
+                                 "error": str(errors[item]), "time": time.time()})
+        self._record(failures)
+        self._attempts = {}
+        self._entry_names = {}
+
+        return dict((item, e) for item, e in errors.items() if item not in retried)
+
+    def _record(self, failures):
+        if not failures:
+            return
+        try:
+            _update_failures(self.failures_path, lambda recorded: recorded + failures)
+        except (IOError, OSError) as e:
+            self.logger.error("Error recording failed DMaaP deletions {0}: {1}".format(failures, e))
@@ -28,6 +28,7 @@ setup(
     keywords = "",
     url = "",
     zip_safe=False,
+    python_requires='>=3.6',
     install_requires=[
         'python-consul>=0.7.0',
         'requests',
@@ -17,6 +17,9 @@
 # ============LICENSE_END=========================================================
 #
 
+import threading
+from collections import namedtuple
+
 import pytest
 
 import requests
@@ -41,16 +44,24 @@ def mockconsul(monkeypatch):
     def fake_add_to_entry(self, key, add_name, add_value):
         return True
 
+    def fake_add_many_to_entry(self, key, entries):
+        return dict(entries)
+
+    def fake_delete_many_from_entry(self, key, delete_names):
+        return {}
+
     def fake_delete_entry(self, entry_name):
         return True
 
-    def fake_init(self, api_url, user, password, logger):
+    def fake_init(self, api_url, user, password, logger, **options):
         pass
 
     from consulif.consulif import ConsulHandle
     monkeypatch.setattr(ConsulHandle, 'get_config', fake_get_config)
     monkeypatch.setattr(ConsulHandle, 'get_service', fake_get_service)
     monkeypatch.setattr(ConsulHandle, 'add_to_entry', fake_add_to_entry)
+    monkeypatch.setattr(ConsulHandle, 'add_many_to_entry', fake_add_many_to_entry)
+    monkeypatch.setattr(ConsulHandle, 'delete_many_from_entry', fake_delete_many_from_entry)
     monkeypatch.setattr(ConsulHandle, 'delete_entry', fake_delete_entry)
     monkeypatch.setattr(ConsulHandle, '__init__', fake_init)
 
@@ -60,19 +71,19 @@ def mockconsul(monkeypatch):
 
 
 @pytest.fixture()
-def mockdmaapbc(monkeypatch):
+def mockdmaapbc(monkeypatch, tmp_path):
 
-    def fake_get(url, auth):
+    def fake_get(self, url, auth, timeout=None):
     #    print "fake_get: {0}, {1}".format(url, auth)
         r = requests.Response()
         r.status_code = 200
         return r
-    def fake_post(url, auth, json):
+    def fake_post(self, url, auth, json, timeout=None):
     #    print "fake_post: {0}, {1}, {2}".format(url, auth, json)
         r = requests.Response()
         r.status_code = 200
         return r
-    def fake_delete(url, auth):
+    def fake_delete(self, url, auth, timeout=None):
     #    print "fake_delete: {0}, {1}".format(url, auth)
         r = requests.Response()
         r.status_code = 200
@@ -82,7 +93,148 @@ def mockdmaapbc(monkeypatch):
 
     import requests
     monkeypatch.setattr(requests.Response, "json", fake_json)
-    monkeypatch.setattr(requests, "get", fake_get)
-    monkeypatch.setattr(requests, "post", fake_post)
-    monkeypatch.setattr(requests, "delete", fake_delete)
+    monkeypatch.setattr(requests.Session, "get", fake_get)
+    monkeypatch.setattr(requests.Session, "post", fake_post)
+    monkeypatch.setattr(requests.Session, "delete", fake_delete)
+
+    # Keep failed deletions out of the real record
+    from dmaapplugin import teardown
+    monkeypatch.setattr(teardown, "DELETE_FAILURES_PATH", str(tmp_path / "deletes.json"))
+
+
+
+# Stand-ins for the relationship subjects (ctx.source, ctx.target) of relationship operations
+_Subject = namedtuple("_Subject", "node instance")
+_Node = namedtuple("_Node", "id properties")
+_Instance = namedtuple("_Instance", "id runtime_properties relationships")
+_Relationship = namedtuple("_Relationship", "type type_hierarchy target")
+_Settings = namedtuple("_Settings", "api_url user password consul")
+
+
+class _FakeRelationships(object):
+    """ Builds the relationship subjects, and their relationships, that the operations get """
+
+    @staticmethod
+    def subject(node_id, runtime_properties, relationships=(), node_properties=None):
+        return _Subject(_Node(node_id, node_properties or {}),
+                        _Instance(node_id + "_1", runtime_properties, list(relationships)))
+
+    @classmethod
+    def relationship(cls, rel_type, target_name, target_props, node_properties=None):
+        """ A DMaaP relationship of type 'dcaegen2.relationships.<rel_type>' to the node 'target_name' """
+        target = cls.subject(target_name, target_props, node_properties=node_properties)
+        return _Relationship("dcaegen2.relationships." + rel_type, [], target)
+
+    @staticmethod
+    def other(rel_type):
+        """ A relationship the DMaaP plugin has nothing to do with """
+        return _Relationship(rel_type, [], None)
+
+
+class _Response(object):
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception("{0} error".format(self.status_code))
+
+    def json(self):
+        return self.body
+
+
+class _FakeBusController(object):
+    """
+    Stands in for DMaaPControllerHandle.
+    Every request to add something waits at a barrier until 'parties' of them are waiting, and
+    every deletion until 'delete_parties' are, so a test with more than one party only passes if
+    the requests are made concurrently.
+    Requests for the feed ids, fqtns or entity ids in 'fail' (or for (kind, id) in 'fail')
+    return 500, deletions of the ids in 'missing' return 404.
+    """
+
+    def __init__(self, parties=1, fail=(), missing=(), delete_parties=1):
+        self.barrier = threading.Barrier(parties, timeout=5)
+        self.delete_barrier = threading.Barrier(delete_parties, timeout=5)
+        self.fail = set(fail)
+        self.missing = set(missing)
+        self.location_requests = 0
+        self.added = []         # (kind, feed id or fqtn) of each publisher, subscriber and client added
+        self.definitions = []   # what each of them was added with
+        self.deleted = []       # (kind, id) of each entity deleted
+
+    def _status(self, kind, item_id):
+        return 500 if item_id in self.fail or (kind, item_id) in self.fail else 200
+
+    def _add(self, kind, item_id, definition, body):
+        self.added.append((kind, item_id))
+        self.definitions.append(definition)
+        self.barrier.wait()
+        return _Response(body, self._status(kind, item_id))
+
+    def _delete(self, kind, entity_id):
+        self.delete_barrier.wait()
+        status = self._status(kind, entity_id)
+        if status == 200:
+            if entity_id in self.missing:
+                return _Response(None, 404)
+            self.deleted.append((kind, entity_id))
+            return _Response(None, 204)
+        return _Response(None, 503)
+
+    def get_dcae_central_locations(self):
+        self.location_requests += 1
+        return ["central1", "central2"]
+
+    def add_publisher(self, feed_id, location, username, password):
+        return self._add("publisher", feed_id, {"location": location},
+                         {"pubId": "pub-" + feed_id})
+
+    def add_subscriber(self, feed_id, location, delivery_url, username, password, decompress, privileged):
+        return self._add("subscriber", feed_id,
+                         {"location": location, "decompress": decompress, "privileged": privileged},
+                         {"subId": "sub-" + feed_id})
+
+    def create_client(self, fqtn, location, client_role, actions):
+        return self._add("client", fqtn, {"location": location, "actions": actions},
+                         {"mrClientId": "client-" + fqtn, "topicURL": "https://mr/" + fqtn})
+
+    def delete_feed(self, feed_id):
+        return self._delete("feed", feed_id)
+
+    def delete_publisher(self, pub_id):
+        return self._delete("publisher", pub_id)
+
+    def delete_subscriber(self, sub_id):
+        return self._delete("subscriber", sub_id)
+
+    def delete_topic(self, fqtn):
+        return self._delete("topic", fqtn)
+
+    def delete_client(self, client_id):
+        return self._delete("client", client_id)
+
+
+@pytest.fixture()
+def fake_relationships():
+    """ Builders for the relationship subjects of relationship operations """
+    return _FakeRelationships
+
+
+@pytest.fixture()
+def fake_bus_controller(monkeypatch, tmp_path):
+    """
+    Make a fake bus controller (see _FakeBusController).  Given 'module', it's also what the
+    module's operations get when they make a DMaaPControllerHandle.
+    """
+    from dmaapplugin import teardown
+    monkeypatch.setattr(teardown, "DELETE_FAILURES_PATH", str(tmp_path / "deletes.json"))
 
+    def make(module=None, **kwargs):
+        dmc = _FakeBusController(**kwargs)
+        if module is not None:
+            monkeypatch.setattr(module, "get_settings", lambda: _Settings("https://bc", "user", "pw", {}))
+            monkeypatch.setattr(module, "DMaaPControllerHandle", lambda api_url, user, password, logger: dmc)
+        return dmc
+    return make
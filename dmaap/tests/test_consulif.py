@@ -70,3 +70,99 @@ def test_add_entry(mockconsul):
     _ch.add_to_entry(key, name, value)
 
     _ch.delete_entry(key)
+
+
+def test_consul_client_shared():
+    _ch1 = ConsulHandle("http://{0}:{1}".format(CONSUL_HOST, CONSUL_PORT), None, None, None)
+    _ch2 = ConsulHandle("http://{0}:{1}".format(CONSUL_HOST, CONSUL_PORT), None, None, None)
+    _ch3 = ConsulHandle("http://{0}:{1}".format("otherconsul", CONSUL_PORT), None, None, None)
+
+    assert _ch1.ch is _ch2.ch
+    assert _ch1.ch is not _ch3.ch
+    assert _ch1.ch.http.session.timeout == (5, 30)
+
+    _ch4 = ConsulHandle("http://{0}:{1}".format(CONSUL_HOST, CONSUL_PORT), None, None, None,
+                        pool_size=2, read_timeout=120)
+    assert _ch4.ch is not _ch1.ch
+    assert _ch4.ch.http.session.timeout == (5, 120)
+    assert _ch4.ch.http.session.get_adapter("http://x")._pool_maxsize == 2
+
+
+def test_add_many_to_entry_backoff(monkeypatch):
+    import json
+    from consulif import consulif
+
+    sleeps = []
+    monkeypatch.setattr(consulif.time, "sleep", sleeps.append)
+
+    class FakeKV(object):
+        def __init__(self, conflicts):
+            self.value = json.dumps({"feed00": {}})
+            self.conflicts = conflicts
+        def get(self, key):
+            return (1, {"Value": self.value, "ModifyIndex": 1})
+        def put(self, key, value, cas):
+            if self.conflicts:
+                self.conflicts -= 1
+                return False
+            self.value = value
+            return True
+
+    _ch = ConsulHandle("http://{0}:{1}".format(CONSUL_HOST, CONSUL_PORT), None, None, None)
+    kv = FakeKV(conflicts=2)
+    monkeypatch.setattr(_ch.ch, "kv", kv)
+
+    before = consulif.cas_stats()
+    _ch.add_many_to_entry("DMAAP_TEST", {"topic00": {}, "topic01": {}})
+    assert sorted(json.loads(kv.value)) == ["feed00", "topic00", "topic01"]
+    assert len(sleeps) == 2
+    assert consulif.cas_stats()["conflicts"] - before["conflicts"] == 2
+
+    kv.conflicts = 10
+    with pytest.raises(consulif.ConsulConflictError):
+        _ch._cas_update("DMAAP_TEST", lambda v: v.update(x=1), max_attempts=3)
+    assert consulif.cas_stats()["failures"] - before["failures"] == 1
+
+
+def test_delete_from_entry(monkeypatch):
+    import json
+
+    class FakeKV(object):
+        def __init__(self, value):
+            self.value = json.dumps(value)
+            self.index = 1
+            self.writes = 0
+        def get(self, key):
+            if self.value is None:
+                return (self.index, None)
+            return (self.index, {"Value": self.value, "ModifyIndex": self.index})
+        def put(self, key, value, cas):
+            assert cas == self.index
+            self.value = value
+            self.index += 1
+            self.writes += 1
+            return True
+        def delete(self, key, cas):
+            assert cas == self.index
+            self.value = None
+            self.index += 1
+            self.writes += 1
+            return True
+
+    _ch = ConsulHandle("http://{0}:{1}".format(CONSUL_HOST, CONSUL_PORT), None, None, None)
+    kv = FakeKV({"feed00": {}, "topic00": {}, "topic01": {}})
+    monkeypatch.setattr(_ch.ch, "kv", kv)
+
+    _ch.delete_from_entry("DMAAP_TEST", "topic00")
+    assert sorted(json.loads(kv.value)) == ["feed00", "topic01"]
+
+    # Removing names that aren't there doesn't touch the key
+    _ch.delete_many_from_entry("DMAAP_TEST", ["topic00", "topic02"])
+    assert kv.writes == 1
+
+    # The key goes once it's empty, and deleting from a missing key does nothing
+    _ch.delete_many_from_entry("DMAAP_TEST", ["feed00", "topic01"])
+    assert kv.value is None
+    assert _ch.delete_from_entry("DMAAP_TEST", "feed00") == {}
+    assert kv.writes == 2
+
@@ -19,6 +19,7 @@
 # ============LICENSE_END=========================================================
 #
 
+import json
 import pytest
 import requests
 from cloudify.mocks import MockCloudifyContext
@@ -100,3 +101,266 @@ def test_dmaapc (monkeypatch, mockconsul, mockdmaapbc):
     rc = dmc._get_resource(path)
     rc = dmc._create_resource(path, None)
     rc = dmc._delete_resource(path)
+
+
+def test_dmaapc_session(monkeypatch):
+    from dmaapcontrollerif import dmaap_requests
+
+    dmc1 = DMaaPControllerHandle("https://dmaap-bc:8443/webapi", "u", "p", logger)
+    dmc2 = DMaaPControllerHandle("https://dmaap-bc:8443/webapi", "u", "p", logger)
+    assert dmc1.session is dmc2.session
+    assert dmc1.session is dmaap_requests.get_session()
+    assert dmaap_requests.get_session(pool_size=2) is not dmc1.session
+
+    adapter = dmc1.session.get_adapter("https://dmaap-bc:8443/webapi")
+    assert adapter.max_retries.total == dmaap_requests.RETRIES
+    assert not adapter.max_retries.is_retry("POST", 503)
+    assert adapter.max_retries.is_retry("GET", 503)
+
+    calls = []
+    def fake_request(self, method, url, **kwargs):
+        calls.append((method, url, kwargs["timeout"]))
+        r = requests.Response()
+        r.status_code = 200
+        return r
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+
+    dmc1.get_feed_info("1")
+    dmc1.delete_feed("1")
+    dmc1.add_publisher("1", "loc", "u", "p")
+    timeout = (dmaap_requests.CONNECT_TIMEOUT, dmaap_requests.READ_TIMEOUT)
+    assert calls == [("GET", "https://dmaap-bc:8443/webapi/feeds/1", timeout),
+                     ("DELETE", "https://dmaap-bc:8443/webapi/feeds/1", timeout),
+                     ("POST", "https://dmaap-bc:8443/webapi/dr_pubs", timeout)]
+
+
+def _streamed_response(body, chunk_size=7):
+    import io
+    r = requests.Response()
+    r.status_code = 200
+    r.raw = io.BytesIO(body.encode('utf-8'))
+    return r
+
+
+def test_iter_json_array():
+    from dmaapcontrollerif.dmaap_requests import _iter_json_array
+
+    items = [{"feedName": "f{0}".format(i), "feedId": str(i), "x": [1, "]", {"y": "é"}]} for i in range(50)]
+    body = json.dumps(items)
+    assert list(_iter_json_array(_streamed_response(body), chunk_size=7)) == items
+    assert list(_iter_json_array(_streamed_response(" [ ] "))) == []
+
+    # Stops reading when the caller stops
+    r = _streamed_response(body)
+    elements = _iter_json_array(r, chunk_size=64)
+    assert next(elements) == items[0]
+    assert r.raw.tell() < len(body) // 2
+
+    with pytest.raises(ValueError):
+        list(_iter_json_array(_streamed_response('[{"a": 1}, {"b"')))
+
+
+def test_get_by_name(monkeypatch):
+    from dmaapcontrollerif import dmaap_requests
+
+    feeds = [{"feedName": "feed{0}".format(i), "feedId": str(i)} for i in range(100)]
+    topics = [{"topicName": "topic{0}".format(i), "fqtn": "org.onap.topic{0}".format(i)} for i in range(100)]
+    calls = []
+    errors = {}
+    def fake_request(self, method, url, stream=False, **kwargs):
+        calls.append(url)
+        path = url.split("/webapi")[1]
+        if path in errors:
+            r = _streamed_response("")
+            r.status_code = errors[path]
+            return r
+        if path.startswith("/feeds/") or path.startswith("/topics/"):
+            r = requests.Response()
+            r.status_code = 200
+            items = feeds if path.startswith("/feeds/") else topics
+            r._content = json.dumps(items[int(path.split("/")[2].split("topic")[-1])]).encode()
+            return r
+        return _streamed_response(json.dumps(feeds if path.startswith("/feeds") else topics))
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+    dmaap_requests._name_index.clear()
+
+    dmc = DMaaPControllerHandle("https://dmaap-bc:8443/webapi", "u", "p", logger)
+    assert dmc.get_feed_info_by_name("feed10").json()["feedId"] == "10"
+    assert calls == ["https://dmaap-bc:8443/webapi/feeds?feedName=feed10", "https://dmaap-bc:8443/webapi/feeds/10"]
+
+    # Names seen in the scan are in the index, and the feed is still checked
+    del calls[:]
+    assert dmc.get_feed_info_by_name("feed5").json()["feedId"] == "5"
+    assert calls == ["https://dmaap-bc:8443/webapi/feeds/5"]
+    assert dmc.get_feed_info_by_name("nosuchfeed") is None
+
+    # Errors other than 404 aren't taken for the feed
+    errors["/feeds/6"] = 503
+    with pytest.raises(requests.exceptions.HTTPError):
+        dmc.get_feed_info_by_name("feed6")
+    errors["/feeds?feedName=newfeed"] = 500
+    with pytest.raises(requests.exceptions.HTTPError):
+        dmc.get_feed_info_by_name("newfeed")
+
+    # A feed deleted since it was seen is looked up again
+    errors["/feeds/8"] = 404
+    del calls[:]
+    assert dmc.get_feed_info_by_name("feed8") is None
+    assert calls == ["https://dmaap-bc:8443/webapi/feeds/8", "https://dmaap-bc:8443/webapi/feeds?feedName=feed8",
+                     "https://dmaap-bc:8443/webapi/feeds/8"]
+
+    assert dmc.get_topic_fqtn_by_name("topic3") == "org.onap.topic3"
+    del calls[:]
+    assert dmc.get_topic_fqtn_by_name("topic3") == "org.onap.topic3"
+    assert calls == ["https://dmaap-bc:8443/webapi/topics/org.onap.topic3"]
+
+    # A topic deleted since it was seen isn't returned
+    del topics[4]
+    errors["/topics/org.onap.topic4"] = 404
+    assert dmc.get_topic_fqtn_by_name("topic4") is None
+    errors["/topics/org.onap.topic5"] = 503
+    with pytest.raises(requests.exceptions.HTTPError):
+        dmc.get_topic_fqtn_by_name("topic5")
+
+    # Deleting forgets the name
+    dmc.delete_topic("org.onap.topic3")
+    assert dmaap_requests._name_index.get(dmc._make_url(dmc.topics_path), "topic3") is None
+
+
+def test_location_cache(monkeypatch):
+    locations = [
+        {"dcaeLocationName": "edge1", "dcaeLayer": "edge", "status": "VALID"},
+        {"dcaeLocationName": "central1", "dcaeLayer": "central-core", "status": "VALID"},
+        {"dcaeLocationName": "central2", "dcaeLayer": "central-core", "status": "INVALID"},
+        {"dcaeLocationName": "central3", "dcaeLayer": "Central", "status": "VALID"},
+        {"dcaeLocationName": "edge2", "dcaeLayer": "edge", "status": "VALID"}
+    ]
+    calls = []
+    def fake_request(self, method, url, **kwargs):
+        calls.append(url)
+        r = requests.Response()
+        r.status_code = 200
+        r._content = json.dumps(locations).encode()
+        return r
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+
+    dmc = DMaaPControllerHandle("https://dmaap-bc:8443/webapi", "u", "p", logger)
+    assert dmc.get_dcae_central_locations() == ["central1", "central3"]
+    assert dmc.get_dcae_locations("edge") == ["edge1", "edge2"]
+    assert len(calls) == 1
+
+    # Each handle (each operation) gets the locations for itself
+    assert DMaaPControllerHandle("https://dmaap-bc:8443/webapi", "u", "p", logger).get_dcae_locations("none") == []
+    assert len(calls) == 2
+
+    dmc.invalidate_locations()
+    dmc.get_dcae_central_locations()
+    dmc.get_dcae_central_locations()
+    assert len(calls) == 3
+
+
+def test_request_logging(monkeypatch):
+    from dmaapcontrollerif import dmaap_requests
+
+    class ListHandler(logging.Handler):
+        def __init__(self):
+            logging.Handler.__init__(self)
+            self.messages = []
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+
+    handler = ListHandler()
+    request_logger = logging.getLogger("test_request_logging")
+    request_logger.addHandler(handler)
+    request_logger.setLevel(logging.INFO)
+
+    statuses = {"GET": 200, "POST": 201}
+    def fake_request(self, method, url, **kwargs):
+        r = requests.Response()
+        r.status_code = statuses[method]
+        r._content = json.dumps({"error": "bad", "userpwd": "x" * 5000}).encode()
+        return r
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+    monkeypatch.setattr(dmaap_requests, "LOG_SAMPLE_EVERY", 3)
+    dmaap_requests._latencies.clear()
+
+    redacted = []
+    redact = dmaap_requests._redact
+    monkeypatch.setattr(dmaap_requests, "_redact", lambda value: redacted.append(value) or redact(value))
+
+    dmc = DMaaPControllerHandle("https://dmaap-bc:8443/webapi", "u", "p", request_logger)
+    for feed_id in range(5):
+        dmc.get_feed_info(str(feed_id))
+    # Successful GETs are sampled
+    assert len(handler.messages) == 2
+    assert handler.messages[0].startswith("GET https://dmaap-bc:8443/webapi/feeds/0 returned 200")
+    assert handler.messages[1].startswith("GET https://dmaap-bc:8443/webapi/feeds/3 returned 200")
+
+    # Bodies of successful requests aren't even formatted at INFO level
+    dmc.add_publisher("1", "loc", "user", "secret-password")
+    assert handler.messages[-1].startswith("POST https://dmaap-bc:8443/webapi/dr_pubs returned 201")
+    assert redacted == []
+
+    # Failures are logged with both bodies, without secrets, cut short
+    statuses["POST"] = 400
+    dmc.add_publisher("1", "loc", "user", "secret-password")
+    message = handler.messages[-1]
+    assert message.startswith("POST https://dmaap-bc:8443/webapi/dr_pubs with body")
+    assert "secret-password" not in message
+    assert '"userpwd": "********"' in message
+    assert "xxxxx" not in message
+    assert len(message) < 2 * dmaap_requests.LOG_BODY_MAX + 200
+
+    stats = dmaap_requests.latency_stats()
+    assert stats["GET /feeds/{id}"]["count"] == 5
+    assert sum(stats["GET /feeds/{id}"]["buckets"].values()) == 5
+    assert stats["POST /dr_pubs"]["count"] == 2
+
+
+def test_request_logging_at_debug_level(monkeypatch):
+    from dmaapcontrollerif import dmaap_requests
+
+    # Cloudify's ctx.logger passes debug messages on, so anything logged at debug level is formatted
+    class ListHandler(logging.Handler):
+        def __init__(self):
+            logging.Handler.__init__(self)
+            self.messages = []
+        def emit(self, record):
+            self.messages.append(record.getMessage())
+
+    handler = ListHandler()
+    request_logger = logging.getLogger("test_request_logging_at_debug_level")
+    request_logger.addHandler(handler)
+    request_logger.setLevel(logging.DEBUG)
+
+    def fake_request(self, method, url, **kwargs):
+        r = requests.Response()
+        r.status_code = 201
+        return r
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+
+    redacted = []
+    redact = dmaap_requests._redact
+    monkeypatch.setattr(dmaap_requests, "_redact", lambda value: redacted.append(value) or redact(value))
+
+    dmc = DMaaPControllerHandle("https://dmaap-bc:8443/webapi", "u", "p", request_logger)
+    dmc.add_publisher("1", "loc", "user", "secret-password")
+    dmc.create_topic("topic", description="d" * 5000)
+
+    # The bodies of successful requests are neither formatted nor logged
+    assert redacted == []
+    assert len(handler.messages) == 2
+    assert handler.messages[0].startswith("POST https://dmaap-bc:8443/webapi/dr_pubs returned 201")
+    assert handler.messages[1].startswith("POST https://dmaap-bc:8443/webapi/topics returned 201")
+    assert not any("body" in message or "secret-password" in message for message in handler.messages)
+
+
+def test_log_body_truncated():
+    from dmaapcontrollerif import dmaap_requests
+
+    text = str(dmaap_requests._LogBody({"topics": ["t" * 100] * 100, "secret": {"a": 1}}))
+    assert len(text) < dmaap_requests.LOG_BODY_MAX + 50
+    assert text.endswith("characters in all)")
+    assert text.startswith('{"secret": "********"')
+    assert dmaap_requests._endpoint("GET", "/feeds?feedName=x") == "GET /feeds"
+    assert dmaap_requests._endpoint("DELETE", "/topics/org.onap.t1") == "DELETE /topics/{id}"
@@ -0,0 +1,127 @@
+# ============LICENSE_START=======================================================
+# org.onap.dcae
+# ================================================================================
+# Copyright (c) 2017-2020 AT&T Intellectual Property. All rights reserved.
+# ================================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END=========================================================
+#
+
+import logging
+import threading
+from collections import namedtuple
+
+import pytest
+
+def _source(rels):
+    relationships = [
+        rels.relationship("bridges_to", "feed01", {"feed_id": "f1", "publish_url": "https://dr/f1"}),
+        rels.relationship("bridges_to_external", "external00", {},
+                          {"url": "https://external/feeds/9", "username": "u", "userpw": "p"}),
+        rels.relationship("bridges_from_external_to_internal", "feed02", {"feed_id": "f2", "publish_url": "https://dr/f2"}),
+        rels.other("cloudify.relationships.depends_on")
+    ]
+    return rels.subject("feed00", {"feed_id": "f0"}, relationships)
+
+def test_set_up_bridges(fake_bus_controller, fake_relationships):
+    from dmaapplugin import dr_bridge
+
+    # One publisher and one subscriber for the internal bridge, one of each for the external ones
+    dmc = fake_bus_controller(dr_bridge, parties=4)
+    source = _source(fake_relationships)
+    assert dr_bridge.set_up_bridges(source, logging.getLogger()) == ["external00", "feed01", "feed02"]
+    assert dmc.location_requests == 1
+    assert all(d["location"] == "central1" for d in dmc.definitions)
+    assert not any(d.get("decompress") or d.get("privileged") for d in dmc.definitions)
+
+    props = source.instance.runtime_properties
+    assert props["feed01"]["publisher_id"] == "pub-f1"
+    assert props["feed01"]["subscriber_id"] == "sub-f0"
+    # The timings are kept apart from the bridges' entries
+    assert "latency" not in props["feed01"]
+    assert sorted(props["bridge_latency"]) == ["external00", "feed01", "feed02"]
+    assert sorted(props["bridge_latency"]["feed01"]) == ["location", "publisher", "subscriber", "total"]
+    assert props["external00"]["subscriber_id"] == "sub-f0"
+    assert props["feed02"]["publisher_id"] == "pub-f2"
+    assert props["feed02"]["url"] == "https://dr/f2"
+
+    # Nothing is left for the other bridge operations to do
+    assert dr_bridge.set_up_bridges(source, logging.getLogger()) == []
+    assert len(dmc.added) == 4
+
+def test_set_up_bridges_cleans_up_half_bridges(fake_bus_controller, fake_relationships):
+    from dmaapplugin import dr_bridge
+
+    dmc = fake_bus_controller(dr_bridge, parties=4, fail=[("subscriber", "f0")])
+    source = _source(fake_relationships)
+    with pytest.raises(Exception, match="500"):
+        dr_bridge.set_up_bridges(source, logging.getLogger(), "feed01")
+
+    # The internal bridge's publisher is deleted again, the bridge from outside is kept
+    assert dmc.deleted == [("publisher", "pub-f1")]
+    props = source.instance.runtime_properties
+    assert "feed01" not in props
+    assert "external00" not in props
+    assert props["feed02"]["publisher_id"] == "pub-f2"
+
+def test_external_source_failure_is_its_own(monkeypatch, fake_bus_controller, fake_relationships):
+    from cloudify.exceptions import NonRecoverableError
+    from dmaapplugin import dr_bridge
+
+    dmc = fake_bus_controller(dr_bridge, parties=4, fail=[("publisher", "f2")])
+    source = _source(fake_relationships)
+    def run(op, rel):
+        target = source.instance.relationships[rel].target
+        monkeypatch.setattr(dr_bridge, "ctx", namedtuple("Context", "source target logger")(source, target, logging.getLogger()))
+        op()
+
+    # The bridge from outside fails while the first operation sets up all of them,
+    # but only its own operation reports it, and that one only logs it
+    run(dr_bridge.create_dr_bridge, 0)
+    props = source.instance.runtime_properties
+    assert props["feed01"]["subscriber_id"] == "sub-f0"
+    assert props["external00"]["subscriber_id"] == "sub-f0"
+    assert "feed02" not in props
+
+    dmc.barrier = threading.Barrier(1)
+    run(dr_bridge.create_external_dr_bridge, 1)
+    run(dr_bridge.create_external_source_dr_bridge, 2)
+    assert "feed02" not in props
+    assert dmc.added.count(("publisher", "f2")) == 2
+
+    # A bridge that must be set up still fails its operation
+    dmc = fake_bus_controller(dr_bridge, parties=4, fail=[("subscriber", "f0")])
+    source = _source(fake_relationships)
+    with pytest.raises(NonRecoverableError):
+        run(dr_bridge.create_dr_bridge, 0)
+
+def test_remove_dr_bridge(monkeypatch, fake_bus_controller, fake_relationships):
+    from dmaapplugin import dr_bridge
+
+    dmc = fake_bus_controller(dr_bridge, parties=4)
+    source = _source(fake_relationships)
+    dr_bridge.set_up_bridges(source, logging.getLogger())
+    dmc.barrier = threading.Barrier(1)
+
+    target = source.instance.relationships[0].target
+    fake_ctx = namedtuple("Context", "source target logger")(source, target, logging.getLogger())
+    monkeypatch.setattr(dr_bridge, "ctx", fake_ctx)
+    dr_bridge.remove_dr_bridge()
+    assert sorted(dmc.deleted) == [("publisher", "pub-f1"), ("subscriber", "sub-f0")]
+    props = source.instance.runtime_properties
+    assert "feed01" not in props["bridge_latency"]
+
+    # Adding the bridge back sets it up again
+    assert dr_bridge.set_up_bridges(source, logging.getLogger()) == ["feed01"]
+    assert props["feed01"]["publisher_id"] == "pub-f1"
+    assert len(dmc.added) == 6
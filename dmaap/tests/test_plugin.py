@@ -24,3 +24,18 @@ from cloudify.exceptions import NonRecoverableError
 
 def test_noop():
     pass
+
+def test_consul_options(mockconsul, monkeypatch):
+    import dmaapplugin
+    from consulif.consulif import ConsulHandle
+
+    config = {'dmaap': {'username': 'u', 'password': 'p', 'owner': 'o'},
+              'consul': {'read_timeout': 120, 'pool_size': 2, 'unknown': 1}}
+    monkeypatch.setattr(ConsulHandle, 'get_config', lambda self, key: config)
+    settings = dmaapplugin._load_settings()
+    assert settings.consul == {'read_timeout': 120, 'pool_size': 2}
+
+    options = []
+    monkeypatch.setattr(ConsulHandle, '__init__', lambda self, api_url, user, password, logger, **kw: options.append(kw))
+    dmaapplugin.get_consul_handle(settings, None)
+    assert options == [{'read_timeout': 120, 'pool_size': 2}]
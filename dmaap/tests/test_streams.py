@@ -0,0 +1,163 @@
+# ============LICENSE_START=======================================================
+# org.onap.dcae
+# ================================================================================
+# Copyright (c) 2017-2020 AT&T Intellectual Property. All rights reserved.
+# ================================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END=========================================================
+#
+
+import logging
+import threading
+from collections import namedtuple
+
+import pytest
+
+def _source(rels):
+    runtime_properties = {
+        "service_component_name": "s-comp",
+        "feed00": {"location": "loc"},
+        "feed01": {"location": "loc", "delivery_url": "https://comp/feed01",
+                   "username": "u", "password": "p"},
+        "topic00": {"location": "loc", "client_role": "role"},
+        "topic01": {"location": "loc", "client_role": "role"}
+    }
+    relationships = [
+        rels.relationship("publish_files", "feed00",
+                          {"feed_id": "f0", "publish_url": "https://dr/f0", "log_url": "https://dr/log/f0"}),
+        rels.relationship("subscribe_to_files", "feed01", {"feed_id": "f1"}),
+        rels.relationship("publish_events", "topic00", {"fqtn": "t0"}),
+        rels.relationship("subscribe_to_events", "topic01", {"fqtn": "t1"}),
+        rels.other("cloudify.relationships.contained_in")
+    ]
+    return rels.subject("comp", runtime_properties, relationships)
+
+@pytest.fixture()
+def consul_entries(monkeypatch):
+    from consulif.consulif import ConsulHandle
+
+    entries = []
+    monkeypatch.setattr(ConsulHandle, "__init__", lambda self, api_url, user, password, logger, **options: None)
+    monkeypatch.setattr(ConsulHandle, "add_many_to_entry", lambda self, key, value: entries.append((key, value)))
+    return entries
+
+def test_provision_streams(consul_entries, fake_bus_controller, fake_relationships):
+    from dmaapplugin import streams
+
+    dmc = fake_bus_controller(streams, parties=4)
+
+    source = _source(fake_relationships)
+    assert streams.provision_streams(source, logging.getLogger()) == ["feed00", "feed01", "topic00", "topic01"]
+
+    props = source.instance.runtime_properties
+    assert props["feed00"]["publisher_id"] == "pub-f0"
+    assert props["feed00"]["publish_url"] == "https://dr/f0"
+    assert props["feed01"]["subscriber_id"] == "sub-f1"
+    assert props["topic00"]["client_id"] == "client-t0"
+    assert props["topic01"]["topic_url"] == "https://mr/t1"
+
+    # The whole entry is written to Consul at once
+    assert consul_entries == [("s-comp:dmaap", dict((name, props[name]) for name in ["feed00", "feed01", "topic00", "topic01"]))]
+
+    # Everything is provisioned now, so the other relationship operations make no requests
+    for (rel, marker) in zip(source.instance.relationships, ["publisher_id", "subscriber_id", "client_id", "client_id"]):
+        streams.provision_stream(source, rel.target, marker, logging.getLogger())
+    assert len(dmc.added) == 4
+    assert len(consul_entries) == 1
+
+def test_provision_streams_records_partial_success(consul_entries, fake_bus_controller, fake_relationships):
+    from dmaapplugin import streams
+
+    dmc = fake_bus_controller(streams, parties=4, fail=["t1"])
+
+    source = _source(fake_relationships)
+    with pytest.raises(Exception, match="topic01"):
+        streams.provision_streams(source, logging.getLogger())
+
+    props = source.instance.runtime_properties
+    assert sorted(consul_entries[0][1]) == ["feed00", "feed01", "topic00"]
+    assert "client_id" not in props["topic01"]
+
+    # Provisioning again only retries the stream that failed
+    dmc.barrier = threading.Barrier(1)
+    dmc.fail = set()
+    assert streams.provision_streams(source, logging.getLogger()) == ["topic01"]
+    assert dmc.added.count(("client", "t1")) == 2
+
+def test_provision_streams_needs_component_name(consul_entries, fake_relationships):
+    from dmaapplugin import streams
+
+    source = _source(fake_relationships)
+    del source.instance.runtime_properties["service_component_name"]
+    with pytest.raises(Exception, match="service_component_name"):
+        streams.provision_streams(source, logging.getLogger())
+    assert consul_entries == []
+
+def _provisioned_source(monkeypatch, fake_bus_controller, fake_relationships, state):
+    from dmaapplugin import streams
+
+    fake_bus_controller(streams, parties=4)
+    source = _source(fake_relationships)
+    streams.provision_streams(source, logging.getLogger())
+
+    class _FakeRestClient(object):
+        class node_instances(object):
+            @staticmethod
+            def get(node_instance_id, _include=None):
+                assert node_instance_id == "comp_1"
+                return namedtuple("NodeInstance", "state")(state)
+    monkeypatch.setattr(streams, "get_rest_client", _FakeRestClient)
+    return source
+
+@pytest.fixture()
+def queued(monkeypatch):
+    from dmaapplugin import teardown
+
+    queued = []
+    def fake_run(queue):
+        queued.extend((item, queue._entry_names.get(item[1])) for item in queue._queue)
+        return {}
+    monkeypatch.setattr(teardown.DeleteQueue, "run", fake_run)
+    return queued
+
+def test_delete_streams(monkeypatch, consul_entries, queued, fake_bus_controller, fake_relationships):
+    from dmaapplugin import streams
+
+    source = _provisioned_source(monkeypatch, fake_bus_controller, fake_relationships, "stopped")
+
+    # The first unlink deletes every stream and the Consul entry
+    rels = source.instance.relationships
+    assert streams.delete_stream(source, rels[2].target, "client_id", logging.getLogger()) == {}
+    assert sorted(item for (item, names) in queued) == [
+        ("client", "client-t0"), ("client", "client-t1"), ("entry", "s-comp:dmaap"),
+        ("publisher", "pub-f0"), ("subscriber", "sub-f1")]
+    assert dict(queued)[("entry", "s-comp:dmaap")] == set(["feed00", "feed01", "topic00", "topic01"])
+    props = source.instance.runtime_properties
+    assert "publisher_id" not in props["feed00"]
+    assert props["feed00"]["location"] == "loc"
+
+    # The others have nothing left to do
+    for (rel, marker) in zip(rels, ["publisher_id", "subscriber_id", "client_id", "client_id"]):
+        streams.delete_stream(source, rel.target, marker, logging.getLogger())
+    assert len(queued) == 5
+
+def test_delete_one_stream(monkeypatch, consul_entries, queued, fake_bus_controller, fake_relationships):
+    from dmaapplugin import streams
+
+    # The component stays installed, so only the stream being unlinked goes
+    source = _provisioned_source(monkeypatch, fake_bus_controller, fake_relationships, "started")
+    streams.delete_stream(source, source.instance.relationships[2].target, "client_id", logging.getLogger())
+    assert queued == [(("client", "client-t0"), None), (("entry", "s-comp:dmaap"), set(["topic00"]))]
+    props = source.instance.runtime_properties
+    assert "client_id" not in props["topic00"]
+    assert props["topic01"]["client_id"] == "client-t1"
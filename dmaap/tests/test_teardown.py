@@ -0,0 +1,138 @@
+# ============LICENSE_START=======================================================
+# org.onap.dcae
+# ================================================================================
+# Copyright (c) 2017-2020 AT&T Intellectual Property. All rights reserved.
+# ================================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END=========================================================
+#
+
+import pytest
+
+class _FakeConsul(object):
+    def __init__(self):
+        self.deleted = []
+
+    def delete_entry(self, key):
+        self.deleted.append(key)
+
+    def delete_many_from_entry(self, key, delete_names):
+        self.deleted.append((key, delete_names))
+
+@pytest.fixture()
+def failures_path(tmp_path):
+    return str(tmp_path / "cache" / "deletes.json")
+
+def test_delete_queue(failures_path, fake_bus_controller):
+    from dmaapplugin.teardown import DeleteQueue, recorded_failures
+
+    dmc = fake_bus_controller(delete_parties=3)
+    ch = _FakeConsul()
+    queue = DeleteQueue(dmc, ch, failures_path=failures_path)
+    queue.add("publisher", "p1")
+    queue.add("client", "c1")
+    queue.add("client", "c1")
+    queue.add("subscriber", "s1")
+    queue.add_entry("s-comp:dmaap")
+    queue.add_entry("s-comp:dmaap")
+
+    assert queue.run() == {}
+    assert sorted(dmc.deleted) == [("client", "c1"), ("publisher", "p1"), ("subscriber", "s1")]
+    assert ch.deleted == ["s-comp:dmaap"]
+    assert recorded_failures(failures_path) == []
+
+    # The queue is empty now
+    assert queue.run() == {}
+    assert len(dmc.deleted) == 3
+
+def test_delete_queue_rejects_unknown_kind(failures_path, fake_bus_controller):
+    from dmaapplugin.teardown import DeleteQueue
+
+    with pytest.raises(ValueError):
+        DeleteQueue(fake_bus_controller(), failures_path=failures_path).add("bridge", "b1")
+
+def test_delete_queue_retries_failures(failures_path, fake_bus_controller):
+    from dmaapplugin.teardown import DeleteQueue, recorded_failures
+
+    dmc = fake_bus_controller(fail=["s1"], missing=["c1"])
+    queue = DeleteQueue(dmc, failures_path=failures_path)
+    queue.add("subscriber", "s1")
+    queue.add("client", "c1")
+    errors = queue.run()
+
+    # Entities that are already gone count as deleted
+    assert list(errors) == [("subscriber", "s1")]
+    recorded = recorded_failures(failures_path)
+    assert [(f["kind"], f["id"], f["attempts"]) for f in recorded] == [("subscriber", "s1", 1)]
+    assert "503" in recorded[0]["error"]
+
+    # The next queue to run tries it again, along with its own deletions,
+    # but only reports its own errors
+    queue = DeleteQueue(dmc, failures_path=failures_path)
+    queue.add("feed", "f1")
+    assert queue.run() == {}
+    assert [(f["id"], f["attempts"]) for f in recorded_failures(failures_path)] == [("s1", 2)]
+
+    dmc.fail = set()
+    queue = DeleteQueue(dmc, failures_path=failures_path)
+    queue.add("feed", "f2")
+    assert queue.run() == {}
+    assert sorted(dmc.deleted) == [("feed", "f1"), ("feed", "f2"), ("subscriber", "s1")]
+    assert recorded_failures(failures_path) == []
+
+def test_delete_queue_does_not_retry_topics(failures_path, fake_bus_controller):
+    from dmaapplugin.teardown import DeleteQueue, recorded_failures
+
+    # A topic is deleted by name, which may belong to another deployment by the next run
+    dmc = fake_bus_controller(fail=["t1"])
+    queue = DeleteQueue(dmc, failures_path=failures_path)
+    queue.add("topic", "t1")
+    assert list(queue.run()) == [("topic", "t1")]
+    assert recorded_failures(failures_path) == []
+
+def test_delete_queue_gives_up(failures_path, fake_bus_controller):
+    from dmaapplugin import teardown
+
+    dmc = fake_bus_controller(fail=["f1"])
+    queue = teardown.DeleteQueue(dmc, failures_path=failures_path)
+    queue.add("feed", "f1")
+    for attempt in range(1, teardown.DELETE_MAX_ATTEMPTS):
+        queue.run()
+        assert [f["attempts"] for f in teardown.recorded_failures(failures_path)] == [attempt]
+    queue.run()
+    assert teardown.recorded_failures(failures_path) == []
+
+def test_delete_queue_does_not_retry_consul_entries(failures_path, fake_bus_controller):
+    from dmaapplugin.teardown import DeleteQueue, recorded_failures
+
+    class _BrokenConsul(object):
+        def delete_many_from_entry(self, key, delete_names):
+            raise Exception("Consul unavailable")
+
+    # By the next run, the entry may have been written again, so the failure is only reported
+    queue = DeleteQueue(fake_bus_controller(), _BrokenConsul(), failures_path=failures_path)
+    queue.add_entry("s-comp:dmaap", ["feed00"])
+    assert list(queue.run()) == [("entry", "s-comp:dmaap")]
+    assert recorded_failures(failures_path) == []
+
+def test_delete_queue_removes_names_from_entry(failures_path, fake_bus_controller):
+    from dmaapplugin.teardown import DeleteQueue
+
+    ch = _FakeConsul()
+    queue = DeleteQueue(fake_bus_controller(), ch, failures_path=failures_path)
+    queue.add_entry("a:dmaap", ["feed00"])
+    queue.add_entry("a:dmaap", ["topic00"])
+    queue.add_entry("b:dmaap", ["feed00"])
+    queue.add_entry("b:dmaap")
+    queue.run()
+    assert ch.deleted == [("a:dmaap", ["feed00", "topic00"]), "b:dmaap"]
@@ -0,0 +1,152 @@
+# ============LICENSE_START=======================================================
+# org.onap.dcae
+# ================================================================================
+# Copyright (c) 2021 AT&T Intellectual Property. All rights reserved.
+# ================================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END=========================================================
+
+#
+# Shared settings and fixtures for the k8sclient micro-benchmarks.
+# Run with "tox -e benchmark" (or "pytest benchmarks" with pytest-benchmark installed).
+
+import pytest
+
+K8S_CONFIGURATION = {
+    "image_pull_secrets": ["secret0", "secret1"],
+    "filebeat": {
+        "log_path": "/var/log/onap",
+        "data_path": "/usr/share/filebeat/data",
+        "config_path": "/usr/share/filebeat/filebeat.yml",
+        "config_subpath": "filebeat.yml",
+        "image": "filebeat-repo/filebeat:latest",
+        "config_map": "dcae-filebeat-configmap"
+    },
+    "tls": {
+        "cert_path": "/opt/certs",
+        "image": "tlsrepo/tls-init-container:1.2.3",
+        "component_cert_dir": "/opt/dcae/cacert"
+    },
+    "external_cert": {
+        "image_tag": "repo/oom-certservice-client:2.1.0",
+        "request_url": "https://request:1010/url",
+        "timeout": "30000",
+        "country": "US",
+        "organization": "Linux-Foundation",
+        "state": "California",
+        "organizational_unit": "ONAP",
+        "location": "San-Francisco",
+        "cert_secret_name": "oom-cert-service-client-tls-secret",
+        "keystore_secret_key": "keystore.jks",
+        "truststore_secret_key": "truststore.jks",
+        "keystore_password_secret_name": "oom-cert-service-client-tls-secret-password",
+        "truststore_password_secret_name": "oom-cert-service-client-tls-secret-password",
+        "keystore_password_secret_key": "password",
+        "truststore_password_secret_key": "password"
+    },
+    "cert_post_processor": {
+        "image_tag": "repo/oom-cert-post-processor:2.1.0"
+    },
+    "cbs": {
+        "base_url": "https://config-binding-service:10443/service_component_all/test-component"
+    },
+    "cmpv2_issuer": {
+        "enabled": "false",
+        "name": "cmpv2-issuer-onap"
+    }
+}
+
+EXTERNAL_CERT = {"external_cert_directory": "/opt/app/certs/",
+                 "use_external_tls": True,
+                 "cert_type": "P12",
+                 "ca_name": "RA",
+                 "external_certificate_parameters": {
+                     "common_name": "component.onap.org",
+                     "sans": "component.onap.org,component"}}
+
+
+
+def component(ports, envs, volumes, host_ports=0):
+    """
+    Build the deploy() keyword arguments for a component with 'ports' container ports (the first
+    'host_ports' of them also exposed on the k8s nodes), 'envs' environment variables and 'volumes' volumes,
+    plus ELK logging, TLS and a readiness check, as a typical blueprint would have.
+    """
+    return {
+        "ports": ["{0}:{1}".format(8000 + i, 30000 + i if i < host_ports else 0) for i in range(ports)],
+        "env": dict(("ENV_VAR_{0}".format(i), "value-{0}".format(i)) for i in range(envs)),
+        "volumes": [{"host": {"path": "/var/lib/component/{0}".format(i)},
+                     "container": {"bind": "/opt/app/data/{0}".format(i), "mode": "rw" if i % 2 else "ro"}}
+                    for i in range(volumes)],
+        "log_info": {"log_directory": "/opt/app/logs"},
+        "tls_info": {"use_tls": True, "cert_directory": "/opt/app/certs"},
+        "readiness": {"type": "http", "endpoint": "/healthcheck", "interval": "15s", "timeout": "1s"},
+        "resources": {"limits": {"cpu": 0.5, "memory": "2Gi"}, "requests": {"cpu": 0.25, "memory": "1Gi"}},
+        "labels": {"cfydeployment": "benchmark", "cfynode": "component", "cfynodeinstance": "component_1"},
+        "k8s_location": "central"
+    }
+
+
+# Component sizes: a minimal component, one like most DCAE service components, and an extreme one
+COMPONENTS = {
+    "small": component(ports=1, envs=2, volumes=1),
+    "typical": component(ports=4, envs=20, volumes=5, host_ports=1),
+    "huge": component(ports=300, envs=500, volumes=200, host_ports=50)
+}
+
+
+class _Logger(object):
+    def info(self, text):
+        pass
+
+
+class _Ctx(object):
+    logger = _Logger()
+
+
+@pytest.fixture()
+def k8s_ctx():
+    """ Minimal stand-in for the Cloudify context, with a logger that discards messages """
+    return _Ctx()
+
+
+@pytest.fixture()
+def mock_k8s_api(monkeypatch):
+    """ Make the k8s API calls used by deploy() return without contacting a k8s API server """
+    import k8sclient.k8sclient
+    from kubernetes import client
+
+    class FakeCoreV1Api(object):
+        def __init__(self, api_client=None):
+            pass
+        def create_namespaced_service(self, namespace, body):
+            return body
+
+    class FakeAppsV1Api(object):
+        def __init__(self, api_client=None):
+            pass
+        def create_namespaced_deployment(self, namespace, body):
+            return body
+
+    monkeypatch.setattr(k8sclient.k8sclient, "_configure_api", lambda location: None)
+    monkeypatch.setattr(client, "CoreV1Api", FakeCoreV1Api)
+    monkeypatch.setattr(client, "AppsV1Api", FakeAppsV1Api)
+
+
+@pytest.fixture()
+def template_cache(request):
+    """ The k8sclient template cache, emptied before and after the benchmark """
+    import k8sclient.k8sclient
+    k8sclient.k8sclient._templates.clear()
+    yield k8sclient.k8sclient._templates
+    k8sclient.k8sclient._templates.clear()
@@ -0,0 +1,98 @@
+# ============LICENSE_START=======================================================
+# org.onap.dcae
+# ================================================================================
+# Copyright (c) 2021 AT&T Intellectual Property. All rights reserved.
+# ================================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END=========================================================
+
+#
+# Benchmarks for the k8sclient functions that turn a component's blueprint parameters into
+# k8s objects, and for a full deploy() with the k8s API calls stubbed out, for small, typical
+# and huge components (see COMPONENTS in conftest.py).
+
+import copy
+
+import pytest
+from conftest import K8S_CONFIGURATION, COMPONENTS
+
+SIZES = ["small", "typical", "huge"]
+
+
+@pytest.fixture(params=SIZES)
+def component(request):
+    return request.param, copy.deepcopy(COMPONENTS[request.param])
+
+
+def test_parse_ports(benchmark, component):
+    import k8sclient.k8sclient as k
+    size, kwargs = component
+    benchmark.group = "parse_ports"
+    container_ports, port_map = benchmark(k.parse_ports, kwargs["ports"])
+    assert len(container_ports) == len(kwargs["ports"])
+
+
+def test_process_port_map(benchmark, component):
+    import k8sclient.k8sclient as k
+    size, kwargs = component
+    benchmark.group = "_process_port_map"
+    container_ports, port_map = k.parse_ports(kwargs["ports"])
+    service_ports, exposed_ports, exposed_ports_ipv6 = benchmark(k._process_port_map, port_map)
+    assert len(service_ports) == len(kwargs["ports"])
+
+
+def test_parse_volumes(benchmark, component):
+    import k8sclient.k8sclient as k
+    size, kwargs = component
+    benchmark.group = "_parse_volumes"
+    volumes, volume_mounts = benchmark(k._parse_volumes, kwargs["volumes"])
+    assert len(volumes) == len(kwargs["volumes"])
+
+
+def test_create_container_object(benchmark, component):
+    import k8sclient.k8sclient as k
+    size, kwargs = component
+    benchmark.group = "_create_container_object"
+    container_ports, port_map = k.parse_ports(kwargs["ports"])
+    volumes, volume_mounts = k._parse_volumes(kwargs["volumes"])
+    container = benchmark(k._create_container_object, "component", "repo/component:1.0.0", False,
+                          env=kwargs["env"], readiness=kwargs["readiness"], resources=kwargs["resources"],
+                          container_ports=container_ports, volume_mounts=volume_mounts)
+    assert len(container.env) == len(kwargs["env"]) + 1
+
+
+def test_create_deployment_object(benchmark, component):
+    import k8sclient.k8sclient as k
+    size, kwargs = component
+    benchmark.group = "_create_deployment_object"
+    container_ports, port_map = k.parse_ports(kwargs["ports"])
+    volumes, volume_mounts = k._parse_volumes(kwargs["volumes"])
+    containers = [k._create_container_object("component", "repo/component:1.0.0", False,
+                                             env=kwargs["env"], container_ports=container_ports,
+                                             volume_mounts=volume_mounts)]
+    dep = benchmark(k._create_deployment_object, "component", containers, [], 1, volumes, dict(kwargs["labels"]),
+                    pull_secrets=K8S_CONFIGURATION["image_pull_secrets"])
+    assert dep.metadata.name == "dep-component"
+
+
+def test_deploy(benchmark, component, k8s_ctx, mock_k8s_api):
+    import k8sclient.k8sclient as k
+    size, kwargs = component
+    benchmark.group = "deploy"
+
+    def deploy():
+        return k.deploy(k8s_ctx, "onap", "component", "repo/component:1.0.0", 1, False,
+                        K8S_CONFIGURATION, **copy.deepcopy(kwargs))
+
+    dep, deployment_description = benchmark(deploy)
+    assert deployment_description["deployment"] == "dep-component"
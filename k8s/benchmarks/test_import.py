@@ -0,0 +1,85 @@
+# ============LICENSE_START=======================================================
+# org.onap.dcae
+# ================================================================================
+# Copyright (c) 2021 AT&T Intellectual Property. All rights reserved.
+# ================================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END=========================================================
+
+#
+# Cost of importing the plugin.  Importing must not read the plugin configuration
+# (the config file and Consul), so it runs here with neither of them available:
+# network connections fail, and the benchmark fails if any is attempted.
+# Third-party packages stay loaded between rounds, so only the plugin's own modules are measured.
+
+import importlib
+import socket
+import sys
+
+import pytest
+
+PLUGIN_PACKAGES = ("k8splugin", "k8sclient", "configure")
+
+
+def _is_plugin_module(name):
+    return name.split(".")[0] in PLUGIN_PACKAGES
+
+
+@pytest.fixture()
+def no_network(monkeypatch):
+    connections = []
+
+    def connect(self, address):
+        connections.append(address)
+        raise socket.error("No network access while importing the plugin")
+
+    monkeypatch.setattr(socket.socket, "connect", connect)
+    return connections
+
+
+@pytest.fixture()
+def plugin_modules():
+    """ Put the plugin's modules (and the import finders they register) back as they were after the test """
+    saved = dict((name, module) for name, module in sys.modules.items() if _is_plugin_module(name))
+    meta_path = list(sys.meta_path)
+    yield
+    sys.meta_path[:] = meta_path
+    for name in [name for name in sys.modules if _is_plugin_module(name)]:
+        del sys.modules[name]
+    sys.modules.update(saved)
+
+
+def _unload_plugin():
+    for name in [name for name in sys.modules if _is_plugin_module(name)]:
+        del sys.modules[name]
+
+
+def test_import_plugin(benchmark, no_network, plugin_modules):
+    benchmark.pedantic(importlib.import_module, args=("k8splugin",), setup=_unload_plugin, rounds=20)
+    benchmark.extra_info["connections"] = len(no_network)
+    assert no_network == []
+
+
+def _import_missing():
+    try:
+        importlib.import_module("google.no_such_module")
+    except ImportError:
+        pass
+
+
+def test_failed_namespace_import(benchmark, plugin_modules):
+    # With the plugin loaded, a failing import in the namespaces cloudify_importer handles
+    # goes through its finder; after the first miss, the answer comes from its cache
+    from k8splugin import cloudify_importer
+    benchmark(_import_missing)
+    benchmark.extra_info.update(cloudify_importer.register_callback().stats())
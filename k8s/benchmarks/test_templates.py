@@ -0,0 +1,64 @@
+# ============LICENSE_START=======================================================
+# org.onap.dcae
+# ================================================================================
+# Copyright (c) 2021 AT&T Intellectual Property. All rights reserved.
+# ================================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END=========================================================
+
+#
+# Cost of building the sidecar and init containers for a component, with and without
+# the k8sclient template cache.  For each case, extra_info records the memory allocated
+# while building the containers for one component.
+
+import tracemalloc
+
+import pytest
+from conftest import K8S_CONFIGURATION, EXTERNAL_CERT
+
+
+def _build_sidecars(ctx, component_name):
+    import k8sclient.k8sclient as k
+    containers, init_containers, volumes, volume_mounts = [], [], [], []
+    k._add_elk_logging_sidecar(containers, volumes, volume_mounts, component_name,
+                               {"log_directory": "/opt/app/logs"}, K8S_CONFIGURATION["filebeat"])
+    k._add_tls_init_container(ctx, init_containers, volumes, volume_mounts, {"use_tls": True},
+                              K8S_CONFIGURATION["tls"])
+    k._add_external_tls_init_container(ctx, init_containers, volumes, EXTERNAL_CERT,
+                                       K8S_CONFIGURATION["external_cert"])
+    k._add_cert_post_processor_init_container(ctx, init_containers, {"use_tls": True}, K8S_CONFIGURATION["tls"],
+                                              EXTERNAL_CERT, K8S_CONFIGURATION["cert_post_processor"], False)
+    return containers, init_containers, volumes, volume_mounts
+
+
+def _allocated(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("cached", [False, True], ids=["uncached", "cached"])
+def test_sidecar_templates(benchmark, k8s_ctx, template_cache, cached):
+    def build():
+        if not cached:
+            template_cache.clear()
+        return _build_sidecars(k8s_ctx, "component")
+
+    # Warm up the cache, so the cached case measures only the copies
+    build()
+    benchmark.extra_info["peak_alloc_bytes"] = _allocated(build)
+    containers, init_containers, volumes, volume_mounts = benchmark(build)
+    assert len(containers) == 1 and len(init_containers) == 3
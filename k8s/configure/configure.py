@@ -26,6 +26,8 @@ DCAE_NAMESPACE = "dcae"
 CONSUL_DNS_NAME = "consul"
 DEFAULT_K8S_LOCATION = "central"
 DEFAULT_MAX_WAIT = 1800
+EXEC_MAX_CONCURRENCY = 10
+EXEC_TIMEOUT = 60
 
 FB_LOG_PATH = "/var/log/onap"
 FB_DATA_PATH = "/usr/share/filebeat/data"
@@ -69,6 +71,10 @@ def _set_defaults():
         "default_k8s_location" : DEFAULT_K8S_LOCATION,  # default k8s location to deploy components
         "image_pull_secrets" : [],                      # list of k8s secrets for accessing Docker registries
         "max_wait": DEFAULT_MAX_WAIT,                   # Default maximum time to wait for component to become healthy (secs)
+        "exec": {                                       # Configuration for running policy notification scripts in pods
+            "max_concurrency": EXEC_MAX_CONCURRENCY,    # maximum number of pods in which the script runs at once
+            "timeout": EXEC_TIMEOUT                     # maximum time to wait for the script to complete in a pod (secs, > 0)
+        },
         "filebeat": {                                   # Configuration for setting up filebeat container
             "log_path" : FB_LOG_PATH,                   # mount point for log volume in filebeat container
             "data_path" : FB_DATA_PATH,                 # mount point for data volume in filebeat container
@@ -117,6 +123,8 @@ def configure(config_path=_CONFIG_PATH, key = _CONSUL_KEY):
     Get configuration information from local file and Consul.
     Note that the Cloudify context ("ctx") isn't available at
     module load time.
+    The Consul configuration is read once in the process (see discovery.get_cached_kv_value),
+    so calling configure() again is cheap.
     """
 
     from cloudify.exceptions import NonRecoverableError
@@ -134,8 +142,7 @@ def configure(config_path=_CONFIG_PATH, key = _CONSUL_KEY):
         config["consul_host"] = c.get('consul','address')
 
         # Get the rest of the config from Consul
-        conn = discovery.create_kv_conn(config["consul_host"])
-        val = discovery.get_kv_value(conn, key)
+        val = discovery.get_cached_kv_value(config["consul_host"], key)
 
         # Merge Consul results into the config
         config.update(val)
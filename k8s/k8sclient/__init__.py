@@ -16,4 +16,4 @@
 # limitations under the License.
 # ============LICENSE_END=========================================================
 #
-from .k8sclient import deploy, undeploy, is_available, scale, upgrade, rollback, execute_command_in_deployment, parse_ports
+from .k8sclient import deploy, undeploy, is_available, wait_for_deployment, informer_stats, scale, upgrade, rollback, execute_command_in_deployment, parse_ports
@@ -0,0 +1,253 @@
+# ============LICENSE_START=======================================================
+# org.onap.dcae
+# ================================================================================
+# Copyright (c) 2021 AT&T Intellectual Property. All rights reserved.
+# ================================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END=========================================================
+
+import threading
+import time
+
+from kubernetes import client, watch
+
+# Maximum duration (secs) of a single watch request.  Also bounds how long an idle informer lingers.
+INFORMER_WATCH_TIMEOUT = 60
+# An informer with no waiters shuts down its watch after this many seconds
+INFORMER_IDLE_TIMEOUT = 600
+# Delay (secs) before retrying after the list or watch fails; doubles on each failure in a row
+INFORMER_RETRY_DELAY = 5
+# Longest delay (secs) between retries
+INFORMER_MAX_RETRY_DELAY = 60
+
+HTTP_GONE = 410
+
+
+class InformerError(RuntimeError):
+    pass
+
+
+class InformerStopped(InformerError):
+    """ The informer was stopped while a thread was waiting on it """
+    pass
+
+
+class DeploymentInformer(object):
+    """
+    Local cache of the k8s Deployments in one namespace, kept up to date by a single
+    list+watch stream running in a background thread.
+
+    Any number of threads can wait for a condition on a deployment in the namespace with wait_for().
+    They all share the one watch stream, instead of each of them polling or watching the API server.
+    The informer starts on the first wait and stops after it has had no waiters for idle_timeout seconds.
+    """
+
+    def __init__(self, api_client, namespace,
+                 watch_timeout=INFORMER_WATCH_TIMEOUT,
+                 idle_timeout=INFORMER_IDLE_TIMEOUT,
+                 retry_delay=INFORMER_RETRY_DELAY,
+                 max_retry_delay=INFORMER_MAX_RETRY_DELAY):
+        self.api_client = api_client
+        self.namespace = namespace
+        self.watch_timeout = watch_timeout
+        self.idle_timeout = idle_timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._apps = client.AppsV1Api(api_client)
+        self._cond = threading.Condition()
+        self._deployments = {}
+        self._synced = False
+        self._error = None
+        self._stopped = False
+        self._thread = None
+        self._waiters = 0
+        self._last_used = time.time()
+        self._counters = {"lists": 0, "watches": 0, "events": 0, "errors": 0, "waits": 0, "timeouts": 0}
+
+    @property
+    def waiters(self):
+        """ Number of threads currently waiting on this informer """
+        with self._cond:
+            return self._waiters
+
+    def stats(self):
+        """ Snapshot of the informer's state and counters """
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                "namespace": self.namespace,
+                "waiters": self._waiters,
+                "deployments": len(self._deployments),
+                "synced": self._synced,
+                "running": self._thread is not None
+            })
+            return stats
+
+    def is_running(self):
+        with self._cond:
+            return self._thread is not None
+
+    def start(self):
+        with self._cond:
+            self._stopped = False
+            if self._thread is None:
+                self._error = None
+                self._thread = threading.Thread(target=self._run, name="informer-{0}".format(self.namespace))
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self):
+        """ Stop the watch, and wake any threads waiting on the informer with InformerStopped """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def get(self, name):
+        """ Get the cached Deployment named 'name', or None """
+        with self._cond:
+            return self._deployments.get(name)
+
+    def wait_for(self, name, condition, timeout=None):
+        """
+        Wait until condition(deployment) is true for the Deployment named 'name'.
+        timeout: maximum time to wait (in seconds); None means wait indefinitely.
+        Returns True if the condition was met, False if the timeout expired first.
+        Raises InformerError if the informer can't list or watch the namespace, so
+        the caller can fall back to some other way of checking, or InformerStopped if
+        the informer is stopped during the wait.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        self.start()
+        with self._cond:
+            self._waiters += 1
+            self._counters["waits"] += 1
+            try:
+                while True:
+                    if self._stopped:
+                        raise InformerStopped("Informer for {0} stopped".format(self.namespace))
+                    if self._synced:
+                        dep = self._deployments.get(name)
+                        if dep is not None and condition(dep):
+                            return True
+                    elif self._error is not None:
+                        raise InformerError(self._error)
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self._counters["timeouts"] += 1
+                            return False
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait(self.watch_timeout)
+            finally:
+                self._waiters -= 1
+                self._last_used = time.time()
+
+    def _is_idle(self):
+        with self._cond:
+            return self._waiters == 0 and time.time() - self._last_used > self.idle_timeout
+
+    def _should_exit(self):
+        # Decided under the lock, so that a concurrent start() either keeps this thread going
+        # or sees that it has gone and starts a new one
+        with self._cond:
+            if self._stopped or self._is_idle():
+                self._thread = None
+                self._synced = False
+                return True
+            return False
+
+    def _run(self):
+        failures = 0
+        while not self._should_exit():
+            try:
+                resource_version = self._list()
+                if self._watch(resource_version):
+                    failures = 0
+                    continue
+            except Exception as e:
+                with self._cond:
+                    self._counters["errors"] += 1
+                    self._synced = False
+                    self._error = e
+                    self._cond.notify_all()
+            # The list or watch failed, or the watch ended without getting anywhere:
+            # back off before listing again, so we don't hammer the API server
+            failures += 1
+            self._pause(min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay))
+
+    def _pause(self, delay):
+        """ Sleep for 'delay' seconds, or until the informer is stopped """
+        with self._cond:
+            if not self._stopped:
+                self._cond.wait(delay)
+
+    def _list(self):
+        deployments = self._apps.list_namespaced_deployment(self.namespace)
+        with self._cond:
+            self._deployments = dict((dep.metadata.name, dep) for dep in deployments.items)
+            self._counters["lists"] += 1
+            self._synced = True
+            self._error = None
+            self._cond.notify_all()
+        return deployments.metadata.resource_version
+
+    def _watch(self, resource_version):
+        """
+        Apply watch events to the cache until the informer goes idle or the resource version expires,
+        and the cache has to be listed again.
+        Returns True if the watch made progress (delivered events, or ran for a while), False if it
+        failed straight away.  The client library never hands us ERROR events: it raises ApiException
+        for them, except for an expired resource version (410) on a request with a timeout, which it
+        retries once and then ends the stream quietly.  So a watch request that ends early without
+        any events counts as a failure too.
+        """
+        progress = False
+        while not self._stopped:
+            started = time.time()
+            events = 0
+            w = watch.Watch()
+            with self._cond:
+                self._counters["watches"] += 1
+            try:
+                for event in w.stream(self._apps.list_namespaced_deployment, self.namespace,
+                                      resource_version=resource_version,
+                                      timeout_seconds=self.watch_timeout):
+                    self._apply(event)
+                    events += 1
+                    progress = True
+                    if self._stopped:
+                        w.stop()
+            except client.rest.ApiException as e:
+                if e.status == HTTP_GONE:
+                    return progress
+                raise
+            if events == 0 and time.time() - started < self.watch_timeout / 2.0:
+                return progress
+            progress = True
+            if w.resource_version:
+                resource_version = w.resource_version
+            if self._is_idle():
+                return True
+        return True
+
+    def _apply(self, event):
+        dep = event["object"]
+        with self._cond:
+            if event["type"] == "DELETED":
+                self._deployments.pop(dep.metadata.name, None)
+            else:
+                self._deployments[dep.metadata.name] = dep
+            self._counters["events"] += 1
+            self._cond.notify_all()
@@ -22,11 +22,16 @@
 from distutils import util
 import os
 import re
+import threading
+import time
 import uuid
 import base64
 
+import decimal
 from binascii import hexlify
+from concurrent import futures
 from kubernetes import config, client, stream
+from .informer import DeploymentInformer, InformerStopped
 from .sans_parser import SansParser
 
 # Default values for readiness probe
@@ -36,17 +41,42 @@ PROBE_DEFAULT_TIMEOUT = 1
 # Location of k8s cluster config file ("kubeconfig")
 K8S_CONFIG_PATH = "/opt/onap/kube/kubeconfig"
 
+# Maximum number of pooled (keep-alive) HTTP connections per k8s API client
+K8S_CONNECTION_POOL_SIZE = 8
+# Parameters for polling for a deployment to become ready
+POLL_INITIAL_INTERVAL = 1       # Initial interval (secs) between status checks if the watch can't be used
+POLL_MAX_INTERVAL = 30          # Upper bound for the (exponentially increasing) interval between status checks
+# Maximum number of sidecar and init container templates to keep
+TEMPLATE_CACHE_SIZE = 256
+
+# Parameters for executing a command in the pods of a deployment
+EXEC_MAX_CONCURRENCY = 10       # Maximum number of pods in which the command runs at once
+EXEC_TIMEOUT = 60               # Maximum time (secs) to wait for the command to complete in a pod
+
+# Maximum age (secs) of a cached k8s API client before it's rebuilt, so credentials
+# that can't refresh themselves (e.g. tokens from an exec plugin) are picked up again
+K8S_API_CLIENT_MAX_AGE = 3600
+
 # Regular expression for interval/timeout specification
 INTERVAL_SPEC = re.compile("^([0-9]+)(s|m|h)?$")
 # Conversion factors to seconds
 FACTORS = {None: 1, "s": 1, "m": 60, "h": 3600}
 
-# Regular expression for port mapping
-# group 1: container port
-# group 2: / + protocol
+# Regular expression for port mapping.  A port may also be a range of ports, e.g. "30000-30999/udp:0".
+# group 1: container port (or first container port of a range)
+# group 2: last container port of a range
 # group 3: protocol
-# group 4: host port
-PORTS = re.compile("^([0-9]+)(/(udp|UDP|tcp|TCP))?:([0-9]+)$")
+# group 4: host port (or first host port of a range)
+# group 5: last host port of a range
+PORTS = re.compile("^([0-9]+)(?:-([0-9]+))?(?:/(udp|UDP|tcp|TCP))?:([0-9]+)(?:-([0-9]+))?$")
+
+# Regular expression and multipliers for k8s resource quantities, e.g. "500m" or "2Gi"
+QUANTITY = re.compile("^([0-9]+(?:\\.[0-9]*)?|\\.[0-9]+)(m|k|M|G|T|Ki|Mi|Gi|Ti)?$")
+QUANTITY_SUFFIXES = {None: 1, "m": decimal.Decimal("0.001"),
+                     "k": 10**3, "M": 10**6, "G": 10**9, "T": 10**12,
+                     "Ki": 2**10, "Mi": 2**20, "Gi": 2**30, "Ti": 2**40}
+# Fields holding maps of quantities, as (parent key, key); values anywhere else aren't quantities
+QUANTITY_FIELDS = (("resources", "limits"), ("resources", "requests"))
 
 # Constants for external_cert
 MOUNT_PATH = "/etc/onap/oom/certservice/certs/"
@@ -69,10 +99,13 @@ def _create_exposed_v6_service_name(component_name):
     return ("x{0}-ipv6".format(component_name))[:63]
 
 
-def _configure_api(location=None):
+def _load_client_configuration(location=None):
+    """ Build a k8s client Configuration for the cluster at 'location' """
+    configuration = client.Configuration()
     # Look for a kubernetes config file
     if os.path.exists(K8S_CONFIG_PATH):
-        config.load_kube_config(config_file=K8S_CONFIG_PATH, context=location, persist_config=False)
+        config.load_kube_config(config_file=K8S_CONFIG_PATH, context=location,
+                                client_configuration=configuration, persist_config=False)
     else:
         # Maybe we're running in a k8s container and we can use info provided by k8s
         # We would like to use:
@@ -89,7 +122,43 @@ def _configure_api(location=None):
             token_filename=config.incluster_config.SERVICE_TOKEN_FILENAME,
             cert_filename=config.incluster_config.SERVICE_CERT_FILENAME,
             environ=localenv
-        ).load_and_set()
+        ).load_and_set(configuration)
+    configuration.connection_pool_maxsize = K8S_CONNECTION_POOL_SIZE
+    return configuration
+
+
+def _config_file_mtime():
+    try:
+        return os.stat(K8S_CONFIG_PATH).st_mtime
+    except OSError:
+        return None
+
+
+# Process-wide cache of k8s API clients, keyed by location.
+# Each entry is a tuple (kubeconfig mtime, creation time, ApiClient).
+_api_clients = {}
+_api_clients_lock = threading.Lock()
+
+
+def _configure_api(location=None):
+    """
+    Get an ApiClient for the k8s cluster at 'location'.
+    Clients are cached and shared across calls (and threads), so the kubeconfig file is only parsed
+    once and the HTTPS connections to the API server are kept alive and reused.
+    A cached client is replaced when the kubeconfig file changes or when it reaches K8S_API_CLIENT_MAX_AGE.
+    (Tokens for the in-cluster service account and for GCP auth are refreshed by the client library itself.)
+    """
+    mtime = _config_file_mtime()
+    now = time.time()
+    with _api_clients_lock:
+        cached = _api_clients.get(location)
+        if cached:
+            cached_mtime, created, api_client = cached
+            if cached_mtime == mtime and now - created < K8S_API_CLIENT_MAX_AGE:
+                return api_client
+        api_client = client.ApiClient(_load_client_configuration(location))
+        _api_clients[location] = (mtime, now, api_client)
+        return api_client
 
 
 def _parse_interval(t):
@@ -271,9 +340,10 @@ def _create_service_object(service_name, component_name, service_ports, annotati
     return service
 
 
-def create_secret_with_password(namespace, secret_prefix, password_key, password_length):
+def create_secret_with_password(namespace, secret_prefix, password_key, password_length, api_client=None):
     """
     Creates K8s secret object with a generated password.
+    Uses the k8s API client 'api_client' if provided, otherwise the library default client.
     Returns: secret name and data key.
 
     Example usage:
@@ -286,7 +356,7 @@ def create_secret_with_password(namespace, secret_prefix, password_key, password
     key = password_key
     data = {key: password_base64}
 
-    response = _create_k8s_secret(namespace, metadata, data, 'Opaque')
+    response = _create_k8s_secret(namespace, metadata, data, 'Opaque', api_client)
     secret_name = response.metadata.name
     return secret_name, key
 
@@ -304,41 +374,65 @@ def _encode_base64(value):
     return encoded_value
 
 
-def _create_k8s_secret(namespace, metadata, data, secret_type):
+def _create_k8s_secret(namespace, metadata, data, secret_type, api_client=None):
     api_version = 'v1'
     kind = 'Secret'
     body = client.V1Secret(api_version, data, kind, metadata, type=secret_type)
 
-    response = client.CoreV1Api().create_namespaced_secret(namespace, body)
+    response = client.CoreV1Api(api_client).create_namespaced_secret(namespace, body)
     return response
 
 
+def _parse_port_spec(p):
+    '''
+    Parse one port specification 'p' (see parse_ports).
+    Returns the protocol and a list of (container port, host port) pairs.
+    '''
+    m = PORTS.match(p.strip())
+    if not m:
+        raise ValueError("Bad port specification: {0}".format(p))
+    cfirst = int(m.group(1))
+    clast = int(m.group(2) or cfirst)
+    proto = (m.group(3) or "TCP").upper()
+    hfirst = int(m.group(4))
+    hlast = int(m.group(5) or hfirst)
+    if clast < cfirst or hlast < hfirst or (m.group(5) is not None and hfirst == 0):
+        raise ValueError("Bad port range: {0}".format(p))
+    count = clast - cfirst + 1
+    if hfirst == 0 and m.group(5) is None:
+        # Not exposed on the k8s nodes
+        return proto, [(cport, 0) for cport in range(cfirst, clast + 1)]
+    if hlast - hfirst + 1 != count:
+        raise ValueError("Container and host port ranges differ in size: {0}".format(p))
+    return proto, [(cfirst + i, hfirst + i) for i in range(count)]
+
+
 def parse_ports(port_list):
     """
     Parse the port list into a list of container ports (needed to create the container)
     and to a set of port mappings to set up k8s services.
+    Each port is a string of the form "<container port>[/<protocol>]:<host port>", or a dict
+    whose "concat" list makes up such a string and whose optional "ipv6" flag selects IPv6.
+    The container port can be a range ("30000-30999"), in which case the host port is either 0
+    or a range of the same size.
+    Returns the container ports, as a list of (port, protocol) tuples, and the port map,
+    a dict mapping (container port, protocol, ipv6) tuples to host ports.
     """
     container_ports = []
+    seen = set()
     port_map = {}
     for p in port_list:
         ipv6 = False
         if type(p) is dict:
             ipv6 = "ipv6" in p and p['ipv6']
             p = "".join(str(v) for v in p['concat'])
-        m = PORTS.match(p.strip())
-        if m:
-            cport = int(m.group(1))
-            hport = int(m.group(4))
-            if m.group(3):
-                proto = (m.group(3)).upper()
-            else:
-                proto = "TCP"
+        proto, mappings = _parse_port_spec(p)
+        for cport, hport in mappings:
             port = (cport, proto)
-            if port not in container_ports:
+            if port not in seen:
+                seen.add(port)
                 container_ports.append(port)
             port_map[(cport, proto, ipv6)] = hport
-        else:
-            raise ValueError("Bad port specification: {0}".format(p))
 
     return container_ports, port_map
 
@@ -347,8 +441,10 @@ def _parse_volumes(volume_list):
     volumes = []
     volume_mounts = []
     for v in volume_list:
-        vname = str(uuid.uuid4())
         vcontainer = v['container']['bind']
+        # Derive the volume name from the mount path, so the same volume list always
+        # produces the same pod spec (which lets a redeployment be recognized as unchanged)
+        vname = str(uuid.uuid5(uuid.NAMESPACE_URL, vcontainer))
         vro = (v['container'].get('mode') == 'ro')
         if ('host' in v) and ('path' in v['host']):
             vhost = v['host']['path']
@@ -363,35 +459,90 @@ def _parse_volumes(volume_list):
     return volumes, volume_mounts
 
 
+# Cache of prebuilt k8s objects for sidecar and init containers, keyed by (template name, frozen arguments).
+# Building k8s model objects is relatively expensive, and most components get identical copies.
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def _freeze(value):
+    ''' Convert 'value' (made of dicts, lists and scalars) into an equivalent hashable value '''
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _clone(obj):
+    '''
+    Copy a k8s model object (or a list, tuple or dict of them) all the way down.
+    Much cheaper than copy.deepcopy or building the object again, because the copies share
+    the original's client Configuration instead of copying it or creating a new one.
+    '''
+    if isinstance(obj, list):
+        return [_clone(v) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(_clone(v) for v in obj)
+    if isinstance(obj, dict):
+        return dict((k, _clone(v)) for k, v in obj.items())
+    if hasattr(obj, "openapi_types"):
+        clone = object.__new__(type(obj))
+        clone.__dict__.update((k, v if k == "local_vars_configuration" else _clone(v)) for k, v in obj.__dict__.items())
+        return clone
+    return obj
+
+
+def _from_template(name, args, build):
+    '''
+    Get a private copy of the objects that build(*args) returns, building them only the first time
+    they're needed for 'name' and 'args'.
+    '''
+    key = (name, _freeze(args))
+    with _templates_lock:
+        template = _templates.get(key)
+    if template is None:
+        template = build(*args)
+        with _templates_lock:
+            if len(_templates) >= TEMPLATE_CACHE_SIZE:
+                _templates.clear()
+            _templates[key] = template
+    return _clone(template)
+
+
+def _elk_logging_sidecar_template(filebeat):
+    # Build the volumes for the ELK logging sidecar, and the sidecar container itself, without
+    # the mount for the component's log directory (which depends on the component).
+    # The configuration data is in a k8s ConfigMap that should be created when DCAE is installed.
+    volumes = [client.V1Volume(name="component-log", empty_dir=client.V1EmptyDirVolumeSource()),
+               client.V1Volume(name="filebeat-data", empty_dir=client.V1EmptyDirVolumeSource()),
+               client.V1Volume(name="filebeat-conf",
+                               config_map=client.V1ConfigMapVolumeSource(name=filebeat["config_map"]))]
+    sidecar_volume_mounts = [client.V1VolumeMount(name="filebeat-data", mount_path=filebeat["data_path"]),
+                             client.V1VolumeMount(name="filebeat-conf", mount_path=filebeat["config_path"],
+                                                  sub_path=filebeat["config_subpath"])]
+    container = _create_container_object("filebeat", filebeat["image"], False, volume_mounts=sidecar_volume_mounts)
+    return volumes, container
+
+
 def _add_elk_logging_sidecar(containers, volumes, volume_mounts, component_name, log_info, filebeat):
     if not log_info or not filebeat:
         return
     log_dir = log_info.get("log_directory")
     if not log_dir:
         return
-    sidecar_volume_mounts = []
 
-    # Create the volume for component log files and volume mounts for the component and sidecar containers
-    volumes.append(client.V1Volume(name="component-log", empty_dir=client.V1EmptyDirVolumeSource()))
+    # Get the volumes for component log files, sidecar data, and sidecar configuration data,
+    # and the sidecar container with its mounts for the data and configuration volumes
+    sidecar_volumes, sidecar = _from_template("filebeat", (filebeat,), _elk_logging_sidecar_template)
+    volumes.extend(sidecar_volumes)
+
+    # Create the volume mounts for the component log files in the component and sidecar containers
     volume_mounts.append(client.V1VolumeMount(name="component-log", mount_path=log_dir))
     sc_path = log_info.get("alternate_fb_path") or "{0}/{1}".format(filebeat["log_path"], component_name)
-    sidecar_volume_mounts.append(client.V1VolumeMount(name="component-log", mount_path=sc_path))
+    sidecar.volume_mounts.insert(0, client.V1VolumeMount(name="component-log", mount_path=sc_path))
 
-    # Create the volume for sidecar data and the volume mount for it
-    volumes.append(client.V1Volume(name="filebeat-data", empty_dir=client.V1EmptyDirVolumeSource()))
-    sidecar_volume_mounts.append(client.V1VolumeMount(name="filebeat-data", mount_path=filebeat["data_path"]))
-
-    # Create the volume for the sidecar configuration data and the volume mount for it
-    # The configuration data is in a k8s ConfigMap that should be created when DCAE is installed.
-    volumes.append(
-        client.V1Volume(name="filebeat-conf", config_map=client.V1ConfigMapVolumeSource(name=filebeat["config_map"])))
-    sidecar_volume_mounts.append(
-        client.V1VolumeMount(name="filebeat-conf", mount_path=filebeat["config_path"],
-                             sub_path=filebeat["config_subpath"]))
-
-    # Finally create the container for the sidecar
-    containers.append(
-        _create_container_object("filebeat", filebeat["image"], False, volume_mounts=sidecar_volume_mounts))
+    containers.append(sidecar)
 
 
 def _add_tls_init_container(ctx, init_containers, volumes, volume_mounts, tls_info, tls_config):
@@ -409,14 +560,16 @@ def _add_tls_init_container(ctx, init_containers, volumes, volume_mounts, tls_in
     env = {}
     env["TLS_SERVER"] = "true" if tls_info.get("use_tls") else "false"
 
-    # Create the certificate volume and volume mounts
-    volumes.append(client.V1Volume(name="tls-info", empty_dir=client.V1EmptyDirVolumeSource()))
-    volume_mounts.append(client.V1VolumeMount(name="tls-info", mount_path=cert_directory))
-    init_volume_mounts = [client.V1VolumeMount(name="tls-info", mount_path=tls_config["cert_path"])]
+    # Create the certificate volume and volume mounts, and the init container
+    def build(docker_image, cert_path, env):
+        volume = client.V1Volume(name="tls-info", empty_dir=client.V1EmptyDirVolumeSource())
+        init_volume_mounts = [client.V1VolumeMount(name="tls-info", mount_path=cert_path)]
+        return volume, _create_container_object("init-tls", docker_image, False, volume_mounts=init_volume_mounts, env=env)
 
-    # Create the init container
-    init_containers.append(
-        _create_container_object("init-tls", docker_image, False, volume_mounts=init_volume_mounts, env=env))
+    volume, init_container = _from_template("init-tls", (docker_image, tls_config["cert_path"], env), build)
+    volumes.append(volume)
+    volume_mounts.append(client.V1VolumeMount(name="tls-info", mount_path=cert_directory))
+    init_containers.append(init_container)
 
 
 def _add_external_tls_init_container(ctx, init_containers, volumes, external_cert, external_tls_config):
@@ -455,19 +608,26 @@ def _add_external_tls_init_container(ctx, init_containers, volumes, external_cer
         {"env_name": "TRUSTSTORE_PASSWORD",
          "secret_name": external_tls_config.get("truststore_password_secret_name"),
          "secret_key": external_tls_config.get("truststore_password_secret_key")}
-    # Create the volumes and volume mounts
-    projected_volume = _create_projected_tls_volume(external_tls_config.get("cert_secret_name"),
-                                                    keystore_secret_key,
-                                                    truststore_secret_key)
-
-    volumes.append(client.V1Volume(name="tls-volume", projected=projected_volume))
-    init_volume_mounts = [
-        client.V1VolumeMount(name="tls-info", mount_path=external_cert.get("external_cert_directory")),
-        client.V1VolumeMount(name="tls-volume", mount_path=MOUNT_PATH)]
-
-    # Create the init container
-    init_containers.append(
-        _create_container_object("cert-service-client", docker_image, False, volume_mounts=init_volume_mounts, env=env, env_from_secret=env_from_secret))
+    # Create the volumes and volume mounts, and the init container
+    def build(docker_image, env, env_from_secret, external_cert_directory, cert_secret_name):
+        projected_volume = _create_projected_tls_volume(cert_secret_name,
+                                                        keystore_secret_key,
+                                                        truststore_secret_key)
+        volume = client.V1Volume(name="tls-volume", projected=projected_volume)
+        init_volume_mounts = [
+            client.V1VolumeMount(name="tls-info", mount_path=external_cert_directory),
+            client.V1VolumeMount(name="tls-volume", mount_path=MOUNT_PATH)]
+        return volume, _create_container_object("cert-service-client", docker_image, False,
+                                                volume_mounts=init_volume_mounts, env=env,
+                                                env_from_secret=env_from_secret)
+
+    volume, init_container = _from_template("cert-service-client",
+                                            (docker_image, env, env_from_secret,
+                                             external_cert.get("external_cert_directory"),
+                                             external_tls_config.get("cert_secret_name")),
+                                            build)
+    volumes.append(volume)
+    init_containers.append(init_container)
 
 
 def _create_projected_tls_volume(secret_name, keystore_secret_key, truststore_secret_key):
@@ -511,14 +671,17 @@ def _add_cert_post_processor_init_container(ctx, init_containers, tls_info, tls_
     ctx.logger.info("KEYSTORE_SOURCE_PATHS:        " + env["KEYSTORE_SOURCE_PATHS"])
     ctx.logger.info("KEYSTORE_DESTINATION_PATHS:   " + env["KEYSTORE_DESTINATION_PATHS"])
 
-    # Create the volumes and volume mounts
-    init_volume_mounts = [client.V1VolumeMount(name="tls-info", mount_path=tls_cert_dir)]
-    if isCertManagerIntegration:
-        init_volume_mounts.append(client.V1VolumeMount(
-            name="certmanager-certs-volume", mount_path=ext_cert_dir))
-    # Create the init container
+    # Create the volume mounts and the init container
+    def build(docker_image, env, tls_cert_dir, ext_cert_dir, isCertManagerIntegration):
+        init_volume_mounts = [client.V1VolumeMount(name="tls-info", mount_path=tls_cert_dir)]
+        if isCertManagerIntegration:
+            init_volume_mounts.append(client.V1VolumeMount(
+                name="certmanager-certs-volume", mount_path=ext_cert_dir))
+        return _create_container_object("cert-post-processor", docker_image, False, volume_mounts=init_volume_mounts, env=env)
+
     init_containers.append(
-        _create_container_object("cert-post-processor", docker_image, False, volume_mounts=init_volume_mounts, env=env))
+        _from_template("cert-post-processor",
+                       (docker_image, env, tls_cert_dir, ext_cert_dir, isCertManagerIntegration), build))
 
 
 def _get_file_extension(output_type):
@@ -548,29 +711,35 @@ def _get_keystore_destination_paths(output_type, tls_cert_dir):
 
 
 def _process_port_map(port_map):
-    service_ports = []  # Ports exposed internally on the k8s network
-    exposed_ports = []  # Ports to be mapped to ports on the k8s nodes via NodePort
+    # Sort the ports into those exposed internally on the k8s network and those to be mapped to ports
+    # on the k8s nodes via NodePort (IPv4 and IPv6), as (port, protocol, node port) tuples.
+    # Only then build the k8s objects for them.
+    service_ports = []
+    exposed_ports = []
     exposed_ports_ipv6 = []
+    seen = set()
     for (cport, proto, ipv6), hport in port_map.items():
-        name = "xport-{0}-{1}".format(proto[0].lower(), cport)
         cport = int(cport)
         hport = int(hport)
-        port = client.V1ServicePort(port=cport, protocol=proto, name=name[1:])
-        if port not in service_ports:
-            service_ports.append(port)
+        if (cport, proto) not in seen:
+            seen.add((cport, proto))
+            service_ports.append((cport, proto, None))
         if hport != 0:
-            if ipv6:
-                exposed_ports_ipv6.append(client.V1ServicePort(port=cport, protocol=proto, node_port=hport, name=name))
-            else:
-                exposed_ports.append(client.V1ServicePort(port=cport, protocol=proto, node_port=hport, name=name))
-    return service_ports, exposed_ports, exposed_ports_ipv6
+            (exposed_ports_ipv6 if ipv6 else exposed_ports).append((cport, proto, hport))
+
+    def service_port(cport, proto, hport, prefix):
+        name = "{0}-{1}-{2}".format(prefix, proto[0].lower(), cport)
+        return client.V1ServicePort(port=cport, protocol=proto, node_port=hport, name=name)
+
+    return ([service_port(cport, proto, hport, "port") for cport, proto, hport in service_ports],
+            [service_port(cport, proto, hport, "xport") for cport, proto, hport in exposed_ports],
+            [service_port(cport, proto, hport, "xport") for cport, proto, hport in exposed_ports_ipv6])
 
 
 def _service_exists(location, namespace, component_name):
     exists = False
     try:
-        _configure_api(location)
-        client.CoreV1Api().read_namespaced_service(_create_service_name(component_name), namespace)
+        client.CoreV1Api(_configure_api(location)).read_namespaced_service(_create_service_name(component_name), namespace)
         exists = True
     except client.rest.ApiException:
         pass
@@ -578,26 +747,7 @@ def _service_exists(location, namespace, component_name):
     return exists
 
 
-def _patch_deployment(location, namespace, deployment, modify):
-    '''
-    Gets the current spec for 'deployment' in 'namespace'
-    in the k8s cluster at 'location',
-    uses the 'modify' function to change the spec,
-    then sends the updated spec to k8s.
-    '''
-    _configure_api(location)
-
-    # Get deployment spec
-    spec = client.AppsV1Api().read_namespaced_deployment(deployment, namespace)
-
-    # Apply changes to spec
-    spec = modify(spec)
-
-    # Patch the deploy with updated spec
-    client.AppsV1Api().patch_namespaced_deployment(deployment, namespace, spec)
-
-
-def _execute_command_in_pod(location, namespace, pod_name, command):
+def _execute_command_in_pod(location, namespace, pod_name, command, timeout=EXEC_TIMEOUT):
     '''
     Execute the command (specified by an argv-style list in  the "command" parameter) in
     the specified pod in the specified namespace at the specified location.
@@ -614,24 +764,33 @@ def _execute_command_in_pod(location, namespace, pod_name, command):
         - https://github.com/kubernetes-client/python/issues/409
         - https://github.com/kubernetes-client/python/issues/526
 
-    The main consequence of the workaround using "stream" is that the caller does not get an indication
-    of the exit code returned by the command when it completes execution.   It turns out that the
-    original implementation of notification in the Docker plugin did not use this result, so we can
-    still match the original notification functionality.
+    We ask "stream" for the underlying websocket client rather than the preloaded output, so that we
+    can bound the time we wait for the command ("timeout", in seconds) and pick up its exit code
+    from the error channel once it completes.  If the command is still running when the timeout
+    expires, we close the connection and report the pod as timed out.  The timeout must be
+    greater than 0:  the websocket client treats 0 as "no timeout" and would wait forever.
+
+    Returns a dict with the pod name, any output sent by the command to stdout or stderr (so it
+    can be logged), a status ("ok", "failed", "timeout", or "not found"), the command's exit code
+    (None if not known), and the time taken in seconds.
 
-    The "stream" approach returns a string containing any output sent by the command to stdout or stderr.
-    We'll return that so it can logged.
+    The "stream" wrapper temporarily replaces the request method of the API client it's given,
+    so we give it a private client (sharing the cached configuration) rather than the shared one.
     '''
-    _configure_api(location)
+    if not timeout > 0:
+        raise ValueError("Command timeout must be greater than 0, not {0}".format(timeout))
+    start = time.time()
+    exec_client = client.ApiClient(_configure_api(location).configuration)
     try:
-        output = stream.stream(client.CoreV1Api().connect_get_namespaced_pod_exec,
-                               name=pod_name,
-                               namespace=namespace,
-                               command=command,
-                               stdout=True,
-                               stderr=True,
-                               stdin=False,
-                               tty=False)
+        resp = stream.stream(client.CoreV1Api(exec_client).connect_get_namespaced_pod_exec,
+                             name=pod_name,
+                             namespace=namespace,
+                             command=command,
+                             stdout=True,
+                             stderr=True,
+                             stdin=False,
+                             tty=False,
+                             _preload_content=False)
     except client.rest.ApiException as e:
         # If the exception indicates the pod wasn't found,  it's not a fatal error.
         # It existed when we enumerated the pods for the deployment but no longer exists.
@@ -641,11 +800,34 @@ def _execute_command_in_pod(location, namespace, pod_name, command):
         # be 404 if the pod isn't found, but empirical testing reveals that "status" is set
         # to zero.)
         if "404 not found" in e.reason.lower():
-            output = "Pod not found"
+            return {"pod": pod_name, "output": "Pod not found", "status": "not found",
+                    "exit_code": None, "latency": time.time() - start}
         else:
             raise e
 
-    return {"pod": pod_name, "output": output}
+    try:
+        resp.run_forever(timeout=timeout)
+        if resp.is_open():
+            status, exit_code = "timeout", None
+        else:
+            exit_code = _exec_returncode(resp)
+            status = "ok" if exit_code == 0 else "failed"
+        output = resp.read_all()
+    finally:
+        resp.close()
+
+    return {"pod": pod_name, "output": output, "status": status,
+            "exit_code": exit_code, "latency": time.time() - start}
+
+def _exec_returncode(resp):
+    '''
+    Get the exit code of a completed command from the websocket client "resp".
+    Returns None if k8s didn't send a status we can interpret.
+    '''
+    try:
+        return resp.returncode
+    except Exception:
+        return None
 
 
 def _create_certificate_subject(external_tls_config):
@@ -760,9 +942,12 @@ def create_certificate_object(ctx, cert_secret_name, external_cert_data, externa
     return custom_resource
 
 
-def _create_certificate_custom_resource(ctx, external_cert_data, external_tls_config, issuer, namespace, component_name, volumes, volume_mounts, deployment_description):
+def _create_certificate_custom_resource(ctx, external_cert_data, external_tls_config, issuer, namespace, component_name, volumes, volume_mounts, journal, api_client=None, password_secret_name=None):
     """
-    Create certificate custom resource for provided configuration
+    Build the certificate custom resource for provided configuration.
+    The certificate itself is created later, along with the other k8s objects for the component,
+    but a secret holding the keystore password (if one is needed) is created here, because the
+    volumes for the deployment refer to the secret by its generated name.
     :param ctx: context
     :param external_cert_data: object contains certificate common name and
     SANs list
@@ -772,15 +957,17 @@ def _create_certificate_custom_resource(ctx, external_cert_data, external_tls_co
     :param component_name: component name
     :param volumes: list of deployment volume
     :param volume_mounts: list of deployment volume mounts
-    :param deployment_description: list contains deployment information,
-    method appends created cert and secrets
+    :param journal: _DeployJournal recording the k8s objects created for the deployment
+    :param api_client: k8s API client to use
+    :param password_secret_name: name of an existing keystore password secret to use instead of creating one
+    Returns: the name of the certificate, the name of its secret, the name of the password secret
+    (None for PEM certificates), and the custom resource.
     """
     ctx.logger.info("Creating certificate custom resource")
     ctx.logger.info("External cert data: " + str(external_cert_data))
 
     cert_type = (external_cert_data.get("cert_type") or DEFAULT_CERT_TYPE).lower()
 
-    api = client.CustomObjectsApi()
     cert_secret_name = component_name + "-secret"
     cert_name = component_name + "-cert"
     cert_dir = external_cert_data.get("external_cert_directory") + "external/"
@@ -791,13 +978,18 @@ def _create_certificate_custom_resource(ctx, external_cert_data, external_tls_co
     # Create the volumes
     if cert_type != 'pem':
         ctx.logger.info("Creating volume with passwords")
-        password_secret_name, password_secret_key = create_secret_with_password(namespace, component_name + "-cert-password", "password",  30)
-        deployment_description["secrets"].append(password_secret_name)
+        if password_secret_name:
+            password_secret_key = "password"
+        else:
+            password_secret_name, password_secret_key = create_secret_with_password(namespace, component_name + "-cert-password", "password",  30, api_client)
+            journal.record("secret", password_secret_name,
+                           lambda: client.CoreV1Api(api_client).delete_namespaced_secret(password_secret_name, namespace))
         custom_resource.get("spec")["keystores"] = _create_keystores_object(_get_keystores_object_type(cert_type), password_secret_name)
         projected_volume_sources = _create_projected_volume_with_password(
             cert_type, cert_secret_name, password_secret_name, password_secret_key)
     else:
         ctx.logger.info("Creating PEM volume")
+        password_secret_name = None
         projected_volume_sources = _create_pem_projected_volume(cert_secret_name)
 
     # Create the volume mounts
@@ -805,18 +997,166 @@ def _create_certificate_custom_resource(ctx, external_cert_data, external_tls_co
     volumes.append(client.V1Volume(name="certmanager-certs-volume", projected=projected_volume))
     volume_mounts.append(client.V1VolumeMount(name="certmanager-certs-volume", mount_path=cert_dir))
 
-    #Create certificate custom resource
     ctx.logger.info("Certificate CRD: " + str(custom_resource))
-    api.create_namespaced_custom_object(
-        group="cert-manager.io",
-        version="v1",
-        namespace=namespace,
-        plural="certificates",
-        body=custom_resource
-    )
-    deployment_description["certificates"].append(cert_name)
-    deployment_description["secrets"].append(cert_secret_name)
-    ctx.logger.info("CRD certificate created")
+    return cert_name, cert_secret_name, password_secret_name, custom_resource
+
+
+def _get_certificate_password_secret(custom_objects, namespace, cert_name):
+    """
+    Get the name of the keystore password secret used by the existing certificate "cert_name",
+    or None if there's no such certificate or it doesn't use a password secret.
+    """
+    try:
+        cert = custom_objects.get_namespaced_custom_object("cert-manager.io", "v1", namespace, "certificates", cert_name)
+    except client.rest.ApiException as e:
+        if e.status == 404:
+            return None
+        raise e
+    for keystore in ((cert.get("spec") or {}).get("keystores") or {}).values():
+        name = (keystore.get("passwordSecretRef") or {}).get("name")
+        if name:
+            return name
+    return None
+
+
+class _DeployJournal(object):
+    """
+    Record of the k8s objects created while deploying a component, in the order they were created,
+    with the action that deletes each one.  If the deployment fails, rollback() deletes whatever
+    was created, most recent first.  Objects can be recorded from several threads at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []
+
+    def record(self, kind, name, undo):
+        with self._lock:
+            self._entries.append((kind, name, undo))
+
+    def rollback(self, logger):
+        """
+        Delete the recorded objects, most recent first.
+        Every deletion is attempted, even if some fail, and the failures are logged.
+        """
+        with self._lock:
+            entries, self._entries = self._entries, []
+        for kind, name, undo in reversed(entries):
+            try:
+                undo()
+            except Exception as e:
+                logger.info("Could not remove {0} {1} after failed deployment: {2}".format(kind, name, e))
+
+
+def _create_objects(creations, journal):
+    """
+    Submit the independent k8s object submissions in "creations" concurrently.
+    Each entry is a tuple (kind, name, submit, undo): "submit" creates the object (or, when
+    reconciling, brings an existing object up to date).  It's called with a function to call
+    as soon as it has created a new object, which records "undo", deleting the object, in "journal".
+    The submissions run in worker threads, so they can't use the Cloudify ctx.
+    Waits for all the submissions to finish, then raises the first error, if any.
+    """
+    def run(kind, name, submit, undo):
+        submit(lambda: journal.record(kind, name, undo))
+
+    with futures.ThreadPoolExecutor(max_workers=max(1, len(creations))) as executor:
+        pending = [executor.submit(run, *creation) for creation in creations]
+        futures.wait(pending)
+
+    for f in pending:
+        if f.exception() is not None:
+            raise f.exception()
+
+
+# API client used only for its (stateless) serialization method; created on first use
+_serializer = None
+
+def _serialize(obj):
+    """ Convert a k8s API model object to the dict that would be sent to (or received from) k8s """
+    global _serializer
+    if _serializer is None:
+        _serializer = client.ApiClient()
+    return _serializer.sanitize_for_serialization(obj)
+
+
+def _same_quantity(desired, live):
+    """
+    Check if two scalar values are the same k8s quantity written differently, e.g. 0.5 and "500m".
+    """
+    def parse(value):
+        if isinstance(value, bool):
+            return None
+        m = QUANTITY.match(str(value))
+        if not m:
+            return None
+        return decimal.Decimal(m.group(1)) * QUANTITY_SUFFIXES[m.group(2)]
+    d, l = parse(desired), parse(live)
+    return d is not None and d == l
+
+
+def _diff(desired, live, strategic=True, _key=None, _quantities=False):
+    """
+    Compute a patch that makes "live" (an object as read back from k8s) match "desired" (an object
+    as we would create it), both in serialized form.  Only the fields we set are compared, so that
+    fields defaulted or maintained by k8s itself are left alone.  Unset (None or "") fields are ignored.
+    Values in resource limits and requests are compared as quantities, so that 0.5 matches "500m";
+    everywhere else, values have to be equal.
+    A list that differs in any way is sent in full.  For a strategic-merge patch ("strategic"),
+    a list of objects is marked to replace the live list, so that entries we no longer want are
+    removed rather than merged, whatever the list's merge key (container names, service ports, ...).
+    Returns the patch, or None if "live" already matches "desired".
+    """
+    if isinstance(desired, dict):
+        if not isinstance(live, dict):
+            return desired
+        patch = {}
+        for key, value in desired.items():
+            if value is None or value == "":
+                continue
+            if key not in live:
+                patch[key] = value
+            else:
+                change = _diff(value, live[key], strategic, key,
+                               _quantities or (_key, key) in QUANTITY_FIELDS)
+                if change is not None:
+                    patch[key] = change
+        return patch or None
+    if isinstance(desired, list):
+        if isinstance(live, list) and len(live) == len(desired) and \
+                all(_diff(d, l, strategic, _key, _quantities) is None for d, l in zip(desired, live)):
+            return None
+        if strategic and desired and all(isinstance(d, dict) for d in desired):
+            return desired + [{"$patch": "replace"}]
+        return desired
+    if desired == live or (_quantities and _same_quantity(desired, live)):
+        return None
+    return desired
+
+
+def _reconcile_object(logger, kind, name, desired, read, create, patch, created, strategic=True):
+    """
+    Bring the k8s object "name" in line with "desired": create it if it doesn't exist,
+    patch the fields that differ if it does, or do nothing if it is already as desired.
+    If it creates the object, calls created() straight away.
+    "logger" is the operation's logger, got from the ctx in the operation's own thread.
+    """
+    try:
+        live = read()
+    except client.rest.ApiException as e:
+        if e.status != 404:
+            raise e
+        create()
+        created()
+        logger.info("Created {0} {1}".format(kind, name))
+        return
+
+    changes = _diff(_serialize(desired), _serialize(live), strategic)
+    if changes is None:
+        logger.info("No changes to {0} {1}".format(kind, name))
+    else:
+        patch(changes)
+        logger.info("Patched {0} {1}: {2}".format(kind, name, changes))
 
 
 def deploy(ctx, namespace, component_name, image, replicas, always_pull, k8sconfig, **kwargs):
@@ -885,26 +1225,37 @@ def deploy(ctx, namespace, component_name, image, replicas, always_pull, k8sconf
             - endpoint: the path portion of the URL that points to the liveness endpoint for "http" and "https" types
             - path: the full path to the script to be executed in the container for "script" and "docker" types
         - k8s_location: name of the Kubernetes location (cluster) where the component is to be deployed
+        - reconcile: if true, objects that already exist (for instance, when a component is
+          reinstalled or healed) are not an error.  Each existing object is read back and compared
+          with the object we would create, and only the fields that differ are patched.  An object
+          that is already as it should be is left alone, so its pods aren't restarted.
 
     """
 
-    deployment_ok = False
-    cip_service_created = False
-    deployment_description = {
-        "namespace": namespace,
-        "location": kwargs.get("k8s_location"),
-        "deployment": '',
-        "services": [],
-        "certificates": [],
-        "secrets": []
-    }
+    location = kwargs.get("k8s_location")
+    reconcile = kwargs.get("reconcile", False)
+    journal = _DeployJournal()
 
     try:
 
         # Get API handles
-        _configure_api(kwargs.get("k8s_location"))
-        core = client.CoreV1Api()
-        k8s_apps_v1_api_client = client.AppsV1Api()
+        api_client = _configure_api(location)
+        core = client.CoreV1Api(api_client)
+        k8s_apps_v1_api_client = client.AppsV1Api(api_client)
+        custom_objects = client.CustomObjectsApi(api_client)
+
+        # Build all of the k8s objects for the component first, then create them together.
+        # Each entry is (kind, name, submit function, delete function), as used by _create_objects.
+        creations = []
+
+        logger = ctx.logger
+        def add_object(kind, name, desired, read, create, patch, delete, strategic=True):
+            if reconcile:
+                submit = lambda created: _reconcile_object(logger, kind, name, desired, read, create, patch,
+                                                           created, strategic)
+            else:
+                submit = lambda created: (create(), created())
+            creations.append((kind, name, submit, delete))
 
         # Parse the port mapping
         container_ports, port_map = parse_ports(kwargs.get("ports", []))
@@ -932,15 +1283,39 @@ def deploy(ctx, namespace, component_name, image, replicas, always_pull, k8sconf
         cmpv2_integration_enabled = bool(util.strtobool(cmpv2_issuer_config.get("enabled")))
         ctx.logger.info("CMPv2 integration enabled: " + str(cmpv2_integration_enabled))
 
-
+        certificates = []
+        secrets = []
         if external_cert and external_cert.get("use_external_tls"):
             if cmpv2_integration_enabled:
-                _create_certificate_custom_resource(ctx, external_cert,
-                                                   k8sconfig.get("external_cert"),
-                                                   cmpv2_issuer_config.get("name"),
-                                                   namespace,
-                                                   component_name, volumes,
-                                                   volume_mounts, deployment_description)
+                # When reconciling, keep using the existing certificate's password secret
+                existing_password_secret = None
+                if reconcile:
+                    existing_password_secret = \
+                        _get_certificate_password_secret(custom_objects, namespace, component_name + "-cert")
+                cert_name, cert_secret_name, password_secret_name, custom_resource = \
+                    _create_certificate_custom_resource(ctx, external_cert,
+                                                        k8sconfig.get("external_cert"),
+                                                        cmpv2_issuer_config.get("name"),
+                                                        namespace,
+                                                        component_name, volumes,
+                                                        volume_mounts, journal, api_client,
+                                                        existing_password_secret)
+                add_object("certificate", cert_name, custom_resource,
+                           lambda: custom_objects.get_namespaced_custom_object(
+                               "cert-manager.io", "v1", namespace, "certificates", cert_name),
+                           lambda: custom_objects.create_namespaced_custom_object(
+                               group="cert-manager.io", version="v1", namespace=namespace,
+                               plural="certificates", body=custom_resource),
+                           lambda changes: custom_objects.patch_namespaced_custom_object(
+                               "cert-manager.io", "v1", namespace, "certificates", cert_name, changes),
+                           lambda: custom_objects.delete_namespaced_custom_object(
+                               group="cert-manager.io", version="v1", name=cert_name,
+                               namespace=namespace, plural="certificates"),
+                           strategic=False)
+                certificates.append(cert_name)
+                if password_secret_name:
+                    secrets.append(password_secret_name)
+                secrets.append(cert_secret_name)
             else:
                 _add_external_tls_init_container(ctx, init_containers, volumes, external_cert,
                                                  k8sconfig.get("external_cert"))
@@ -961,66 +1336,78 @@ def deploy(ctx, namespace, component_name, image, replicas, always_pull, k8sconf
         labels["app"] = component_name
         dep = _create_deployment_object(component_name, containers, init_containers, replicas, volumes, labels,
                                         pull_secrets=k8sconfig["image_pull_secrets"])
-
-        # Have k8s deploy it
-        k8s_apps_v1_api_client.create_namespaced_deployment(namespace, dep)
-        deployment_ok = True
-        deployment_description["deployment"] = _create_deployment_name(component_name)
-
-        # Create service(s), if a port mapping is specified
+        deployment_name = _create_deployment_name(component_name)
+        add_object("deployment", deployment_name, dep,
+                   lambda: k8s_apps_v1_api_client.read_namespaced_deployment(deployment_name, namespace),
+                   lambda: k8s_apps_v1_api_client.create_namespaced_deployment(namespace, dep),
+                   lambda changes: k8s_apps_v1_api_client.patch_namespaced_deployment(deployment_name, namespace, changes),
+                   lambda: k8s_apps_v1_api_client.delete_namespaced_deployment(
+                       deployment_name, namespace,
+                       body=client.V1DeleteOptions(propagation_policy="Foreground")))
+
+        # Build service(s), if a port mapping is specified
+        services = []
         if port_map:
             service_ports, exposed_ports, exposed_ports_ipv6 = _process_port_map(port_map)
 
-            # Create a ClusterIP service for access via the k8s network
-            service = _create_service_object(_create_service_name(component_name), component_name, service_ports, None,
-                                             labels, "ClusterIP", "IPv4")
-            core.create_namespaced_service(namespace, service)
-            cip_service_created = True
-            deployment_description["services"].append(_create_service_name(component_name))
+            # A ClusterIP service for access via the k8s network
+            services.append(_create_service_object(_create_service_name(component_name), component_name,
+                                                   service_ports, None, labels, "ClusterIP", "IPv4"))
 
-            # If there are ports to be exposed on the k8s nodes, create a "NodePort" service
+            # If there are ports to be exposed on the k8s nodes, a "NodePort" service
             if exposed_ports:
-                exposed_service = \
-                    _create_service_object(_create_exposed_service_name(component_name), component_name, exposed_ports,
-                                           '', labels, "NodePort", "IPv4")
-                core.create_namespaced_service(namespace, exposed_service)
-                deployment_description["services"].append(_create_exposed_service_name(component_name))
+                services.append(_create_service_object(_create_exposed_service_name(component_name), component_name,
+                                                       exposed_ports, '', labels, "NodePort", "IPv4"))
 
             if exposed_ports_ipv6:
-                exposed_service_ipv6 = \
-                    _create_service_object(_create_exposed_v6_service_name(component_name), component_name,
-                                           exposed_ports_ipv6, '', labels, "NodePort", "IPv6")
-                core.create_namespaced_service(namespace, exposed_service_ipv6)
-                deployment_description["services"].append(_create_exposed_v6_service_name(component_name))
+                services.append(_create_service_object(_create_exposed_v6_service_name(component_name), component_name,
+                                                       exposed_ports_ipv6, '', labels, "NodePort", "IPv6"))
+
+        for service in services:
+            name = service.metadata.name
+            add_object("service", name, service,
+                       lambda name=name: core.read_namespaced_service(name, namespace),
+                       lambda service=service: core.create_namespaced_service(namespace, service),
+                       lambda changes, name=name: core.patch_namespaced_service(name, namespace, changes),
+                       lambda name=name: core.delete_namespaced_service(name, namespace))
+
+        # None of the objects depends on another existing first, so have k8s create them all at once
+        _create_objects(creations, journal)
+        if certificates:
+            ctx.logger.info("CRD certificate created")
 
     except Exception as e:
-        # If the ClusterIP service was created, delete the service:
-        if cip_service_created:
-            core.delete_namespaced_service(_create_service_name(component_name), namespace)
-        # If the deployment was created but not the service, delete the deployment
-        if deployment_ok:
-            client.AppsV1Api().delete_namespaced_deployment(_create_deployment_name(component_name), namespace,
-                                                            body=client.V1DeleteOptions())
+        journal.rollback(ctx.logger)
         raise e
 
+    deployment_description = {
+        "namespace": namespace,
+        "location": location,
+        "deployment": deployment_name,
+        "services": [service.metadata.name for service in services],
+        "certificates": certificates,
+        "secrets": secrets
+    }
+
     return dep, deployment_description
 
 
 def undeploy(deployment_description):
-    _configure_api(deployment_description["location"])
+    api_client = _configure_api(deployment_description["location"])
+    core = client.CoreV1Api(api_client)
 
     namespace = deployment_description["namespace"]
 
     # remove any services associated with the component
     for service in deployment_description["services"]:
-        client.CoreV1Api().delete_namespaced_service(service, namespace)
+        core.delete_namespaced_service(service, namespace)
 
     for secret in deployment_description["secrets"]:
-        client.CoreV1Api().delete_namespaced_secret(secret, namespace)
+        core.delete_namespaced_secret(secret, namespace)
 
     for cert in deployment_description["certificates"]:
         # client.CoreV1Api().delete_namespaced_service(service, namespace)
-        client.CustomObjectsApi().delete_namespaced_custom_object(
+        client.CustomObjectsApi(api_client).delete_namespaced_custom_object(
             group="cert-manager.io",
             version="v1",
             name=cert,
@@ -1029,39 +1416,162 @@ def undeploy(deployment_description):
         )
     # Have k8s delete the underlying pods and replicaset when deleting the deployment.
     options = client.V1DeleteOptions(propagation_policy="Foreground")
-    client.AppsV1Api().delete_namespaced_deployment(deployment_description["deployment"], namespace, body=options)
+    client.AppsV1Api(api_client).delete_namespaced_deployment(deployment_description["deployment"], namespace, body=options)
 
 
-def is_available(location, namespace, component_name):
-    _configure_api(location)
-    dep_status = client.AppsV1Api().read_namespaced_deployment_status(_create_deployment_name(component_name),
-                                                                      namespace)
+def _deployment_is_ready(dep):
     # Check if the number of available replicas is equal to the number requested and that the replicas match the
     # current spec This check can be used to verify completion of an initial deployment, a scale operation,
-    # or an update operation
-    return dep_status.status.available_replicas == dep_status.spec.replicas and dep_status.status.updated_replicas == dep_status.spec.replicas
+    # or an update operation.
+    # The status is only meaningful once the deployment controller has seen the current generation of the spec.
+    if (dep.status.observed_generation or 0) < (dep.metadata.generation or 0):
+        return False
+    return dep.status.available_replicas == dep.spec.replicas and dep.status.updated_replicas == dep.spec.replicas
+
+
+def _rollout_condition(min_generation=None, replicas=None):
+    """
+    Build the test for the completion of a rollout.  Beyond _deployment_is_ready, the deployment must
+    have reached spec generation 'min_generation' and/or have 'replicas' replicas, if they're given.
+    That way a cached copy of the deployment from before a change isn't mistaken for the result of the change.
+    """
+    def condition(dep):
+        if min_generation is not None and (dep.metadata.generation or 0) < min_generation:
+            return False
+        if replicas is not None and dep.spec.replicas != replicas:
+            return False
+        return _deployment_is_ready(dep)
+    return condition
+
+
+def _read_deployment_status(location, namespace, component_name):
+    return client.AppsV1Api(_configure_api(location)).read_namespaced_deployment_status(
+        _create_deployment_name(component_name), namespace)
 
 
-def scale(deployment_description, replicas):
-    """ Trigger a scaling operation by updating the replica count for the Deployment """
+def is_available(location, namespace, component_name):
+    return _deployment_is_ready(_read_deployment_status(location, namespace, component_name))
 
-    def update_replica_count(spec):
-        spec.spec.replicas = replicas
-        return spec
 
-    _patch_deployment(deployment_description["location"], deployment_description["namespace"],
-                      deployment_description["deployment"], update_replica_count)
+def _remaining(deadline):
+    return None if deadline is None else deadline - time.time()
 
 
-def upgrade(deployment_description, image, container_index=0):
-    """ Trigger a rolling upgrade by sending a new image name/tag to k8s """
+# Process-wide registry of deployment informers, keyed by (location, namespace)
+_informers = {}
+_informers_lock = threading.Lock()
 
-    def update_image(spec):
-        spec.spec.template.spec.containers[container_index].image = image
-        return spec
 
-    _patch_deployment(deployment_description["location"], deployment_description["namespace"],
-                      deployment_description["deployment"], update_image)
+def _get_informer(location, namespace):
+    """
+    Get the shared DeploymentInformer for 'namespace' at 'location',
+    creating it (or replacing it, if the API client for the location has changed).
+    Threads waiting on a replaced informer get InformerStopped, and wait on the new one instead.
+    """
+    api_client = _configure_api(location)
+    with _informers_lock:
+        informer = _informers.get((location, namespace))
+        if informer is None or informer.api_client is not api_client:
+            if informer is not None:
+                informer.stop()
+            informer = DeploymentInformer(api_client, namespace)
+            _informers[(location, namespace)] = informer
+        return informer
+
+
+def informer_stats():
+    """
+    Report on the deployment informers in this process: for each (location, namespace),
+    the number of attached waiters, the number of cached deployments, and event counters.
+    """
+    with _informers_lock:
+        return dict(("{0}/{1}".format(location, namespace), informer.stats())
+                    for (location, namespace), informer in _informers.items())
+
+
+def _poll_deployment(location, namespace, component_name, deadline, condition):
+    ''' Wait for 'condition' to hold for the deployment for component_name, polling with exponential backoff '''
+    interval = POLL_INITIAL_INTERVAL
+    while True:
+        if condition(_read_deployment_status(location, namespace, component_name)):
+            return True
+        remaining = _remaining(deadline)
+        if remaining is not None:
+            if remaining <= 0:
+                return False
+            interval = min(interval, remaining)
+        time.sleep(interval)
+        interval = min(interval * 2, POLL_MAX_INTERVAL)
+
+
+def wait_for_deployment(location, namespace, component_name, max_wait, min_generation=None, replicas=None):
+    """
+    Wait until the k8s Deployment for component_name in 'namespace' at 'location' is ready--that is,
+    until all of the replicas requested by the current spec have been updated and are available.
+    This can be used to verify completion of an initial deployment, a scale operation, or an update operation.
+
+    max_wait: maximum time (in seconds) to wait. 0 means wait indefinitely.
+    min_generation: if given, the deployment's spec must have reached at least this generation
+        (as returned by upgrade()), so that the wait covers the rollout of that change.
+    replicas: if given, the deployment's spec must ask for this many replicas (as set by scale()).
+
+    All the waits in the process for the same location and namespace share one DeploymentInformer,
+    which keeps a cache of the namespace's deployments up to date using the k8s watch API--so we find out
+    as soon as the rollout completes, and many concurrent waits cost a single watch stream.
+    If the informer can't list or watch the deployments (for instance, if the API server rejects it),
+    we fall back to polling the deployment status, starting at POLL_INITIAL_INTERVAL seconds between checks
+    and doubling the interval up to POLL_MAX_INTERVAL.
+
+    Returns True if the deployment became ready within max_wait seconds, False otherwise.
+    """
+    deadline = time.time() + max_wait if max_wait > 0 else None
+    condition = _rollout_condition(min_generation, replicas)
+    while True:
+        try:
+            return _get_informer(location, namespace).wait_for(_create_deployment_name(component_name),
+                                                               condition,
+                                                               _remaining(deadline))
+        except InformerStopped:
+            # The informer was replaced while we were waiting on it
+            continue
+        except Exception:
+            return _poll_deployment(location, namespace, component_name, deadline, condition)
+
+
+def scale(deployment_description, replicas, resource_version=None):
+    """
+    Trigger a scaling operation by updating the replica count for the Deployment.
+    The change goes through the Deployment's "scale" subresource, so only the replica count is
+    sent, and there's no need to read the Deployment first.
+    If 'resource_version' is given, k8s rejects the change (with a 409 Conflict) if the Deployment
+    has been modified since that version.
+    """
+    body = {"spec": {"replicas": replicas}}
+    if resource_version:
+        body["metadata"] = {"resourceVersion": resource_version}
+
+    client.AppsV1Api(_configure_api(deployment_description["location"])).patch_namespaced_deployment_scale(
+        deployment_description["deployment"], deployment_description["namespace"], body)
+
+
+def upgrade(deployment_description, image, container_index=0, resource_version=None):
+    """
+    Trigger a rolling upgrade by sending a new image name/tag to k8s.
+    The change is a JSON patch replacing just the image of the container, so there's no
+    need to read the Deployment first.
+    If 'resource_version' is given, k8s rejects the change (with a 422 error, from the failed
+    "test" operation) if the Deployment has been modified since that version.
+    Returns the generation of the updated Deployment spec, for use with wait_for_deployment.
+    """
+    patch = [{"op": "replace",
+              "path": "/spec/template/spec/containers/{0}/image".format(container_index),
+              "value": image}]
+    if resource_version:
+        patch.insert(0, {"op": "test", "path": "/metadata/resourceVersion", "value": resource_version})
+
+    dep = client.AppsV1Api(_configure_api(deployment_description["location"])).patch_namespaced_deployment(
+        deployment_description["deployment"], deployment_description["namespace"], patch)
+    return dep.metadata.generation
 
 
 def rollback(deployment_description, rollback_to=0):
@@ -1080,28 +1590,37 @@ def rollback(deployment_description, rollback_to=0):
        - https://github.com/kubernetes/kubernetes/pull/63837
     The fix has been merged into the master branch but is not in the latest release.
     '''
-    _configure_api(deployment_description["location"])
+    api_client = _configure_api(deployment_description["location"])
     deployment = deployment_description["deployment"]
     namespace = deployment_description["namespace"]
 
     # Initiate the rollback
-    client.ExtensionsV1beta1Api().create_namespaced_deployment_rollback(
+    client.ExtensionsV1beta1Api(api_client).create_namespaced_deployment_rollback(
         deployment,
         namespace,
         client.AppsV1beta1DeploymentRollback(name=deployment,
                                              rollback_to=client.AppsV1beta1RollbackConfig(revision=rollback_to)))
 
     # Read back the spec for the rolled-back deployment
-    spec = client.AppsV1Api().read_namespaced_deployment(deployment, namespace)
+    spec = client.AppsV1Api(api_client).read_namespaced_deployment(deployment, namespace)
     return spec.spec.template.spec.containers[0].image, spec.spec.replicas
 
 
-def execute_command_in_deployment(deployment_description, command):
+def execute_command_in_deployment(deployment_description, command,
+                                  max_concurrency=EXEC_MAX_CONCURRENCY, timeout=EXEC_TIMEOUT):
     """
     Enumerates the pods in the k8s deployment identified by "deployment_description",
     then executes the command (represented as an argv-style list) in "command" in
     container 0 (the main application container) each of those pods.
 
+    The command is executed in up to "max_concurrency" pods at a time, so the whole
+    operation takes about as long as the slowest pod rather than the sum over all pods.
+    "timeout" bounds the time (in seconds) we wait for the command in any one pod; it
+    must be greater than 0 (ValueError is raised otherwise, before any pod is touched).
+    The result is a list with one entry per pod, in the order the pods were enumerated,
+    as returned by _execute_command_in_pod.  If executing the command fails in a way that
+    isn't a timeout or a vanished pod, the exception is raised after all pods are done.
+
     Note that the sets of pods associated with a deployment can change over time.  The
     enumeration is a snapshot at one point in time.  The command will not be executed in
     pods that are created after the initial enumeration.   If a pod disappears after the
@@ -1126,21 +1645,32 @@ def execute_command_in_deployment(deployment_description, command):
     the pod that has the k8s deployment name.  To list the pods, the code below queries for
     pods with the label carrying the deployment name.
     """
+    if not timeout > 0:
+        raise ValueError("Command timeout must be greater than 0, not {0}".format(timeout))
     location = deployment_description["location"]
-    _configure_api(location)
     deployment = deployment_description["deployment"]
     namespace = deployment_description["namespace"]
 
     # Get names of all the running pods belonging to the deployment
-    pod_names = [pod.metadata.name for pod in client.CoreV1Api().list_namespaced_pod(
+    pod_names = [pod.metadata.name for pod in client.CoreV1Api(_configure_api(location)).list_namespaced_pod(
         namespace=namespace,
         label_selector="k8sdeployment={0}".format(deployment),
         field_selector="status.phase=Running"
     ).items]
 
+    if not pod_names:
+        return []
+
     # Execute command in the running pods
-    return [_execute_command_in_pod(location, namespace, pod_name, command)
-            for pod_name in pod_names]
+    with futures.ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(pod_names)))) as executor:
+        pending = [executor.submit(_execute_command_in_pod, location, namespace, pod_name, command, timeout)
+                   for pod_name in pod_names]
+        futures.wait(pending)
+
+    for f in pending:
+        if f.exception() is not None:
+            raise f.exception()
+    return [f.result() for f in pending]
 
 
 
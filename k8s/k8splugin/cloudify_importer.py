@@ -15,107 +15,126 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-# Copied and updated for python3 from cloudify-python-importer
-
-from __future__ import print_function
+# Based on cloudify-python-importer.
+#
+# In a Cloudify Manager plugin environment, the parts of a namespace package (for instance,
+# "google", which google.auth is part of) can end up in different sys.path entries, where the
+# regular import system finds the first part and then can't find the rest.  The finder here
+# runs after the regular finders, only for modules in NAMESPACES, and looks for the module in
+# every sys.path entry.
+#
+# It caches directory listings (until the directory's mtime changes) and lookups that found
+# nothing (until sys.path changes, a directory changes, or importlib.invalidate_caches() is
+# called), so repeated failing imports don't keep scanning sys.path.
 
-import sys
-import imp
+import importlib.abc
+import importlib.machinery
+import importlib.util
 import os
-try:
-    import builtins
-except ImportError:
-    import __builtin__ as builtins
-
-
-class _OurImporter(object):
-
-    def __init__(self, dir_name, load_file):
-        self.dirname = dir_name
-        self.load_file = load_file
-
-    def load_module(self, package_name):
-        try:
-            return sys.modules[package_name]
-        except KeyError:
-            pass
-
-        if self.load_file:
-            try:
-                fp, pathname, description = imp.find_module(
-                    package_name.split(".")[-1],
-                    ["/".join(self.dirname.split("/")[:-1])]
-                )
-                m = imp.load_module(package_name, fp, pathname, description)
-            except ImportError as e:
-                raise e
-        else:
-            m = imp.new_module(package_name)
-
-            m.__name__ = package_name
-            m.__path__ = [self.dirname]
-            m.__doc__ = None
-
-        m.__loader__ = self
-
-        sys.modules.setdefault(package_name, m)
-        return m
-
-
-class _OurFinder(object):
-
-    def __init__(self, dir_name):
-        self.dir_name = dir_name
+import sys
+import threading
 
-    def find_module(self, package_name):
-        real_path = "/".join(package_name.split("."))
+# Top-level packages the finder looks for
+NAMESPACES = ("google",)
 
-        for path in [self.dir_name] + sys.path:
 
-            full_name = os.path.abspath(path) + "/" + real_path
-            dir_root = os.path.abspath(path) + "/" + real_path.split("/")[0]
+class NamespaceFinder(importlib.abc.MetaPathFinder):
 
-            if os.path.isfile(path + "/" + real_path + ".py"):
-                return _OurImporter(full_name, True)
+    def __init__(self, namespaces=NAMESPACES):
+        self.namespaces = frozenset(namespaces)
+        self._lock = threading.Lock()
+        self._listings = {}     # directory -> (mtime, set of entries)
+        self._misses = {}       # module name -> sys.path at the time of the lookup
+        self._counters = {"lookups": 0, "found": 0, "misses": 0, "cached_misses": 0}
 
-            if os.path.isdir(full_name):
-                if not os.path.isfile(dir_root + "/" + "__init__.py"):
-                    print('Creating __init__.py in', dir_root, file=sys.stderr)
-                    with open(dir_root + "/" + "__init__.py", 'a+') as file:
-                        file.write("# Created by importer")
-                    return _OurImporter(dir_root, False)
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
 
-                return _OurImporter(full_name, True)
+    def invalidate_caches(self):
+        with self._lock:
+            self._listings.clear()
+            self._misses.clear()
 
+    def _listdir(self, directory):
+        """ Entries in 'directory', or None if it isn't a directory.  Called with the lock held. """
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            self._listings.pop(directory, None)
+            return None
+        cached = self._listings.get(directory)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        try:
+            entries = set(os.listdir(directory))
+        except OSError:
+            return None
+        if cached is not None:
+            # The directory changed, so earlier misses may not be misses any more
+            self._misses.clear()
+        self._listings[directory] = (mtime, entries)
+        return entries
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname.split(".")[0] not in self.namespaces:
+            return None
+
+        with self._lock:
+            self._counters["lookups"] += 1
+            search_path = [entry for entry in sys.path if isinstance(entry, str)]
+            if self._misses.get(fullname) == search_path:
+                # Not found last time with this sys.path, and none of the directories have changed since
+                self._counters["cached_misses"] += 1
+                return None
+            spec = self._find(fullname, search_path)
+            if spec is None:
+                self._counters["misses"] += 1
+                self._misses[fullname] = search_path
+            else:
+                self._counters["found"] += 1
+                self._misses.pop(fullname, None)
+            return spec
+
+    def _find(self, fullname, search_path):
+        parts = fullname.split(".")
+        name = parts[-1]
+        namespace_dirs = []
+        for entry in search_path:
+            base = os.path.join(os.path.abspath(entry), *parts[:-1])
+            entries = self._listdir(base)
+            if not entries:
+                continue
+            if name + ".py" in entries:
+                return importlib.util.spec_from_file_location(fullname, os.path.join(base, name + ".py"))
+            if name in entries:
+                package_dir = os.path.join(base, name)
+                package_entries = self._listdir(package_dir)
+                if package_entries is None:
+                    continue
+                if "__init__.py" in package_entries:
+                    return importlib.util.spec_from_file_location(fullname, os.path.join(package_dir, "__init__.py"),
+                                                                  submodule_search_locations=[package_dir])
+                namespace_dirs.append(package_dir)
+
+        if namespace_dirs:
+            # A directory without __init__.py: treat it as a namespace package spanning all of them
+            spec = importlib.machinery.ModuleSpec(fullname, None, is_package=True)
+            spec.submodule_search_locations = namespace_dirs
+            return spec
         return None
 
 
-def _check_import(dir_name):
-    return _OurFinder(dir_name)
+_finder = None
 
 
 def register_callback():
-    sys.path_hooks.append(_check_import)
-
-    save_import = builtins.__import__
-
-    def new_import(*argv, **kwargs):
-        try:
-            module = save_import(*argv, **kwargs)
-        except ImportError as e:
-            finder = _OurFinder("")
-            if not finder:
-                raise e
-            importer = finder.find_module(argv[0])
-            if not importer:
-                raise e
-            module = importer.load_module(argv[0])
-            if not module:
-                raise e
-
-        return module
-
-    builtins.__import__ = new_import
+    """ Add the finder to the end of sys.meta_path (once) """
+    global _finder
+    if _finder is None:
+        _finder = NamespaceFinder()
+        sys.meta_path.append(_finder)
+    return _finder
 
 
 register_callback()
@@ -18,9 +18,13 @@
 # ============LICENSE_END=========================================================
 #
 
+import base64
 import json
 import logging
+import random
 import re
+import threading
+import time
 import uuid
 from functools import partial
 
@@ -29,10 +33,27 @@ import requests
 
 logger = logging.getLogger("discovery")
 
+# Maximum number of keep-alive HTTP connections kept per Consul host
+CONSUL_POOL_SIZE = 10
+# Timeouts (secs) for connecting to Consul and for reading a response
+CONSUL_CONNECT_TIMEOUT = 5
+CONSUL_READ_TIMEOUT = 30
+# Check-and-set updates: maximum number of tries, and the bounds (secs) of the
+# exponential backoff between tries
+CAS_MAX_ATTEMPTS = 20
+CAS_BASE_DELAY = 0.05
+CAS_MAX_DELAY = 2.0
+# Consul's limit on the number of operations in one transaction
+CONSUL_TXN_MAX_OPS = 64
+
 
 class DiscoveryError(RuntimeError):
     pass
 
+class DiscoveryConflictError(DiscoveryError):
+    """A check-and-set update kept losing out to concurrent updates of the same key"""
+    pass
+
 class DiscoveryConnectionError(RuntimeError):
     pass
 
@@ -73,28 +94,125 @@ def generate_service_component_name(service_component_type):
     return ("s{0}-{1}".format(str(uuid.uuid4()).replace("-",""),sct))[:63]
 
 
-def create_kv_conn(host):
+class _TimeoutSession(requests.Session):
+    """requests Session that applies a default timeout to every request"""
+
+    def __init__(self, timeout):
+        super(_TimeoutSession, self).__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super(_TimeoutSession, self).request(*args, **kwargs)
+
+
+# Process-wide cache of Consul clients, keyed by (host, port, pool size, timeouts)
+_consul_clients = {}
+_consul_clients_lock = threading.Lock()
+
+
+def _consul_client(hostname, port=None, pool_size=None, connect_timeout=None, read_timeout=None):
+    """Get the shared Consul client for hostname:port, creating it if needed
+
+    The client's requests session keeps up to pool_size connections to Consul alive
+    for reuse, so each Consul operation doesn't have to set up a new TCP connection.
+    It's safe to use the client from several threads at once."""
+    pool_size = pool_size or CONSUL_POOL_SIZE
+    timeout = (connect_timeout or CONSUL_CONNECT_TIMEOUT, read_timeout or CONSUL_READ_TIMEOUT)
+    key = (hostname, port, pool_size, timeout)
+    with _consul_clients_lock:
+        conn = _consul_clients.get(key)
+        if conn is None:
+            conn = consul.Consul(host=hostname, port=port) if port else consul.Consul(host=hostname)
+            session = _TimeoutSession(timeout)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            conn.http.session = session
+            _consul_clients[key] = conn
+        return conn
+
+def create_kv_conn(host, pool_size=None, connect_timeout=None, read_timeout=None):
     """Create connection to key-value store
 
-    Returns a Consul client to the specified Consul host"""
+    Returns a Consul client to the specified Consul host.
+    Clients are cached, so all the connections to a host share one client and its pool
+    of keep-alive HTTP connections.  pool_size, connect_timeout and read_timeout override
+    CONSUL_POOL_SIZE, CONSUL_CONNECT_TIMEOUT and CONSUL_READ_TIMEOUT."""
     try:
         [hostname, port] = host.split(":")
-        return consul.Consul(host=hostname, port=int(port))
+        return _consul_client(hostname, int(port), pool_size, connect_timeout, read_timeout)
     except ValueError as e:
-        return consul.Consul(host=host)
+        return _consul_client(host, None, pool_size, connect_timeout, read_timeout)
+
+class ConsulTransaction(object):
+    """KV writes to be made together, with one request to Consul's /v1/txn endpoint
+
+    Either all of the writes are made or, if any of them fails, none of them are.
+    A transaction holds at most CONSUL_TXN_MAX_OPS operations, which is as many as Consul
+    takes in one request.  Adding more raises DiscoveryError rather than splitting the
+    transaction into several requests, which wouldn't be atomic.
+    commit() sends the operations once: if it fails, nothing has been written, and the
+    caller can make the writes again with a new transaction.
+    """
+
+    def __init__(self, kv_conn):
+        self.kv_conn = kv_conn
+        self._ops = []
+
+    def set(self, key, value):
+        if not isinstance(value, bytes):
+            value = value.encode("utf-8")
+        self._add({"Verb": "set", "Key": key, "Value": base64.b64encode(value).decode("ascii")})
+
+    def delete(self, key):
+        """Delete 'key', if it exists"""
+        self._add({"Verb": "delete", "Key": key})
+
+    def _add(self, op):
+        if len(self._ops) >= CONSUL_TXN_MAX_OPS:
+            raise DiscoveryError("A Consul transaction can't have more than {0} operations".format(CONSUL_TXN_MAX_OPS))
+        self._ops.append({"KV": op})
+
+    def commit(self):
+        ops, self._ops = self._ops, []
+        if not ops:
+            return
+        try:
+            _wrap_consul_call(self.kv_conn.txn.put, ops)
+        except consul.base.ConsulException as e:
+            raise DiscoveryError("Consul transaction failed, nothing was written: {0}".format(e))
+
+
+def _component_keys(service_component_name):
+    """The keys other plugins write for a component, next to its configuration:
+    its relationships and its DMaaP streams"""
+    return [_create_rel_key(service_component_name), "{0}:dmaap".format(service_component_name)]
 
 def push_service_component_config(kv_conn, service_component_name, config):
+    """Write the component's configuration to Consul
+
+    Whatever an earlier component with the same name left in the keys the other plugins
+    write for it (see _component_keys) is deleted in the same transaction, so the
+    component never sees its new configuration with streams or relationships it doesn't have.
+    The relationship operations that fill them in run after this."""
     config_string = config if isinstance(config, str) else json.dumps(config)
-    kv_put_func = partial(_wrap_consul_call, kv_conn.kv.put)
 
-    if kv_put_func(service_component_name, config_string):
-        logger.info("Added config for {0}".format(service_component_name))
-    else:
-        raise DiscoveryError("Failed to push configuration")
+    txn = ConsulTransaction(kv_conn)
+    txn.set(service_component_name, config_string)
+    for key in _component_keys(service_component_name):
+        txn.delete(key)
+    txn.commit()
+    logger.info("Added config for {0}".format(service_component_name))
 
 def remove_service_component_config(kv_conn, service_component_name):
-    kv_delete_func = partial(_wrap_consul_call, kv_conn.kv.delete)
-    kv_delete_func(service_component_name)
+    """Delete the component's configuration, and whatever is left in the keys the other
+    plugins write for it (see _component_keys), from Consul with one transaction"""
+    txn = ConsulTransaction(kv_conn)
+    txn.delete(service_component_name)
+    for key in _component_keys(service_component_name):
+        txn.delete(key)
+    txn.commit()
 
 
 def get_kv_value(kv_conn, key):
@@ -111,6 +229,34 @@ def get_kv_value(kv_conn, key):
         raise DiscoveryKVEntryNotFoundError("{0} kv entry not found".format(key))
 
 
+# Process-wide copies of the KV entries read with get_cached_kv_value, keyed by (Consul host, key)
+_kv_values = {}
+_kv_values_lock = threading.Lock()
+
+
+def get_cached_kv_value(host, key):
+    """Get a key-value entry's value, parsed as JSON, reading it from Consul only once in the process
+
+    The entry is read with a consistent read, so it can't be a stale copy from a lagging server.
+    Each Cloudify operation runs in a process of its own, so an operation sees the entry as it
+    was when the operation first read it, and changes to it reach the operations that start after.
+
+    Raises DiscoveryKVEntryNotFoundError if entry not found
+    """
+    with _kv_values_lock:
+        if (host, key) not in _kv_values:
+            (index, val) = _wrap_consul_call(create_kv_conn(host).kv.get, key, consistency="consistent")
+            value = val["Value"] if val else None
+            if isinstance(value, bytes):
+                value = value.decode("utf-8")
+            _kv_values[(host, key)] = value
+        value = _kv_values[(host, key)]
+
+    if value is None:
+        raise DiscoveryKVEntryNotFoundError("{0} kv entry not found".format(key))
+    return json.loads(value)
+
+
 def _create_rel_key(service_component_name):
     return "{0}:rel".format(service_component_name)
 
@@ -195,6 +341,67 @@ def is_healthy(consul_host, instance):
     return _is_healthy_pure(get_health_func, instance)
 
 
+# Contention counters for check-and-set updates in this process
+_cas_counters = {"updates": 0, "attempts": 0, "conflicts": 0, "failures": 0, "backoff_time": 0.0}
+_cas_counters_lock = threading.Lock()
+
+
+def _count_cas(**increments):
+    with _cas_counters_lock:
+        for counter, increment in increments.items():
+            _cas_counters[counter] += increment
+
+
+def cas_stats():
+    """Report the check-and-set counters: updates made, attempts, conflicts with
+    concurrent updates, updates that gave up, and total time spent backing off"""
+    with _cas_counters_lock:
+        return dict(_cas_counters)
+
+
+def _cas_update(conn, key, update, max_attempts=CAS_MAX_ATTEMPTS,
+                base_delay=CAS_BASE_DELAY, max_delay=CAS_MAX_DELAY):
+    """Update the JSON dict stored under 'key' with a check-and-set write
+
+    update(v) changes the dict v.  If the key changes between reading it and writing it
+    back, the update is tried again on the new value, after a randomized exponential
+    backoff so that concurrent updaters spread out instead of hammering Consul.
+    Raises DiscoveryConflictError after max_attempts tries.
+
+    Returns the updated dict
+    """
+    for attempt in range(1, max_attempts + 1):
+        (index, val) = _wrap_consul_call(conn.kv.get, key)     # index gives version of key retrieved
+
+        if val is None:     # no key yet
+            vstring = '{}'
+            mod_index = 0   # Use 0 as the cas index for initial insertion of the key
+        else:
+            vstring = val['Value']
+            mod_index = val['ModifyIndex']
+
+        # Build the updated dict
+        # Exceptions just propagate
+        v = json.loads(vstring)
+        update(v)
+        new_vstring = json.dumps(v)
+
+        # if the key has changed since retrieval, this will return false
+        if _wrap_consul_call(conn.kv.put, key, new_vstring, cas=mod_index):
+            _count_cas(updates=1, attempts=attempt, conflicts=attempt - 1)
+            return v
+
+        if attempt < max_attempts:
+            # "Full jitter" backoff
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            logger.debug("Conflicting update to {0}, retrying in {1:.3f}s".format(key, delay))
+            _count_cas(backoff_time=delay)
+            time.sleep(delay)
+
+    _count_cas(attempts=max_attempts, conflicts=max_attempts, failures=1)
+    raise DiscoveryConflictError("Could not update {0}: still conflicting after {1} attempts".format(key, max_attempts))
+
+
 def add_to_entry(conn, key, add_name, add_value):
     """
     Find 'key' in consul.
@@ -210,25 +417,12 @@ def add_to_entry(conn, key, add_name, add_value):
     should result in the value for key 'xyz:dmaap' in consul being updated to
     '{"feed00": {"feed_url" : "http://example.com/feeds/999"}, "topic00" : {"topic_url" : "http://example.com/topics/1229"}}'
     """
-    while True:     # do until update succeeds
-        (index, val) = conn.kv.get(key)     # index gives version of key retrieved
-
-        if val is None:     # no key yet
-            vstring = '{}'
-            mod_index = 0   # Use 0 as the cas index for initial insertion of the key
-        else:
-            vstring = val['Value']
-            mod_index = val['ModifyIndex']
+    return add_many_to_entry(conn, key, {add_name: add_value})
 
-        # Build the updated dict
-        # Exceptions just propagate
-        v = json.loads(vstring)
-        v[add_name] = add_value
-        new_vstring = json.dumps(v)
 
-        updated = conn.kv.put(key, new_vstring, cas=mod_index)       # if the key has changed since retrieval, this will return false
-        if updated:
-            return v
+def add_many_to_entry(conn, key, entries):
+    """Like add_to_entry, but add all of the name/value pairs in the dict 'entries' with one update"""
+    return _cas_update(conn, key, lambda v: v.update(entries))
 
 
 def _find_matching_services(services, name_search, tags):
@@ -23,8 +23,9 @@
 # Needed by Cloudify Manager to load google.auth for the Kubernetes python client
 from . import cloudify_importer
 
-import time, copy
+import copy
 import json
+import threading
 from cloudify import ctx
 from cloudify.decorators import operation
 from cloudify.exceptions import NonRecoverableError, RecoverableError
@@ -37,15 +38,37 @@ from k8splugin import utils
 from configure import configure
 import k8sclient
 
-# Get configuration
-plugin_conf = configure.configure()
-CONSUL_HOST = plugin_conf.get("consul_host")
-CONSUL_INTERNAL_NAME = plugin_conf.get("consul_dns_name")
-DCAE_NAMESPACE = plugin_conf.get("namespace")
-DEFAULT_MAX_WAIT = plugin_conf.get("max_wait")
-DEFAULT_K8S_LOCATION = plugin_conf.get("default_k8s_location")
-COMPONENT_CERT_DIR = plugin_conf.get("tls",{}).get("component_cert_dir")
-CBS_BASE_URL = plugin_conf.get("cbs").get("base_url")
+# Configuration settings, read on first use rather than when the module is loaded,
+# so that importing the plugin doesn't need the config file or Consul.
+# Each maps a setting name to the function that gets it from the plugin configuration.
+_SETTINGS = {
+    "CONSUL_HOST": lambda conf: conf.get("consul_host"),
+    "CONSUL_INTERNAL_NAME": lambda conf: conf.get("consul_dns_name"),
+    "DCAE_NAMESPACE": lambda conf: conf.get("namespace"),
+    "DEFAULT_MAX_WAIT": lambda conf: conf.get("max_wait"),
+    "DEFAULT_K8S_LOCATION": lambda conf: conf.get("default_k8s_location"),
+    "COMPONENT_CERT_DIR": lambda conf: conf.get("tls",{}).get("component_cert_dir"),
+    "CBS_BASE_URL": lambda conf: conf.get("cbs").get("base_url"),
+    "EXEC_MAX_CONCURRENCY": lambda conf: conf.get("exec", {}).get("max_concurrency", configure.EXEC_MAX_CONCURRENCY),
+    "EXEC_TIMEOUT": lambda conf: conf.get("exec", {}).get("timeout", configure.EXEC_TIMEOUT)
+}
+
+_plugin_conf = None
+_plugin_conf_lock = threading.Lock()
+
+def get_setting(name):
+    """Get configuration setting 'name' (one of the _SETTINGS)
+
+    The plugin configuration is read from the config file and Consul the first time a
+    setting is needed, and kept for the life of the process, as the module constants
+    these settings replace were.
+    """
+    global _plugin_conf
+    with _plugin_conf_lock:
+        if _plugin_conf is None:
+            _plugin_conf = configure.configure()
+        conf = _plugin_conf
+    return _SETTINGS[name](conf)
 
 # Used to construct delivery urls for data router subscribers. Data router in FTL
 # requires https but this author believes that ONAP is to be defaulted to http.
@@ -80,7 +103,7 @@ def _setup_for_discovery(**kwargs):
         # NOTE: application_config is no longer a json string and is inputed as a
         # YAML map which translates to a dict. We don't have to do any
         # preprocessing anymore.
-        conn = dis.create_kv_conn(CONSUL_HOST)
+        conn = dis.create_kv_conn(get_setting("CONSUL_HOST"))
         dis.push_service_component_config(conn, name, application_config)
         return kwargs
     except dis.DiscoveryConnectionError as e:
@@ -121,7 +144,7 @@ def _get_resources(**kwargs):
 def  _get_location():
     ''' Get the k8s location property.  Set to the default if the property is missing, None, or zero-length '''
     return ctx.node.properties["location_id"] if "location_id" in ctx.node.properties and ctx.node.properties["location_id"] \
-        else DEFAULT_K8S_LOCATION
+        else get_setting("DEFAULT_K8S_LOCATION")
 
 @merge_inputs_for_create
 @monkeypatch_loggers
@@ -206,34 +229,22 @@ def create_for_components_with_streams(**create_inputs):
                         **_generate_component_name(
                             **create_inputs)))))
 
-def _verify_k8s_deployment(location, service_component_name, max_wait):
+def _verify_k8s_deployment(location, service_component_name, max_wait, **expected):
     """Verify that the k8s Deployment is ready
 
     Args:
     -----
     location (string): location of the k8s cluster where the component was deployed
     service_component_name: component's service component name
-    max_wait (integer): limit to how may attempts to make which translates to
-        seconds because each sleep is one second. 0 means infinite.
+    max_wait (integer): limit to how many seconds to wait. 0 means infinite.
+    expected: "min_generation" and/or "replicas" the deployment must have reached
+        (see k8sclient.wait_for_deployment)
 
     Return:
     -------
     True if deployment is ready within the maximum wait time, False otherwise
     """
-    num_attempts = 1
-
-    while True:
-        if k8sclient.is_available(location, DCAE_NAMESPACE, service_component_name):
-            return True
-        else:
-            num_attempts += 1
-
-            if max_wait > 0 and max_wait < num_attempts:
-                return False
-
-            time.sleep(1)
-
-    return True
+    return k8sclient.wait_for_deployment(location, get_setting("DCAE_NAMESPACE"), service_component_name, max_wait, **expected)
 
 def _fail_if_external_cert_incorrect(external_cert):
     if not (external_cert.get(EXT_CERT_DIR)
@@ -277,30 +288,34 @@ def _create_and_start_container(container_name, image, **kwargs):
         - readiness: object with information needed to create a readiness check
         - liveness: object with information needed to create a liveness check
         - k8s_location: name of the Kubernetes location (cluster) where the component is to be deployed
+        - reconcile: boolean.  If true, k8s objects left from an earlier installation of the component
+          are updated in place (only where they differ) instead of causing the deployment to fail
     '''
     tls_info = kwargs.get("tls_info") or {}
     external_cert = kwargs.get("external_cert")
     if external_cert and external_cert.get("use_external_tls"):
         _fail_if_external_cert_incorrect(external_cert)
-    cert_dir = tls_info.get("cert_directory") or COMPONENT_CERT_DIR
-    env = { "CONSUL_HOST": CONSUL_INTERNAL_NAME,
+    cert_dir = tls_info.get("cert_directory") or get_setting("COMPONENT_CERT_DIR")
+    env = { "CONSUL_HOST": get_setting("CONSUL_INTERNAL_NAME"),
             "CONFIG_BINDING_SERVICE": "config-binding-service",
             "DCAE_CA_CERTPATH" : "{0}/cacert.pem".format(cert_dir),
-            "CBS_CONFIG_URL" : "{0}/{1}".format(CBS_BASE_URL, container_name)
+            "CBS_CONFIG_URL" : "{0}/{1}".format(get_setting("CBS_BASE_URL"), container_name)
           }
     env.update(kwargs.get("envs", {}))
     ctx.logger.info("Starting k8s deployment for {}, image: {}, env: {}, kwargs: {}".format(container_name, image, env, kwargs))
-    ctx.logger.info("Passing k8sconfig: {}".format(plugin_conf))
+    # Get the current configuration, in case it has changed since the plugin was loaded
+    k8sconfig = configure.configure()
+    ctx.logger.info("Passing k8sconfig: {}".format(k8sconfig))
     replicas = kwargs.get("replicas", 1)
     resource_config = _get_resources(**kwargs)
     _, dep = k8sclient.deploy(
                      ctx,
-                     DCAE_NAMESPACE,
+                     get_setting("DCAE_NAMESPACE"),
                      container_name,
                      image,
                      replicas=replicas,
                      always_pull=kwargs.get("always_pull_image", False),
-                     k8sconfig=plugin_conf,
+                     k8sconfig=k8sconfig,
                      resources=resource_config,
                      volumes=kwargs.get("volumes", []),
                      ports=kwargs.get("ports", []),
@@ -311,7 +326,8 @@ def _create_and_start_container(container_name, image, **kwargs):
                      log_info=kwargs.get("log_info"),
                      readiness=kwargs.get("readiness"),
                      liveness=kwargs.get("liveness"),
-                     k8s_location=kwargs.get("k8s_location"))
+                     k8s_location=kwargs.get("k8s_location"),
+                     reconcile=kwargs.get("reconcile", False))
 
     # Capture the result of deployment for future use
     ctx.instance.runtime_properties[K8S_DEPLOYMENT] = dep
@@ -347,11 +363,13 @@ def _parse_cloudify_context(**kwargs):
     if "external_cert" in ctx.node.properties:
         kwargs["external_cert"] = ctx.node.properties["external_cert"]
 
-    # Pick up replica count and always_pull_image flag
+    # Pick up replica count, always_pull_image flag and reconcile flag
     if "replicas" in ctx.node.properties:
         kwargs["replicas"] = ctx.node.properties["replicas"]
     if "always_pull_image" in ctx.node.properties:
         kwargs["always_pull_image"] = ctx.node.properties["always_pull_image"]
+    if "reconcile" in ctx.node.properties:
+        kwargs["reconcile"] = ctx.node.properties["reconcile"]
 
     # Pick up location
     kwargs["k8s_location"] = _get_location()
@@ -419,7 +437,7 @@ def _verify_component(**kwargs):
     """Verify deployment is ready"""
     service_component_name = kwargs[SERVICE_COMPONENT_NAME]
 
-    max_wait = kwargs.get("max_wait", DEFAULT_MAX_WAIT)
+    max_wait = kwargs.get("max_wait", get_setting("DEFAULT_MAX_WAIT"))
     ctx.logger.info("Waiting up to {0} secs for {1} to become ready".format(max_wait, service_component_name))
 
     if _verify_k8s_deployment(kwargs.get("k8s_location"), service_component_name, max_wait):
@@ -504,9 +522,10 @@ def scale(replicas, **kwargs):
         ctx.instance.runtime_properties["replicas"] = replicas
 
         # Verify that the scaling took place as expected
-        max_wait = kwargs.get("max_wait", DEFAULT_MAX_WAIT)
+        max_wait = kwargs.get("max_wait", get_setting("DEFAULT_MAX_WAIT"))
         ctx.logger.info("Waiting up to {0} secs for {1} to scale and become ready".format(max_wait, service_component_name))
-        if _verify_k8s_deployment(deployment_description["location"], service_component_name, max_wait):
+        if _verify_k8s_deployment(deployment_description["location"], service_component_name, max_wait,
+                                  replicas=replicas):
             ctx.logger.info("Scaling complete: {0} from {1} to {2} replica(s)".format(service_component_name, current_replicas, replicas))
 
     else:
@@ -523,13 +542,14 @@ def update_image(image, **kwargs):
         current_image = ctx.instance.runtime_properties["image"]
         ctx.logger.info("Updating app image for {0} from {1} to {2}".format(service_component_name, current_image, image))
         deployment_description = ctx.instance.runtime_properties[K8S_DEPLOYMENT]
-        k8sclient.upgrade(deployment_description, image)
+        generation = k8sclient.upgrade(deployment_description, image)
         ctx.instance.runtime_properties["image"] = image
 
         # Verify that the update took place as expected
-        max_wait = kwargs.get("max_wait", DEFAULT_MAX_WAIT)
+        max_wait = kwargs.get("max_wait", get_setting("DEFAULT_MAX_WAIT"))
         ctx.logger.info("Waiting up to {0} secs for {1} to be updated and become ready".format(max_wait, service_component_name))
-        if _verify_k8s_deployment(deployment_description["location"], service_component_name, max_wait):
+        if _verify_k8s_deployment(deployment_description["location"], service_component_name, max_wait,
+                                  min_generation=generation):
             ctx.logger.info("Update complete: {0} from {1} to {2}".format(service_component_name, current_image, image))
 
     else:
@@ -549,7 +569,7 @@ def cleanup_discovery(**kwargs):
         service_component_name = ctx.instance.runtime_properties[SERVICE_COMPONENT_NAME]
 
         try:
-            conn = dis.create_kv_conn(CONSUL_HOST)
+            conn = dis.create_kv_conn(get_setting("CONSUL_HOST"))
             dis.remove_service_component_config(conn, service_component_name)
         except dis.DiscoveryConnectionError as e:
             raise RecoverableError(e)
@@ -583,7 +603,9 @@ def _notify_container(**kwargs):
 
         # Execute the command
         deployment_description = ctx.instance.runtime_properties[K8S_DEPLOYMENT]
-        resp = k8sclient.execute_command_in_deployment(deployment_description, command)
+        resp = k8sclient.execute_command_in_deployment(deployment_description, command,
+                                                       max_concurrency=get_setting("EXEC_MAX_CONCURRENCY"),
+                                                       timeout=get_setting("EXEC_TIMEOUT"))
 
     # else the default is no trigger
 
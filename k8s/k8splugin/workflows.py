@@ -0,0 +1,160 @@
+# ============LICENSE_START=======================================================
+# org.onap.dcae
+# ================================================================================
+# Copyright (c) 2021 AT&T Intellectual Property. All rights reserved.
+# ================================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END=========================================================
+
+# Workflows that change many components at once.
+#
+# The scale and update_image operations work on one node instance at a time, and each one
+# waits for its rollout to finish before returning.  The workflows here patch the k8s Deployments
+# for all of the selected node instances directly, with up to 'parallelism' rollouts in progress
+# at once.  All of the waits in the workflow share one k8s watch per namespace (see
+# k8sclient.wait_for_deployment), so waiting on many rollouts costs little more than waiting on one.
+
+import time
+from concurrent import futures
+
+from cloudify.decorators import workflow
+from cloudify.workflows import ctx
+from cloudify.manager import get_rest_client
+from cloudify.exceptions import NonRecoverableError
+
+import k8sclient
+from k8splugin.tasks import K8S_DEPLOYMENT, SERVICE_COMPONENT_NAME, get_setting
+
+# Default maximum number of rollouts in progress at once
+DEFAULT_PARALLELISM = 10
+
+
+def _select_instances(nodes, node_type=None, node_ids=None, node_instance_ids=None):
+    """
+    Select the node instances, from the instances of 'nodes', that have a k8s deployment
+    and that match all of the selectors given:
+        - node_type: a node type that the node has or derives from
+        - node_ids: a list of node ids
+        - node_instance_ids: a list of node instance ids
+    """
+    selected = []
+    for node in nodes:
+        if node_type and node_type not in node.type_hierarchy:
+            continue
+        if node_ids and node.id not in node_ids:
+            continue
+        for instance in node.instances:
+            if node_instance_ids and instance.id not in node_instance_ids:
+                continue
+            if K8S_DEPLOYMENT in instance.runtime_properties:
+                selected.append(instance)
+    return selected
+
+
+def _update_runtime_properties(node_instance_id, updates):
+    ''' Record 'updates' in the runtime properties of the node instance '''
+    rest = get_rest_client()
+    instance = rest.node_instances.get(node_instance_id)
+    runtime_properties = instance.runtime_properties or {}
+    runtime_properties.update(updates)
+    rest.node_instances.update(node_instance_id, runtime_properties=runtime_properties, version=instance.version)
+
+
+def _roll_out(instances, change, updates, parallelism, max_wait, logger, record=_update_runtime_properties):
+    """
+    Apply 'change' to the k8s Deployment of each of the node 'instances', with at most 'parallelism'
+    changes in progress at once, and wait up to 'max_wait' seconds (0 means indefinitely) for each
+    rollout to complete.
+    'change' is called with the deployment description from an instance's runtime properties.
+    It makes the change and returns the keyword arguments for k8sclient.wait_for_deployment that
+    identify the rollout of the change.  Once all of the rollouts are over, 'updates' are recorded
+    with 'record' in the runtime properties of each instance whose Deployment was changed.
+    That happens in the calling thread: the Cloudify REST client gets the tenant and token from
+    the workflow's context, which the worker threads don't have.
+    Returns a dict mapping each instance id to a result with the status of its rollout
+    ("ready", "timeout" or "failed"), the time it took, and the error if it failed.
+    """
+    def roll_out(instance):
+        start = time.time()
+        deployment_description = instance.runtime_properties[K8S_DEPLOYMENT]
+        component_name = instance.runtime_properties[SERVICE_COMPONENT_NAME]
+        changed = False
+        try:
+            expected = change(deployment_description)
+            changed = True
+            ready = k8sclient.wait_for_deployment(deployment_description["location"],
+                                                  deployment_description["namespace"],
+                                                  component_name, max_wait, **expected)
+            result = {"status": "ready" if ready else "timeout"}
+        except Exception as e:
+            result = {"status": "failed", "error": str(e)}
+        result["latency"] = time.time() - start
+        logger.info("Rollout for {0} ({1}): {2}".format(component_name, instance.id, result))
+        return instance.id, changed, result
+
+    if not instances:
+        return {}
+    with futures.ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(instances)))) as executor:
+        rollouts = list(executor.map(roll_out, instances))
+
+    results = {}
+    for instance_id, changed, result in rollouts:
+        if changed:
+            try:
+                record(instance_id, updates)
+            except Exception as e:
+                logger.warning("Could not record {0} for {1}: {2}".format(updates, instance_id, e))
+                result = dict(result, status="failed", error="Changed, but could not record {0}: {1}".format(updates, e))
+        results[instance_id] = result
+    return results
+
+
+def _bulk_update(change, updates, node_type, node_ids, node_instance_ids, parallelism, max_wait):
+    instances = _select_instances(ctx.nodes, node_type, node_ids, node_instance_ids)
+    ctx.logger.info("Updating {0} node instance(s): {1}".format(len(instances), [i.id for i in instances]))
+
+    results = _roll_out(instances, change, updates, parallelism,
+                        get_setting("DEFAULT_MAX_WAIT") if max_wait is None else max_wait, ctx.logger)
+
+    not_ready = dict((instance_id, result) for instance_id, result in results.items() if result["status"] != "ready")
+    if not_ready:
+        raise NonRecoverableError("Update did not complete for {0} of {1} node instance(s): {2}"
+                                  .format(len(not_ready), len(results), not_ready))
+    ctx.logger.info("Update complete for {0} node instance(s)".format(len(results)))
+
+
+@workflow
+def bulk_scale(replicas, node_type=None, node_ids=None, node_instance_ids=None,
+               parallelism=DEFAULT_PARALLELISM, max_wait=None, **kwargs):
+    """ Scale the k8s Deployments of the selected node instances to 'replicas' replicas """
+    if replicas <= 0:
+        raise NonRecoverableError("Cannot scale to {0} replicas".format(replicas))
+
+    def change(deployment_description):
+        k8sclient.scale(deployment_description, replicas)
+        return {"replicas": replicas}
+
+    _bulk_update(change, {"replicas": replicas}, node_type, node_ids, node_instance_ids, parallelism, max_wait)
+
+
+@workflow
+def bulk_update_image(image, node_type=None, node_ids=None, node_instance_ids=None,
+                      parallelism=DEFAULT_PARALLELISM, max_wait=None, **kwargs):
+    """ Update the application container image of the k8s Deployments of the selected node instances """
+    if not image:
+        raise NonRecoverableError("Cannot update to unusable image '{0}'".format(image))
+
+    def change(deployment_description):
+        return {"min_generation": k8sclient.upgrade(deployment_description, image)}
+
+    _bulk_update(change, {"image": image}, node_type, node_ids, node_instance_ids, parallelism, max_wait)
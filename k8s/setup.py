@@ -28,6 +28,7 @@ setup(
     author='J. F. Lucas, Michael Hwang, Tommy Carpenter, Joanna Jeremicz, Sylwia Jakubek, Jan Malkiewicz, Remigiusz Janeczek, Piotr Marcinkiewicz, Tomasz Wrobel',
     packages=['k8splugin','k8sclient','configure'],
     zip_safe=False,
+    python_requires='>=3.6',
     install_requires=[
         'python-consul>=0.6.0',
         'onap-dcae-dcaepolicy-lib>=2.5.1',
@@ -29,6 +29,8 @@ def mockconfig(monkeypatch):
       config["consul_host"] = config["consul_dns_name"]
       return config
     monkeypatch.setattr(configure, 'configure', altconfig)
+    from k8splugin import tasks
+    monkeypatch.setattr(tasks, '_plugin_conf', None)
 
 @pytest.fixture()
 def mockk8sapi(monkeypatch):
@@ -51,21 +53,21 @@ def mockk8sapi(monkeypatch):
     # patched_core returns a CoreV1Api object with the
     # create_namespaced_service method stubbed out so that there
     # is no attempt to call the k8s API server
-    def patched_core():
+    def patched_core(api_client=None):
         monkeypatch.setattr(core, "create_namespaced_service", pseudo_service)
         return core
 
     # patched_ext returns an ExtensionsV1beta1Api object with the
     # create_namespaced_deployment method stubbed out so that there
     # is no attempt to call the k8s API server
-    def patched_ext():
+    def patched_ext(api_client=None):
         monkeypatch.setattr(ext,"create_namespaced_deployment", pseudo_deploy)
         return ext
 
     # patched_appsv1 returns an AppsV1Api object with the
     # create_namespaced_deployment method stubbed out so that there
     # is no attempt to call the k8s API server
-    def patched_appsv1():
+    def patched_appsv1(api_client=None):
         monkeypatch.setattr(ext,"create_namespaced_deployment", pseudo_deploy)
         return ext
 
@@ -0,0 +1,71 @@
+# ============LICENSE_START=======================================================
+# org.onap.dcae
+# ================================================================================
+# Copyright (c) 2021 AT&T Intellectual Property. All rights reserved.
+# ================================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END=========================================================
+
+import importlib
+import sys
+
+import pytest
+
+from k8splugin.cloudify_importer import NamespaceFinder
+
+
+@pytest.fixture()
+def split_namespace(monkeypatch, tmpdir):
+    """
+    'splitns' is split across two sys.path entries, and the first one makes it a regular
+    package, so the regular import system can't find splitns.auth in the second one
+    """
+    first, second = tmpdir.mkdir("first"), tmpdir.mkdir("second")
+    first.mkdir("splitns").join("__init__.py").write("")
+    first.join("splitns", "core.py").write("NAME = 'core'\n")
+    auth = second.mkdir("splitns").mkdir("auth")
+    auth.join("__init__.py").write("NAME = 'auth'\n")
+    second.join("splitns", "nopkg").mkdir().join("mod.py").write("NAME = 'mod'\n")
+
+    monkeypatch.setattr(sys, "path", [str(first), str(second)] + sys.path)
+    finder = NamespaceFinder(["splitns"])
+    monkeypatch.setattr(sys, "meta_path", sys.meta_path + [finder])
+    yield finder, second
+    for name in [name for name in sys.modules if name.split(".")[0] == "splitns"]:
+        del sys.modules[name]
+
+
+def test_find_split_namespace(split_namespace):
+    finder, second = split_namespace
+    assert importlib.import_module("splitns.core").NAME == "core"
+    assert importlib.import_module("splitns.auth").NAME == "auth"
+    # A directory without __init__.py is a namespace package; nothing is written into it
+    assert importlib.import_module("splitns.nopkg.mod").NAME == "mod"
+    assert not second.join("splitns", "nopkg", "__init__.py").exists()
+    # Other top-level packages are left to the regular import system
+    assert finder.find_spec("json") is None
+
+
+def test_negative_cache(split_namespace):
+    finder, second = split_namespace
+    for _ in range(3):
+        with pytest.raises(ImportError):
+            importlib.import_module("splitns.missing")
+    stats = finder.stats()
+    assert stats["misses"] == 1
+    assert stats["cached_misses"] == 2
+
+    # A new module shows up once its directory changes
+    second.join("splitns", "missing.py").write("NAME = 'missing'\n")
+    importlib.invalidate_caches()
+    assert importlib.import_module("splitns.missing").NAME == "missing"
@@ -68,3 +68,131 @@ def test_is_healthy_pure(mockconfig):
         return 0, [{ "Checks": [{"Status": "passing"}] }]
 
     assert True == dis._is_healthy_pure(fake_is_healthy, "some-component")
+
+def test_create_kv_conn_cached(mockconfig):
+    from k8splugin import discovery as dis
+
+    conn = dis.create_kv_conn("consul-server:8500")
+    assert conn is dis.create_kv_conn("consul-server:8500")
+    assert conn.http.host == "consul-server" and conn.http.port == 8500
+    assert conn is not dis.create_kv_conn("consul-server")
+    assert conn is not dis.create_kv_conn("consul-server:8500", read_timeout=120)
+
+    # Requests get the default timeouts and a pool of keep-alive connections
+    assert conn.http.session.timeout == (dis.CONSUL_CONNECT_TIMEOUT, dis.CONSUL_READ_TIMEOUT)
+    assert conn.http.session.get_adapter("http://consul-server:8500")._pool_maxsize == dis.CONSUL_POOL_SIZE
+
+def test_add_to_entry_backoff(monkeypatch, mockconfig):
+    from k8splugin import discovery as dis
+    import json
+
+    sleeps = []
+    monkeypatch.setattr(dis.time, "sleep", sleeps.append)
+
+    class FakeKV(object):
+        def __init__(self, conflicts):
+            self.value = json.dumps({"feed00": {}})
+            self.conflicts = conflicts
+        def get(self, key):
+            return (1, {"Value": self.value, "ModifyIndex": 1})
+        def put(self, key, value, cas):
+            if self.conflicts:
+                self.conflicts -= 1
+                return False
+            self.value = value
+            return True
+
+    class FakeConn(object):
+        def __init__(self, conflicts):
+            self.kv = FakeKV(conflicts)
+
+    before = dis.cas_stats()
+    conn = FakeConn(conflicts=3)
+    v = dis.add_many_to_entry(conn, "scn:dmaap", {"topic00": {}, "topic01": {}})
+    assert sorted(v) == ["feed00", "topic00", "topic01"]
+    assert json.loads(conn.kv.value) == v
+    # Backed off after each conflict, within the exponential bounds
+    assert len(sleeps) == 3
+    assert all(0 <= delay <= dis.CAS_BASE_DELAY * 2 ** i for i, delay in enumerate(sleeps))
+    after = dis.cas_stats()
+    assert after["updates"] - before["updates"] == 1
+    assert after["conflicts"] - before["conflicts"] == 3
+
+    # Gives up after max_attempts
+    with pytest.raises(dis.DiscoveryConflictError):
+        dis._cas_update(FakeConn(conflicts=10), "scn:dmaap", lambda v: v.update(x=1), max_attempts=4)
+    assert dis.cas_stats()["failures"] - after["failures"] == 1
+
+def test_consul_transaction(mockconfig):
+    from k8splugin import discovery as dis
+    import base64
+    import consul
+
+    class FakeTxn(object):
+        def __init__(self):
+            self.requests = []
+            self.error = None
+        def put(self, payload):
+            self.requests.append(payload)
+            if self.error:
+                raise self.error
+            return {"Results": []}
+
+    class FakeConn(object):
+        txn = FakeTxn()
+
+    # The configuration and the component's other keys go in one request
+    dis.push_service_component_config(FakeConn, "s-comp", {"a": 1})
+    assert FakeConn.txn.requests == [[
+        {"KV": {"Verb": "set", "Key": "s-comp", "Value": base64.b64encode(b'{"a": 1}').decode("ascii")}},
+        {"KV": {"Verb": "delete", "Key": "s-comp:rel"}},
+        {"KV": {"Verb": "delete", "Key": "s-comp:dmaap"}}]]
+
+    del FakeConn.txn.requests[:]
+    dis.remove_service_component_config(FakeConn, "s-comp")
+    assert [[op["KV"]["Key"] for op in ops] for ops in FakeConn.txn.requests] == [["s-comp", "s-comp:rel", "s-comp:dmaap"]]
+
+    # A transaction isn't split up: one with too many operations fails before anything is sent
+    del FakeConn.txn.requests[:]
+    txn = dis.ConsulTransaction(FakeConn)
+    for i in range(dis.CONSUL_TXN_MAX_OPS):
+        txn.set("key{0}".format(i), "value")
+    with pytest.raises(dis.DiscoveryError):
+        txn.delete("one-too-many")
+    txn.commit()
+    assert len(FakeConn.txn.requests) == 1 and len(FakeConn.txn.requests[0]) == dis.CONSUL_TXN_MAX_OPS
+    # Committing again sends nothing
+    txn.commit()
+    assert len(FakeConn.txn.requests) == 1
+
+    FakeConn.txn.error = consul.base.ClientError("409 rolled back")
+    with pytest.raises(dis.DiscoveryError):
+        dis.push_service_component_config(FakeConn, "s-comp", "{}")
+
+def test_get_cached_kv_value(monkeypatch, mockconfig):
+    from k8splugin import discovery as dis
+
+    reads = []
+    class FakeKV(object):
+        value = b'{"namespace": "onap"}'
+        def get(self, key, consistency=None):
+            reads.append((key, consistency))
+            return (5, {"Value": self.value, "ModifyIndex": 5} if self.value else None)
+
+    class FakeConn(object):
+        kv = FakeKV()
+
+    monkeypatch.setattr(dis, "create_kv_conn", lambda host: FakeConn)
+    monkeypatch.setattr(dis, "_kv_values", {})
+
+    # Read once, consistently, for the whole process
+    assert dis.get_cached_kv_value("consul:8500", "k8s-plugin") == {"namespace": "onap"}
+    assert dis.get_cached_kv_value("consul:8500", "k8s-plugin") == {"namespace": "onap"}
+    assert reads == [("k8s-plugin", "consistent")]
+
+    FakeConn.kv.value = None
+    with pytest.raises(dis.DiscoveryKVEntryNotFoundError):
+        dis.get_cached_kv_value("consul:8500", "other-plugin")
+    with pytest.raises(dis.DiscoveryKVEntryNotFoundError):
+        dis.get_cached_kv_value("consul:8500", "other-plugin")
+    assert len(reads) == 2
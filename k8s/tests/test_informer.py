@@ -0,0 +1,176 @@
+# ============LICENSE_START=======================================================
+# org.onap.dcae
+# ================================================================================
+# Copyright (c) 2021 AT&T Intellectual Property. All rights reserved.
+# ================================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END=========================================================
+
+import threading
+
+import pytest
+
+
+class _Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _dep(name, ready):
+    return _Obj(metadata=_Obj(name=name, resource_version="1"), ready=ready)
+
+
+@pytest.fixture()
+def fakewatch(monkeypatch):
+    """ Replace the k8s list and watch calls with a list result and a queue of watch events """
+    try:
+        import queue
+    except ImportError:
+        import Queue as queue
+    from kubernetes import client, watch
+
+    state = {"lists": 0, "watches": 0, "list_error": None,
+             "items": [], "events": queue.Queue(), "stream": None}
+
+    class FakeApps(object):
+        def __init__(self, api_client=None):
+            pass
+
+        def list_namespaced_deployment(self, namespace, **kwargs):
+            state["lists"] += 1
+            if state["list_error"]:
+                raise state["list_error"]
+            return _Obj(metadata=_Obj(resource_version="1"), items=state["items"])
+
+    class FakeWatch(object):
+        resource_version = None
+
+        def stream(self, func, namespace, **kwargs):
+            state["watches"] += 1
+            events = state["stream"]() if state["stream"] else None
+            if isinstance(events, Exception):
+                raise events
+            if events is not None:
+                for event in events:
+                    yield event
+                return
+            while True:
+                try:
+                    event = state["events"].get(timeout=kwargs["timeout_seconds"])
+                except queue.Empty:
+                    return
+                yield event
+
+        def stop(self):
+            pass
+
+    monkeypatch.setattr(client, "AppsV1Api", FakeApps)
+    monkeypatch.setattr(watch, "Watch", FakeWatch)
+    return state
+
+
+def test_waiters_share_one_watch(fakewatch):
+    from k8sclient.informer import DeploymentInformer
+
+    fakewatch["items"] = [_dep("dep-a", False), _dep("dep-b", False)]
+    informer = DeploymentInformer(None, "ns", watch_timeout=1)
+
+    results = {}
+    def wait(name):
+        results[name] = informer.wait_for(name, lambda d: d.ready, timeout=10)
+
+    threads = [threading.Thread(target=wait, args=(name,)) for name in ("dep-a", "dep-b")]
+    for t in threads:
+        t.start()
+
+    fakewatch["events"].put({"type": "MODIFIED", "object": _dep("dep-a", True)})
+    fakewatch["events"].put({"type": "MODIFIED", "object": _dep("dep-b", True)})
+    for t in threads:
+        t.join(10)
+
+    assert results == {"dep-a": True, "dep-b": True}
+    assert fakewatch["lists"] == 1
+    stats = informer.stats()
+    assert stats["waits"] == 2
+    assert stats["waiters"] == 0
+    assert stats["deployments"] == 2
+    informer.stop()
+
+
+def test_wait_timeout(fakewatch):
+    from k8sclient.informer import DeploymentInformer
+
+    fakewatch["items"] = [_dep("dep-a", False)]
+    informer = DeploymentInformer(None, "ns", watch_timeout=1)
+
+    assert not informer.wait_for("dep-a", lambda d: d.ready, timeout=0.5)
+    assert informer.stats()["timeouts"] == 1
+
+    # Already satisfied in the cache
+    fakewatch["events"].put({"type": "ADDED", "object": _dep("dep-c", True)})
+    assert informer.wait_for("dep-c", lambda d: d.ready, timeout=5)
+    informer.stop()
+
+
+def test_list_failure(fakewatch):
+    from k8sclient.informer import DeploymentInformer, InformerError
+
+    fakewatch["list_error"] = RuntimeError("forbidden")
+    informer = DeploymentInformer(None, "ns", watch_timeout=1, retry_delay=0.1)
+
+    with pytest.raises(InformerError):
+        informer.wait_for("dep-a", lambda d: True, timeout=5)
+    informer.stop()
+
+
+def test_expired_resource_version(fakewatch):
+    from kubernetes import client
+    from k8sclient.informer import DeploymentInformer
+
+    # The watch library raises the 410 for an expired resource version,
+    # or ends the stream without any events
+    streams = [client.rest.ApiException(status=410, reason="too old"), [],
+               client.rest.ApiException(status=410, reason="too old")]
+    fakewatch["stream"] = lambda: streams.pop(0) if streams else None
+    fakewatch["events"].put({"type": "ADDED", "object": _dep("dep-a", True)})
+    informer = DeploymentInformer(None, "ns", watch_timeout=60, retry_delay=0.1)
+
+    assert informer.wait_for("dep-a", lambda d: d.ready, timeout=10)
+    stats = informer.stats()
+    informer.stop()
+
+    # Each failed watch was followed by a fresh list, after backing off
+    assert stats["lists"] == 4
+    assert stats["watches"] == 4
+
+
+def test_stop_wakes_waiters(fakewatch):
+    from k8sclient.informer import DeploymentInformer, InformerStopped
+
+    fakewatch["items"] = [_dep("dep-a", False)]
+    informer = DeploymentInformer(None, "ns", watch_timeout=1)
+
+    results = []
+    def wait():
+        try:
+            informer.wait_for("dep-a", lambda d: d.ready)
+        except InformerStopped:
+            results.append("stopped")
+
+    t = threading.Thread(target=wait)
+    t.start()
+    while informer.waiters == 0:
+        t.join(0.01)
+    informer.stop()
+    t.join(5)
+    assert results == ["stopped"]
@@ -154,6 +154,31 @@ def test_parse_ports():
     container_ports, port_map = parse_ports(port_list)
     assert port_map == expected_port_map
 
+def test_parse_port_ranges():
+    from k8sclient.k8sclient import parse_ports
+
+    container_ports, port_map = parse_ports(["30000-30999/udp:0", "8080:0", "8080:0", "9000-9002:31000-31002"])
+    assert len(container_ports) == 1000 + 1 + 3
+    assert container_ports[0] == (30000, "UDP") and container_ports[999] == (30999, "UDP")
+    assert container_ports[1000] == (8080, "TCP")
+    assert port_map[(30500, "UDP", False)] == 0
+    assert port_map[(9001, "TCP", False)] == 31001
+
+    for port in ["30999-30000:0", "9000-9002:31000", "9000-9002:31000-31001", "9000-9002:0-2", "9000-:0"]:
+        with pytest.raises(ValueError):
+            parse_ports([port])
+
+def test_process_port_map():
+    from k8sclient.k8sclient import parse_ports, _process_port_map
+
+    container_ports, port_map = parse_ports([{"concat": ["8080", ":", "30080"], "ipv6": True},
+                                             "8080:30081", "53/udp:0"])
+    service_ports, exposed_ports, exposed_ports_ipv6 = _process_port_map(port_map)
+    assert [(p.name, p.port, p.protocol, p.node_port) for p in service_ports] == \
+        [("port-t-8080", 8080, "TCP", None), ("port-u-53", 53, "UDP", None)]
+    assert [(p.name, p.port, p.node_port) for p in exposed_ports] == [("xport-t-8080", 8080, 30081)]
+    assert [(p.name, p.port, p.node_port) for p in exposed_ports_ipv6] == [("xport-t-8080", 8080, 30080)]
+
 def test_create_container():
     from k8sclient.k8sclient import _create_container_object
     from kubernetes import client
@@ -183,3 +208,313 @@ def test_create_probe():
     for hc in script_checks:
         probe = _create_probe(hc, 13131)
         assert probe._exec.command[0] == hc["script"]
+
+def test_configure_api_caches_clients(monkeypatch, tmpdir):
+    import os
+    import k8sclient.k8sclient
+    from kubernetes import client
+
+    kubeconfig = tmpdir.join("kubeconfig")
+    kubeconfig.write("")
+    monkeypatch.setattr(k8sclient.k8sclient, "K8S_CONFIG_PATH", str(kubeconfig))
+    monkeypatch.setattr(k8sclient.k8sclient, "_api_clients", {})
+
+    loads = []
+    def fake_load(location=None):
+        loads.append(location)
+        return client.Configuration()
+    monkeypatch.setattr(k8sclient.k8sclient, "_load_client_configuration", fake_load)
+
+    # Repeated calls for the same location reuse the same client
+    c1 = k8sclient.k8sclient._configure_api("central")
+    assert k8sclient.k8sclient._configure_api("central") is c1
+    assert loads == ["central"]
+
+    # Each location gets its own client
+    assert k8sclient.k8sclient._configure_api("edge") is not c1
+    assert loads == ["central", "edge"]
+
+    # A change to the kubeconfig file invalidates the cached client
+    st = os.stat(str(kubeconfig))
+    os.utime(str(kubeconfig), (st.st_atime, st.st_mtime + 10))
+    assert k8sclient.k8sclient._configure_api("central") is not c1
+    assert loads == ["central", "edge", "central"]
+
+class _Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+def _fake_deployment(replicas, available, updated, generation=1, observed_generation=1, resource_version="1"):
+    return _Obj(metadata=_Obj(generation=generation, resource_version=resource_version),
+                spec=_Obj(replicas=replicas),
+                status=_Obj(available_replicas=available, updated_replicas=updated,
+                            observed_generation=observed_generation))
+
+def test_deployment_is_ready():
+    from k8sclient.k8sclient import _deployment_is_ready
+
+    assert _deployment_is_ready(_fake_deployment(2, 2, 2))
+    assert not _deployment_is_ready(_fake_deployment(2, 1, 2))
+    assert not _deployment_is_ready(_fake_deployment(2, 2, 1))
+    assert not _deployment_is_ready(_fake_deployment(2, None, None))
+    # Status not yet updated for the latest spec
+    assert not _deployment_is_ready(_fake_deployment(2, 2, 2, generation=2, observed_generation=1))
+
+def test_wait_for_deployment_informer(monkeypatch):
+    import k8sclient.k8sclient
+
+    waits = []
+    class FakeInformer(object):
+        def wait_for(self, name, condition, timeout):
+            waits.append((name, timeout))
+            return condition(_fake_deployment(2, 2, 2))
+
+    monkeypatch.setattr(k8sclient.k8sclient, "_get_informer", lambda loc, ns: FakeInformer())
+
+    assert k8sclient.k8sclient.wait_for_deployment("loc", "ns", "comp", 0)
+    assert waits == [("dep-comp", None)]
+
+def test_wait_for_deployment_poll_fallback(monkeypatch):
+    import k8sclient.k8sclient
+
+    def broken_informer(location, namespace):
+        raise Exception("watch not available")
+
+    results = [False, False, False, True]
+    def fake_read_status(location, namespace, component_name):
+        return _fake_deployment(1, 1 if results.pop(0) else 0, 1)
+
+    sleeps = []
+    monkeypatch.setattr(k8sclient.k8sclient, "_get_informer", broken_informer)
+    monkeypatch.setattr(k8sclient.k8sclient, "_read_deployment_status", fake_read_status)
+    monkeypatch.setattr(k8sclient.k8sclient.time, "sleep", sleeps.append)
+
+    assert k8sclient.k8sclient.wait_for_deployment("loc", "ns", "comp", 0)
+    # Exponential backoff between status checks
+    assert sleeps == [1, 2, 4]
+
+    # Never ready
+    monkeypatch.setattr(k8sclient.k8sclient, "_read_deployment_status",
+                        lambda loc, ns, comp: _fake_deployment(1, 0, 1))
+    clock = [1000.0]
+    def fake_sleep(t):
+        clock[0] += t
+    monkeypatch.setattr(k8sclient.k8sclient.time, "sleep", fake_sleep)
+    monkeypatch.setattr(k8sclient.k8sclient.time, "time", lambda: clock[0])
+    assert not k8sclient.k8sclient.wait_for_deployment("loc", "ns", "comp", 10)
+    assert clock[0] == 1010.0
+
+def test_execute_command_in_deployment(monkeypatch):
+    import threading
+    import k8sclient.k8sclient
+    from kubernetes import client
+
+    class FakeCore(object):
+        def __init__(self, api_client=None):
+            pass
+        def list_namespaced_pod(self, namespace, label_selector, field_selector):
+            return _Obj(items=[_Obj(metadata=_Obj(name="pod-{0}".format(i))) for i in range(6)])
+
+    lock = threading.Lock()
+    running = [0, 0]
+    def fake_exec(location, namespace, pod_name, command, timeout):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        threading.Event().wait(0.05)
+        with lock:
+            running[0] -= 1
+        return {"pod": pod_name, "output": "", "status": "ok", "exit_code": 0, "latency": 0.05}
+
+    monkeypatch.setattr(client, "CoreV1Api", FakeCore)
+    monkeypatch.setattr(k8sclient.k8sclient, "_configure_api", lambda location: None)
+    monkeypatch.setattr(k8sclient.k8sclient, "_execute_command_in_pod", fake_exec)
+
+    dep = {"location": "loc", "namespace": "ns", "deployment": "dep-comp"}
+    resp = k8sclient.k8sclient.execute_command_in_deployment(dep, ["/bin/true"], max_concurrency=3)
+    assert [r["pod"] for r in resp] == ["pod-{0}".format(i) for i in range(6)]
+    # Bounded fan-out
+    assert 1 < running[1] <= 3
+
+    def failing_exec(location, namespace, pod_name, command, timeout):
+        if pod_name == "pod-2":
+            raise client.rest.ApiException(status=500, reason="Internal error")
+        return fake_exec(location, namespace, pod_name, command, timeout)
+
+    monkeypatch.setattr(k8sclient.k8sclient, "_execute_command_in_pod", failing_exec)
+    with pytest.raises(client.rest.ApiException):
+        k8sclient.k8sclient.execute_command_in_deployment(dep, ["/bin/true"])
+
+    with pytest.raises(ValueError):
+        k8sclient.k8sclient.execute_command_in_deployment(dep, ["/bin/true"], timeout=0)
+
+def test_execute_command_in_pod(monkeypatch):
+    import k8sclient.k8sclient
+    from kubernetes import client, stream
+
+    class FakeResp(object):
+        def __init__(self, finishes, returncode):
+            self.open = True
+            self.finishes = finishes
+            self.returncode = returncode
+        def run_forever(self, timeout=None):
+            if self.finishes:
+                self.open = False
+        def is_open(self):
+            return self.open
+        def read_all(self):
+            return "some output"
+        def close(self):
+            self.open = False
+
+    resps = []
+    def fake_stream(func, **kwargs):
+        assert kwargs["_preload_content"] is False
+        return resps.pop(0)
+
+    monkeypatch.setattr(stream, "stream", fake_stream)
+    monkeypatch.setattr(k8sclient.k8sclient, "_configure_api", lambda location: client.ApiClient())
+
+    resps[:] = [FakeResp(True, 0), FakeResp(True, 2), FakeResp(False, None)]
+    ok = k8sclient.k8sclient._execute_command_in_pod("loc", "ns", "pod-0", ["/bin/true"], timeout=1)
+    assert (ok["pod"], ok["output"], ok["status"], ok["exit_code"]) == ("pod-0", "some output", "ok", 0)
+    failed = k8sclient.k8sclient._execute_command_in_pod("loc", "ns", "pod-0", ["/bin/false"], timeout=1)
+    assert (failed["status"], failed["exit_code"]) == ("failed", 2)
+    hung = k8sclient.k8sclient._execute_command_in_pod("loc", "ns", "pod-0", ["/bin/sleep"], timeout=1)
+    assert (hung["status"], hung["exit_code"]) == ("timeout", None)
+
+    def gone(func, **kwargs):
+        raise client.rest.ApiException(status=0, reason="404 Not Found")
+    monkeypatch.setattr(stream, "stream", gone)
+    missing = k8sclient.k8sclient._execute_command_in_pod("loc", "ns", "pod-0", ["/bin/true"])
+    assert missing["status"] == "not found"
+
+    # A zero timeout would make the websocket client wait forever
+    with pytest.raises(ValueError):
+        k8sclient.k8sclient._execute_command_in_pod("loc", "ns", "pod-0", ["/bin/true"], timeout=0)
+
+def test_diff():
+    from k8sclient.k8sclient import _diff
+
+    live = {"metadata": {"name": "dep-comp", "uid": "1234", "labels": {"app": "comp"}},
+            "spec": {"replicas": 2,
+                     "template": {"spec": {"containers": [{"name": "comp", "image": "comp:1.0",
+                                                           "resources": {"limits": {"cpu": "500m", "memory": "2Gi"}},
+                                                           "terminationMessagePath": "/dev/termination-log"}]}}}}
+    desired = {"metadata": {"name": "dep-comp", "labels": {"app": "comp"}, "annotations": None},
+               "spec": {"replicas": 2,
+                        "template": {"spec": {"containers": [{"name": "comp", "image": "comp:1.0",
+                                                              "resources": {"limits": {"cpu": 0.5, "memory": "2Gi"}}}]}}}}
+
+    # Fields set by k8s, and quantities written differently, aren't differences
+    assert _diff(desired, live) is None
+
+    desired["spec"]["replicas"] = 3
+    assert _diff(desired, live) == {"spec": {"replicas": 3}}
+
+    desired["spec"]["replicas"] = 2
+    desired["spec"]["template"]["spec"]["containers"][0]["image"] = "comp:2.0"
+    containers = _diff(desired, live)["spec"]["template"]["spec"]["containers"]
+    assert containers[0]["image"] == "comp:2.0"
+    assert containers[-1] == {"$patch": "replace"}
+    assert _diff(desired, live, strategic=False)["spec"]["template"]["spec"]["containers"][-1]["name"] == "comp"
+
+    # Outside resource limits and requests, numbers written differently are different
+    live = {"spec": {"containers": [{"name": "comp", "env": [{"name": "N", "value": "1000"}]}]}}
+    desired = {"spec": {"containers": [{"name": "comp", "env": [{"name": "N", "value": "1k"}]}]}}
+    assert _diff(desired, live)["spec"]["containers"][0]["env"][0]["value"] == "1k"
+
+    # Lists of objects without names are replaced too
+    live = {"spec": {"ports": [{"port": 80, "targetPort": 8080}, {"port": 443, "targetPort": 8443}]}}
+    desired = {"spec": {"ports": [{"port": 80, "targetPort": 8080}]}}
+    assert _diff(desired, live) == {"spec": {"ports": [{"port": 80, "targetPort": 8080}, {"$patch": "replace"}]}}
+
+def test_reconcile_journals_creations(monkeypatch):
+    import threading
+    from kubernetes import client
+    from k8sclient.k8sclient import _DeployJournal, _create_objects, _reconcile_object
+
+    class FakeLogger(object):
+        def info(self, text):
+            raise RuntimeError("logging failed")
+
+    def not_found():
+        raise client.rest.ApiException(status=404)
+
+    # Worker threads get the logger, not ctx, and a creation is journaled even if logging it fails
+    created = []
+    deleted = []
+    journal = _DeployJournal()
+    submit = lambda recorded: _reconcile_object(FakeLogger(), "service", "svc", {}, not_found,
+                                                lambda: created.append(threading.current_thread()),
+                                                None, recorded)
+    with pytest.raises(RuntimeError):
+        _create_objects([("service", "svc", submit, lambda: deleted.append("svc"))], journal)
+    assert len(created) == 1 and created[0] is not threading.current_thread()
+    journal.rollback(FakeLogger())
+    assert deleted == ["svc"]
+
+def test_rollout_condition():
+    from k8sclient.k8sclient import _rollout_condition
+
+    assert _rollout_condition()(_fake_deployment(2, 2, 2))
+    # A cached copy from before the change
+    assert not _rollout_condition(min_generation=2)(_fake_deployment(2, 2, 2))
+    assert _rollout_condition(min_generation=2)(_fake_deployment(2, 2, 2, generation=2, observed_generation=2))
+    assert not _rollout_condition(replicas=3)(_fake_deployment(2, 2, 2))
+    assert _rollout_condition(replicas=3)(_fake_deployment(3, 3, 3))
+
+def test_scale_and_upgrade(monkeypatch):
+    import k8sclient.k8sclient
+    from kubernetes import client
+
+    calls = []
+    class FakeApps(object):
+        def __init__(self, api_client=None):
+            pass
+        def read_namespaced_deployment(self, name, namespace):
+            raise AssertionError("no need to read the deployment")
+        def patch_namespaced_deployment_scale(self, name, namespace, body):
+            calls.append(("scale", name, namespace, body))
+        def patch_namespaced_deployment(self, name, namespace, body):
+            calls.append(("patch", name, namespace, body))
+            return _fake_deployment(1, 1, 1, generation=7)
+
+    monkeypatch.setattr(client, "AppsV1Api", FakeApps)
+    monkeypatch.setattr(k8sclient.k8sclient, "_configure_api", lambda location: None)
+    dep = {"location": "loc", "namespace": "ns", "deployment": "dep-comp"}
+
+    k8sclient.k8sclient.scale(dep, 3)
+    k8sclient.k8sclient.scale(dep, 4, resource_version="99")
+    assert calls == [("scale", "dep-comp", "ns", {"spec": {"replicas": 3}}),
+                     ("scale", "dep-comp", "ns", {"spec": {"replicas": 4}, "metadata": {"resourceVersion": "99"}})]
+
+    del calls[:]
+    assert k8sclient.k8sclient.upgrade(dep, "comp:2.0") == 7
+    assert k8sclient.k8sclient.upgrade(dep, "comp:3.0", container_index=1, resource_version="99") == 7
+    assert calls[0][3] == [{"op": "replace", "path": "/spec/template/spec/containers/0/image", "value": "comp:2.0"}]
+    assert calls[1][3] == [{"op": "test", "path": "/metadata/resourceVersion", "value": "99"},
+                           {"op": "replace", "path": "/spec/template/spec/containers/1/image", "value": "comp:3.0"}]
+
+def test_from_template():
+    import k8sclient.k8sclient
+    from kubernetes import client
+
+    builds = []
+    def build(image, env):
+        builds.append(image)
+        return client.V1Container(name="init", image=image, env=[client.V1EnvVar(name=k, value=v) for k, v in env.items()],
+                                  volume_mounts=[client.V1VolumeMount(name="tls-info", mount_path="/certs")])
+
+    first = k8sclient.k8sclient._from_template("test", ("img:1", {"A": "1"}), build)
+    second = k8sclient.k8sclient._from_template("test", ("img:1", {"A": "1"}), build)
+    assert builds == ["img:1"]
+    assert first == second
+    # Each caller gets its own copy
+    second.volume_mounts.append(client.V1VolumeMount(name="other", mount_path="/other"))
+    second.env[0].value = "2"
+    third = k8sclient.k8sclient._from_template("test", ("img:1", {"A": "1"}), build)
+    assert len(third.volume_mounts) == 1 and third.env[0].value == "1"
+
+    k8sclient.k8sclient._from_template("test", ("img:1", {"A": "2"}), build)
+    assert builds == ["img:1", "img:1"]
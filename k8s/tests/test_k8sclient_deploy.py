@@ -179,3 +179,128 @@ def test_deploy_config_map(mockk8sapi):
 
     # then
     assert app_container.volume_mounts[1].mount_path == "/path/to/configMap"
+
+
+def test_deploy_rollback(monkeypatch):
+    """ A failure creating one object removes the objects already created """
+    import copy
+    import k8sclient.k8sclient
+    from kubernetes import client
+
+    created = []
+    deleted = []
+
+    class FakeCore(object):
+        def __init__(self, api_client=None):
+            pass
+        def create_namespaced_secret(self, namespace, body):
+            created.append(("secret", "testcomponent-cert-password-abcde"))
+            return client.V1Secret(metadata=client.V1ObjectMeta(name="testcomponent-cert-password-abcde"))
+        def delete_namespaced_secret(self, name, namespace):
+            deleted.append(("secret", name))
+        def create_namespaced_service(self, namespace, service):
+            if service.spec.type == "NodePort":
+                raise client.rest.ApiException(status=422, reason="Unprocessable Entity")
+            created.append(("service", service.metadata.name))
+        def delete_namespaced_service(self, name, namespace):
+            deleted.append(("service", name))
+
+    class FakeApps(object):
+        def __init__(self, api_client=None):
+            pass
+        def create_namespaced_deployment(self, namespace, dep):
+            created.append(("deployment", dep.metadata.name))
+        def delete_namespaced_deployment(self, name, namespace, body):
+            deleted.append(("deployment", name))
+
+    class FakeCustomObjects(object):
+        def __init__(self, api_client=None):
+            pass
+        def create_namespaced_custom_object(self, group, version, namespace, plural, body):
+            created.append(("certificate", body["metadata"]["name"]))
+        def delete_namespaced_custom_object(self, group, version, name, namespace, plural):
+            deleted.append(("certificate", name))
+
+    monkeypatch.setattr(k8sclient.k8sclient, "_configure_api", lambda location: None)
+    monkeypatch.setattr(client, "CoreV1Api", FakeCore)
+    monkeypatch.setattr(client, "AppsV1Api", FakeApps)
+    monkeypatch.setattr(client, "CustomObjectsApi", FakeCustomObjects)
+
+    config = copy.deepcopy(K8S_CONFIGURATION)
+    config["cmpv2_issuer"]["enabled"] = "true"
+    kwargs = copy.deepcopy(BASIC_KWARGS)
+    kwargs.update(copy.deepcopy(KWARGS_WITH_EXTERNAL_CERT))
+    kwargs["ports"] = ["80:0", "443:30443"]
+
+    with pytest.raises(client.rest.ApiException):
+        do_deploy(config, kwargs)
+
+    assert len(created) == 4
+    assert sorted(deleted) == sorted(created)
+    # The password secret was created first, so it's removed last
+    assert deleted[-1] == ("secret", "testcomponent-cert-password-abcde")
+
+
+def test_deploy_reconcile(monkeypatch):
+    """ Redeploying with reconcile patches only what has changed """
+    import copy
+    import k8sclient.k8sclient
+    from kubernetes import client
+
+    store = {}
+    created = []
+    patched = []
+
+    def read(name):
+        if name not in store:
+            raise client.rest.ApiException(status=404, reason="Not Found")
+        return store[name]
+
+    def create(obj):
+        store[obj.metadata.name] = k8sclient.k8sclient._serialize(obj)
+        created.append(obj.metadata.name)
+
+    class FakeCore(object):
+        def __init__(self, api_client=None):
+            pass
+        def read_namespaced_service(self, name, namespace):
+            return read(name)
+        def create_namespaced_service(self, namespace, service):
+            create(service)
+        def patch_namespaced_service(self, name, namespace, body):
+            patched.append((name, body))
+
+    class FakeApps(object):
+        def __init__(self, api_client=None):
+            pass
+        def read_namespaced_deployment(self, name, namespace):
+            return read(name)
+        def create_namespaced_deployment(self, namespace, dep):
+            create(dep)
+        def patch_namespaced_deployment(self, name, namespace, body):
+            patched.append((name, body))
+
+    monkeypatch.setattr(k8sclient.k8sclient, "_configure_api", lambda location: None)
+    monkeypatch.setattr(client, "CoreV1Api", FakeCore)
+    monkeypatch.setattr(client, "AppsV1Api", FakeApps)
+
+    kwargs = copy.deepcopy(BASIC_KWARGS)
+    kwargs["reconcile"] = True
+
+    # Nothing there yet
+    do_deploy(K8S_CONFIGURATION, copy.deepcopy(kwargs))
+    assert sorted(created) == ["dep-testcomponent", "testcomponent"]
+
+    # Nothing changed
+    created[:] = []
+    dep, deployment_description = do_deploy(K8S_CONFIGURATION, copy.deepcopy(kwargs))
+    assert created == [] and patched == []
+    assert deployment_description["deployment"] == "dep-testcomponent"
+    assert deployment_description["services"] == ["testcomponent"]
+
+    # A changed environment variable
+    kwargs["env"]["NAME1"] = "newvalue"
+    do_deploy(K8S_CONFIGURATION, copy.deepcopy(kwargs))
+    assert created == []
+    assert [name for name, body in patched] == ["dep-testcomponent"]
+    assert list(patched[0][1].keys()) == ["spec"]
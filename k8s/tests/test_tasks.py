@@ -122,19 +122,22 @@ def test_verify_container(monkeypatch, mockconfig):
     from k8splugin import tasks
     from k8splugin.exceptions import DockerPluginDeploymentError
 
-    def fake_is_available_success(loc, ch, scn):
+    calls = []
+    def fake_wait_for_deployment_success(loc, ns, scn, max_wait):
+        calls.append((loc, ns, scn, max_wait))
         return True
 
-    monkeypatch.setattr(k8sclient, "is_available",
-            fake_is_available_success)
+    monkeypatch.setattr(k8sclient, "wait_for_deployment",
+            fake_wait_for_deployment_success)
 
     assert tasks._verify_k8s_deployment("some-location","some-name", 3)
+    assert calls == [("some-location", tasks.get_setting("DCAE_NAMESPACE"), "some-name", 3)]
 
-    def fake_is_available_never_good(loc, ch, scn):
+    def fake_wait_for_deployment_never_good(loc, ns, scn, max_wait):
         return False
 
-    monkeypatch.setattr(k8sclient, "is_available",
-            fake_is_available_never_good)
+    monkeypatch.setattr(k8sclient, "wait_for_deployment",
+            fake_wait_for_deployment_never_good)
 
     assert not tasks._verify_k8s_deployment("some-location", "some-name", 2)
 
@@ -188,3 +191,46 @@ def test_notify_container(mockconfig):
 
     test_input = { "docker_config": { "policy": { "trigger_type": "unknown" } } }
     assert [] == tasks._notify_container(**test_input)
+
+def test_notify_container_exec_settings(monkeypatch, mockconfig):
+    from cloudify.mocks import MockCloudifyContext
+    from cloudify.state import current_ctx
+    from configure import configure
+    from k8splugin import tasks
+    import k8sclient
+
+    def altconfig():
+        config = configure._set_defaults()
+        config["exec"] = {"timeout": 5}
+        return config
+    monkeypatch.setattr(configure, "configure", altconfig)
+
+    calls = []
+    def fake_execute(deployment_description, command, max_concurrency, timeout):
+        calls.append((command[0], max_concurrency, timeout))
+        return [{"pod": "pod-0", "status": "ok"}]
+    monkeypatch.setattr(k8sclient, "execute_command_in_deployment", fake_execute)
+
+    current_ctx.set(MockCloudifyContext(node_id="test_node_id", runtime_properties={tasks.K8S_DEPLOYMENT: {}}))
+    try:
+        test_input = { "docker_config": { "policy": { "trigger_type": "docker", "script_path": "/notify.sh" } },
+                       "policies": [], "updated_policies": [], "removed_policies": [] }
+        assert tasks._notify_container(**test_input) == [{"pod": "pod-0", "status": "ok"}]
+    finally:
+        current_ctx.clear()
+    # Settings missing from a partial "exec" object keep their defaults
+    assert calls == [("/notify.sh", configure.EXEC_MAX_CONCURRENCY, 5)]
+
+def test_get_setting_reads_config_once(monkeypatch, mockconfig):
+    from configure import configure
+    from k8splugin import tasks
+
+    calls = []
+    def counting_configure():
+        calls.append(1)
+        return configure._set_defaults()
+    monkeypatch.setattr(configure, "configure", counting_configure)
+
+    assert tasks.get_setting("DCAE_NAMESPACE") == configure.DCAE_NAMESPACE
+    assert tasks.get_setting("DEFAULT_MAX_WAIT") == configure.DEFAULT_MAX_WAIT
+    assert len(calls) == 1
@@ -0,0 +1,135 @@
+# ============LICENSE_START=======================================================
+# org.onap.dcae
+# ================================================================================
+# Copyright (c) 2021 AT&T Intellectual Property. All rights reserved.
+# ================================================================================
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============LICENSE_END=========================================================
+
+import threading
+
+
+class _Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _instance(instance_id, k8s=True):
+    runtime_properties = {"service_component_name": "comp-" + instance_id}
+    if k8s:
+        runtime_properties["k8s_deployment"] = {"location": "loc", "namespace": "ns",
+                                                "deployment": "dep-comp-" + instance_id}
+    return _Obj(id=instance_id, runtime_properties=runtime_properties)
+
+
+class _Logger(object):
+    def info(self, text):
+        print(text)
+
+    def warning(self, text):
+        print(text)
+
+
+def _nodes():
+    return [_Obj(id="collector", type_hierarchy=["cloudify.nodes.Root", "dcae.nodes.ContainerizedServiceComponent"],
+                 instances=[_instance("collector_1"), _instance("collector_2")]),
+            _Obj(id="app", type_hierarchy=["cloudify.nodes.Root", "dcae.nodes.ContainerizedApplication"],
+                 instances=[_instance("app_1"), _instance("app_2", k8s=False)])]
+
+
+def test_select_instances(mockconfig):
+    from k8splugin import workflows
+
+    def ids(instances):
+        return sorted(i.id for i in instances)
+
+    assert ids(workflows._select_instances(_nodes())) == ["app_1", "collector_1", "collector_2"]
+    assert ids(workflows._select_instances(_nodes(), node_type="dcae.nodes.ContainerizedServiceComponent")) == \
+        ["collector_1", "collector_2"]
+    assert ids(workflows._select_instances(_nodes(), node_ids=["app"])) == ["app_1"]
+    assert ids(workflows._select_instances(_nodes(), node_instance_ids=["collector_2", "app_2"])) == ["collector_2"]
+
+
+def test_roll_out(monkeypatch, mockconfig):
+    import k8sclient
+    from k8splugin import workflows
+
+    lock = threading.Lock()
+    in_progress = [0, 0]
+    def fake_wait(location, namespace, component_name, max_wait, **expected):
+        assert expected == {"replicas": 3}
+        with lock:
+            in_progress[0] += 1
+            in_progress[1] = max(in_progress)
+        threading.Event().wait(0.05)
+        with lock:
+            in_progress[0] -= 1
+        return component_name != "comp-collector_2"
+
+    monkeypatch.setattr(k8sclient, "wait_for_deployment", fake_wait)
+
+    changed = []
+    def change(deployment_description):
+        if deployment_description["deployment"] == "dep-comp-app_1":
+            raise Exception("Conflict")
+        changed.append(deployment_description["deployment"])
+        return {"replicas": 3}
+
+    recorded = []
+    instances = workflows._select_instances(_nodes()) + [_instance("extra_{0}".format(i)) for i in range(4)]
+    results = workflows._roll_out(instances, change, {"replicas": 3}, 2, 10, _Logger(),
+                                  record=lambda instance_id, updates: recorded.append(instance_id))
+
+    assert results["collector_1"]["status"] == "ready"
+    assert results["collector_2"]["status"] == "timeout"
+    assert results["app_1"]["status"] == "failed"
+    assert "Conflict" in results["app_1"]["error"]
+    assert sorted(recorded) == sorted(i.id for i in instances if i.id != "app_1")
+    assert len(changed) == 6
+    # Parallelism budget
+    assert 1 < in_progress[1] <= 2
+
+
+def test_roll_out_records_in_workflow_thread(monkeypatch, mockconfig):
+    import k8sclient
+    from k8splugin import workflows
+
+    monkeypatch.setattr(k8sclient, "wait_for_deployment", lambda *args, **kwargs: True)
+
+    # Like Cloudify's, the REST client can only be had in the thread with the workflow's context
+    workflow_thread = []
+    updated = {}
+    class FakeNodeInstances(object):
+        def get(self, node_instance_id):
+            return _Obj(runtime_properties={"replicas": 1}, version=1)
+        def update(self, node_instance_id, runtime_properties, version):
+            updated[node_instance_id] = runtime_properties
+    def fake_get_rest_client():
+        if threading.current_thread() not in workflow_thread:
+            raise RuntimeError("No context set in current execution thread")
+        return _Obj(node_instances=FakeNodeInstances())
+    monkeypatch.setattr(workflows, "get_rest_client", fake_get_rest_client)
+
+    results = {}
+    def workflow():
+        workflow_thread.append(threading.current_thread())
+        instances = workflows._select_instances(_nodes())
+        results.update(workflows._roll_out(instances, lambda description: {"replicas": 3}, {"replicas": 3},
+                                           2, 10, _Logger()))
+    t = threading.Thread(target=workflow)
+    t.start()
+    t.join(10)
+
+    assert dict((instance_id, result["status"]) for instance_id, result in results.items()) == \
+        {"collector_1": "ready", "collector_2": "ready", "app_1": "ready"}
+    assert updated == dict((instance_id, {"replicas": 3}) for instance_id in results)
@@ -23,7 +23,15 @@ try:
 except ImportError:
     from urlparse import urlparse
 import json
+import threading
 import consul
+import requests
+
+# Maximum number of keep-alive HTTP connections kept per Consul host
+CONSUL_POOL_SIZE = 10
+# Timeouts (secs) for connecting to Consul and for reading a response
+CONSUL_CONNECT_TIMEOUT = 5
+CONSUL_READ_TIMEOUT = 30
 
 
 class DiscoveryError(RuntimeError):
@@ -58,13 +66,42 @@ def _parse_host(host):
         return parse_urlparse_result(urlparse("http://{0}".format(host)))
 
 
+class _TimeoutSession(requests.Session):
+    """requests Session that applies a default timeout to every request"""
+
+    def __init__(self, timeout):
+        super(_TimeoutSession, self).__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super(_TimeoutSession, self).request(*args, **kwargs)
+
+
+# Process-wide cache of Consul clients, keyed by (hostname, port)
+_consul_clients = {}
+_consul_clients_lock = threading.Lock()
+
+
 def create_kv_conn(host):
     """Create connection to key-value store
 
-    Returns a Consul client to the specified Consul host
+    Returns a Consul client to the specified Consul host.  Clients are cached, so all
+    the connections to a host share one client and its pool of keep-alive HTTP connections.
     """
-    (hostname, port) = _parse_host(host)
-    return consul.Consul(host=hostname, port=port)
+    key = _parse_host(host)
+    with _consul_clients_lock:
+        conn = _consul_clients.get(key)
+        if conn is None:
+            (hostname, port) = key
+            conn = consul.Consul(host=hostname, port=port)
+            session = _TimeoutSession((CONSUL_CONNECT_TIMEOUT, CONSUL_READ_TIMEOUT))
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=CONSUL_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            conn.http.session = session
+            _consul_clients[key] = conn
+        return conn
 
 def store_relationship(kv_conn, source_name, target_name):
     # TODO: Rel entry may already exist in a one-to-many situation. Need to
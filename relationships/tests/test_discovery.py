@@ -37,3 +37,10 @@ def test_create_kv_conn_parse_host():
     with pytest.raises(dis.DiscoveryError):
         dis._parse_host(host)
 
+
+
+def test_create_kv_conn_cached():
+    conn = dis.create_kv_conn("some-consul.far.away")
+    assert conn is dis.create_kv_conn("some-consul.far.away:8500")
+    assert conn is not dis.create_kv_conn("some-consul.far.away:8080")
+    assert conn.http.session.timeout == (dis.CONSUL_CONNECT_TIMEOUT, dis.CONSUL_READ_TIMEOUT)